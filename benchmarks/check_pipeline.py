@@ -0,0 +1,63 @@
+import sys
+import tempfile
+import pandas as pd
+from cacoca.pipeline import Pipeline
+from cacoca.run import run
+from cacoca.batch import apply_overrides
+from cacoca.setup.read_input import read_config
+from cacoca.tools.results_store import read_results
+from cacoca.tools.tools import log
+
+
+# Regression check of the memoized pipeline (usage: python -m benchmarks.check_pipeline
+# [config files]): Each config is run once on a warm pipeline, then again with each of the
+# overrides below (if the config has their keys) on the same pipeline. Every warm result (return
+# value and stored results) has to equal that of run() with the same config.
+
+check_overrides = [
+    {},
+    {'scenarios_bidding.prices.Electricity': 'EU-Price-Cap'},
+    {'scenarios_actual.prices.Hydrogen': 'EU-Price-Cap'},
+    {'scenarios_actual.prices.Hydrogen': 'EU-Price-Cap',
+     'scenarios_bidding.prices.Hydrogen': 'EU-Price-Cap'},
+    {},
+]
+
+
+def check_pipeline(config_filepaths: list = ('config/config.yml', 'config/config_slides.yml')):
+    """ Raises an exception if a warm pipeline run differs from run() """
+
+    for config_filepath in config_filepaths:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = read_config(config_filepath) | {
+                'use_run_cache': False,
+                'save_figures': False,
+                'results_dir': tmp_dir,
+            }
+            pipeline = Pipeline()
+            pipeline.run(config=config)
+            for overrides in check_overrides:
+                if any(key.split('.')[0] not in config for key in overrides):
+                    continue
+                variant_config = apply_overrides(config, overrides)
+                warm, warm_stored = pipeline.run(config=variant_config), read_stored(tmp_dir)
+                cold, cold_stored = run(config=variant_config), read_stored(tmp_dir)
+                if isinstance(warm, tuple):
+                    warm, cold = warm[1], cold[1]
+                if isinstance(warm, pd.DataFrame):
+                    pd.testing.assert_frame_equal(warm, cold)
+                elif warm != cold:
+                    raise Exception(f"Pipeline result differs from run() for {config_filepath} "
+                                    f"with {overrides}: {warm} != {cold}")
+                for dataset in cold_stored:
+                    pd.testing.assert_frame_equal(warm_stored[dataset], cold_stored[dataset])
+                log(f"Pipeline equals run() for {config_filepath} with {overrides}")
+
+
+def read_stored(results_dir: str):
+    return {dataset: read_results(results_dir, dataset, mmap=False)
+            for dataset in ['yearly', 'aggregate', 'payout']}
+
+
+if __name__ == '__main__':
+    check_pipeline(*([sys.argv[1:]] if sys.argv[1:] else []))
@@ -0,0 +1,160 @@
+import copy
+import os
+import numpy as np
+import pandas as pd
+import yaml
+from cacoca.setup.read_input import read_config, techdata_filepaths, scenario_filepaths
+
+
+# Seeded generator of synthetic model inputs in the formats of the files in data/ and config/:
+# - techdata: n_tech_variants variants of each technology of the base projects file, with CAPEX,
+#   OPEX, demands and emissions scaled by random factors (for steel_dri including the -H2 and -NG
+#   technologies); The variants have the reference technology of the original.
+# - scenarios: n_scenarios variants of the price and H2 share scenarios, as random walks around
+#   the original scenarios.
+# - projects: n_projects projects with random technology, size, time of investment, etc.
+# The base config and its input files define the formats and the original data.
+
+
+def generate_inputs(output_dir: str, n_projects: int, n_scenarios: int = 100,
+                    n_tech_variants: int = 10, seed: int = 0,
+                    base_config_filepath: str = 'config/config.yml'):
+    """ Write synthetic input files and a config using them to output_dir; Returns the config path """
+
+    rng = np.random.default_rng(seed)
+    base_config = read_config(base_config_filepath)
+    base_projects = pd.read_csv(base_config['projects_file'])
+
+    techdata_dir = os.path.join(output_dir, 'tech')
+    scenarios_dir = os.path.join(output_dir, 'scenarios')
+    projects_file = os.path.join(output_dir, 'projects.csv')
+    for dirpath in [techdata_dir, scenarios_dir]:
+        os.makedirs(dirpath, exist_ok=True)
+
+    technologies = generate_techdata(base_config, base_projects, techdata_dir, n_tech_variants,
+                                     rng)
+    h2share_scenarios = generate_scenarios(base_config, scenarios_dir, n_scenarios, rng)
+    generate_projects(technologies, h2share_scenarios, n_projects, rng) \
+        .to_csv(projects_file, index=False)
+
+    config = copy.deepcopy(base_config) | {
+        'techdata_dir': techdata_dir,
+        'scenarios_dir': scenarios_dir,
+        'projects_file': projects_file,
+        'show_figures': False,
+        'save_figures': False,
+    }
+    # keep the share of chosen projects similar to the base config
+    budget_factor = n_projects / len(base_projects)
+    config['auction_rounds'] = [
+        config_ar | {'budget_BnEUR': config_ar['budget_BnEUR'] * budget_factor}
+        for config_ar in config['auction_rounds']
+    ]
+
+    config_filepath = os.path.join(output_dir, 'config.yml')
+    with open(config_filepath, 'w') as f:
+        yaml.dump(config, f, sort_keys=False, allow_unicode=True)
+    return config_filepath
+
+
+def generate_techdata(base_config: dict, base_projects: pd.DataFrame, techdata_dir: str,
+                      n_tech_variants: int, rng: np.random.Generator):
+    """ Write techdata files with variants of the technologies of the base projects """
+
+    base_technologies = base_projects \
+        .filter(['Technology', 'Industry']) \
+        .drop_duplicates()
+
+    filepaths = techdata_filepaths(base_config['techdata_dir'], base_config['techdata_files'])
+    *filepaths, reference_filepath = filepaths
+    reference_tech = pd.read_csv(reference_filepath)
+
+    technologies = [base_technologies]
+    new_references = []
+    for filename_base, filepath in zip(base_config['techdata_files'], filepaths):
+        techdata = pd.read_csv(filepath)
+        variants = []
+        for technology in base_technologies \
+                .query(f"Industry == '{filename_base}'")['Technology']:
+            # steel_dri projects use the -H2 and -NG technologies (see split_technology_names)
+            names = [technology, technology + '-H2', technology + '-NG']
+            tech_rows = techdata[techdata['Technology'].isin(names)]
+            for i_variant in range(1, n_tech_variants + 1):
+                variant = f"{technology} v{i_variant}"
+                factors = rng.lognormal(0., 0.1, size=len(tech_rows))
+                variants.append(tech_rows.assign(
+                    Technology=variant + tech_rows['Technology'].str[len(technology):],
+                    Value=pd.to_numeric(tech_rows['Value'], errors='coerce') * factors,
+                ))
+                technologies.append(pd.DataFrame({'Technology': [variant],
+                                                  'Industry': [filename_base]}))
+                new_references.append(
+                    reference_tech[reference_tech['Technology'] == technology]
+                    .assign(Technology=variant))
+        pd.concat([techdata] + variants) \
+            .to_csv(os.path.join(techdata_dir, filename_base + '.csv'), index=False)
+
+    pd.concat([reference_tech] + new_references) \
+        .to_csv(os.path.join(techdata_dir, os.path.basename(reference_filepath)), index=False)
+
+    return pd.concat(technologies, ignore_index=True)
+
+
+def generate_scenarios(base_config: dict, scenarios_dir: str, n_scenarios: int,
+                       rng: np.random.Generator):
+    """
+    Write scenario files with n_scenarios random variants of the price scenarios of each
+    component and of the H2 share scenarios; Returns the names of all H2 share scenarios.
+    """
+
+    co2prices, fuel_prices, h2share, free_allocations, standard_deviations = \
+        [pd.read_csv(fp) for fp in scenario_filepaths(base_config['scenarios_dir'])]
+
+    def add_variants(df: pd.DataFrame, group_by: list, step_std: float, upper: float = None):
+        year_columns = [c for c in df.columns if c.isdigit()]
+        variants = []
+        for _, group in df.groupby(group_by, sort=False) if group_by else [(None, df)]:
+            base_rows = group.iloc[np.arange(n_scenarios) % len(group)]
+            steps = rng.normal(0., step_std, size=(n_scenarios, len(year_columns)))
+            values = base_rows[year_columns].values * np.exp(np.cumsum(steps, axis=1))
+            if upper is not None:
+                values = np.minimum(values, upper)
+            variants.append(base_rows.assign(**dict(zip(year_columns, values.T))).assign(
+                Scenario=base_rows['Scenario'].values + [f" #{i}" for i in range(n_scenarios)]))
+        return pd.concat([df] + variants, ignore_index=True)
+
+    co2prices = add_variants(co2prices, [], 0.03)
+    fuel_prices = add_variants(fuel_prices, ['Component'], 0.03)
+    h2share = add_variants(h2share, [], 0.05, upper=1.)
+
+    for df, filepath in zip([co2prices, fuel_prices, h2share, free_allocations,
+                             standard_deviations],
+                            scenario_filepaths(scenarios_dir)):
+        df.to_csv(filepath, index=False)
+
+    return h2share['Scenario'].values
+
+
+def generate_projects(technologies: pd.DataFrame, h2share_scenarios: np.ndarray, n_projects: int,
+                      rng: np.random.Generator):
+    """ Random projects in the format of the projects file """
+
+    i_tech = rng.integers(len(technologies), size=n_projects)
+    size = np.round(np.clip(rng.lognormal(-0.7, 0.8, size=n_projects), 0.01, 5.), 3)
+    return pd.DataFrame({
+        'Project name': [f"Project {i}" for i in range(n_projects)],
+        'Active': 1,
+        'Industry': technologies['Industry'].values[i_tech],
+        'Technology': technologies['Technology'].values[i_tech],
+        'Project size/Production capacity [Mt/a] or GW': size,
+        'Planned production volume p.a.': size * rng.choice([1., 1., 1., 0.9, 0.8],
+                                                            size=n_projects),
+        'Max. full load hours': rng.choice([8760, 8760, 8760, 6000, 4000], size=n_projects),
+        'Technical lifetime': rng.choice([15, 20, 25], size=n_projects),
+        'Time of investment': rng.integers(2024, 2031, size=n_projects),
+        'Project duration [a]': 15,
+        'WACC': np.where(rng.random(n_projects) < 0.5, np.nan,
+                         np.round(rng.uniform(0.04, 0.1, size=n_projects), 3)),
+        'Share of high CAPEX': rng.choice([0., 0.3, 0.5, 0.7, 1.], size=n_projects),
+        'H2 Share Scenario': rng.choice(h2share_scenarios, size=n_projects),
+    })
@@ -0,0 +1,42 @@
+import plotly as pl
+import pandas as pd
+from cacoca.output.plot_tools import get_color
+
+
+def plot_scaling(results: pd.DataFrame, stage: str = 'run', show: bool = True,
+                 filepath: str = None):
+    """
+    Wall time and peak memory (of the whole run) against the number of projects, on log-log
+    axes, with one line per case and label (see read_benchmarks).
+    """
+
+    results = results \
+        .query(f"Stage == '{stage}'") \
+        .groupby(['Label', 'Case', 'Projects'], sort=False) \
+        .agg({'Wall time [s]': 'min', 'Peak memory [MB]': 'max'}) \
+        .reset_index()
+
+    fig = pl.subplots.make_subplots(rows=1, cols=2,
+                                    subplot_titles=['Wall time [s]', 'Peak memory [MB]'])
+    lines = results.filter(['Label', 'Case']).drop_duplicates()
+    for (_, line), color in zip(lines.iterrows(), get_color(list(range(len(lines))))):
+        df = results.query(f"Label == '{line['Label']}' and Case == '{line['Case']}'")
+        for i_col, variable in enumerate(['Wall time [s]', 'Peak memory [MB]']):
+            fig.add_trace(pl.graph_objs.Scatter(
+                x=df['Projects'],
+                y=df[variable],
+                mode='lines+markers',
+                line=dict(color=color),
+                name=f"{line['Case']} ({line['Label']})",
+                legendgroup=f"{line['Label']} {line['Case']}",
+                showlegend=(i_col == 0),
+            ), row=1, col=i_col + 1)
+
+    fig.update_xaxes(type='log', title='Number of projects')
+    fig.update_yaxes(type='log')
+
+    if show:
+        fig.show()
+    if filepath is not None:
+        fig.write_image(filepath)
+    return fig
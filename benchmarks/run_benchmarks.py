@@ -0,0 +1,175 @@
+import datetime
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from cacoca.setup.read_input import read_config
+from cacoca.tools.tools import log
+from benchmarks.generate import generate_inputs
+
+
+# Benchmark runner (usage: python -m benchmarks.run_benchmarks [benchmarks.yml] [label]):
+# For each size in the benchmark config, synthetic inputs are generated (once, see generate.py),
+# and run() is timed for each case in a fresh process, so that the peak memory of the process
+# belongs to this run only. Each run is profiled (see cacoca/tools/profiling.py), which gives
+# the summed wall time per calculation stage. The results are written to
+# <results_dir>/<label>.csv, with the label defaulting to the current git commit; Results of
+# different labels can be compared with compare_benchmarks and plotted with plot_scaling.
+
+sensitivity_parameters = [
+    {'is_relative': True, 'std_value': 0.1, 'data_frame': 'prices',
+     'filters': {'Component': 'Electricity'}},
+    {'is_relative': True, 'std_value': 0.1, 'data_frame': 'prices',
+     'filters': {'Component': 'Hydrogen'}},
+    {'is_relative': True, 'std_value': 0.1, 'data_frame': 'techdata',
+     'filters': {'Type': 'High CAPEX'}},
+]
+
+
+def run_benchmarks(bench_config_filepath: str = 'benchmarks/benchmarks.yml', label: str = None):
+    """ Run all cases for all sizes of the benchmark config; Returns the results """
+
+    bench_config = read_config(bench_config_filepath)
+    if label is None:
+        label = get_commit() or datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+
+    results = []
+    for n_projects in bench_config['sizes']:
+        config_filepath = get_inputs(bench_config, n_projects)
+        for case in bench_config['cases']:
+            for i_repeat in range(bench_config.get('repeat', 1)):
+                log(f"Benchmark {case} with {n_projects} projects ({i_repeat + 1})...")
+                result = measure_in_new_process(case, config_filepath)
+                results.append(result.assign(**{
+                    'Label': label,
+                    'Date': datetime.date.today().isoformat(),
+                    'Case': case,
+                    'Projects': n_projects,
+                    'Repeat': i_repeat,
+                }))
+
+    results = pd.concat(results, ignore_index=True) \
+        .filter(['Label', 'Date', 'Case', 'Projects', 'Repeat', 'Stage', 'Wall time [s]',
+                 'Peak memory [MB]'])
+    os.makedirs(bench_config['results_dir'], exist_ok=True)
+    results_filepath = os.path.join(bench_config['results_dir'], f"{label}.csv")
+    results.to_csv(results_filepath, index=False)
+    log(f"Benchmark results written to {results_filepath}")
+    return results
+
+
+def get_inputs(bench_config: dict, n_projects: int):
+    """ Path of the config of the synthetic inputs, which are generated if not present """
+    output_dir = os.path.join(
+        bench_config['data_dir'],
+        f"projects_{n_projects}_scenarios_{bench_config['n_scenarios']}"
+        f"_variants_{bench_config['n_tech_variants']}_seed_{bench_config['seed']}")
+    config_filepath = os.path.join(output_dir, 'config.yml')
+    if not os.path.isfile(config_filepath):
+        log(f"Generate inputs with {n_projects} projects...")
+        generate_inputs(output_dir, n_projects, n_scenarios=bench_config['n_scenarios'],
+                        n_tech_variants=bench_config['n_tech_variants'],
+                        seed=bench_config['seed'],
+                        base_config_filepath=bench_config['base_config'])
+    return config_filepath
+
+
+def measure_in_new_process(case: str, config_filepath: str):
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(measure_case, case, config_filepath).result()
+
+
+def measure_case(case: str, config_filepath: str):
+    """ Wall time and peak memory of run() and wall time per stage for one case """
+
+    from cacoca.run import run
+
+    config = read_config(config_filepath)
+    config = config | get_case_config(case) | {
+        'use_run_cache': False,
+        'profiling': {'report': os.path.join(os.path.dirname(config_filepath),
+                                             f"profile_{case}.json")},
+    }
+
+    memory_before = peak_memory()
+    start = time.perf_counter()
+    run(config=config)
+    wall_time = time.perf_counter() - start
+
+    stages = pd.read_json(config['profiling']['report']) \
+        .groupby('Stage', sort=False)['Wall time [s]'] \
+        .sum() \
+        .reset_index()
+    total = pd.DataFrame({
+        'Stage': ['run'],
+        'Wall time [s]': [wall_time],
+        'Peak memory [MB]': [peak_memory() - memory_before],
+    })
+    return pd.concat([total, stages], ignore_index=True)
+
+
+def get_case_config(case: str):
+    if case == 'auction':
+        return {'mode': 'auction'}
+    elif case == 'analyze_cost':
+        return {'mode': 'analyze_cost'}
+    elif case == 'sensitivities':
+        return {'mode': 'analyze_cost', 'uncertain_parameters': sensitivity_parameters}
+    raise KeyError(f"Invalid benchmark case: {case}; "
+                   f"Valid are: auction, analyze_cost, sensitivities")
+
+
+def peak_memory():
+    """ Peak resident memory of the process in MB (NaN where not available, e.g. Windows) """
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    # in kB on Linux, in bytes on macOS
+    scale = 1e-6 if sys.platform == 'darwin' else 1e-3
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_benchmarks(results_dir: str = 'benchmarks/results/', labels: list = None):
+    """ Results of all (or the given) labels in results_dir """
+    if labels is None:
+        labels = sorted(fn[:-len('.csv')] for fn in os.listdir(results_dir)
+                        if fn.endswith('.csv'))
+    return pd.concat([pd.read_csv(os.path.join(results_dir, f"{label}.csv"))
+                      for label in labels], ignore_index=True)
+
+
+def compare_benchmarks(results: pd.DataFrame, reference_label: str = None):
+    """
+    Fastest wall time of each case, size and stage per label (in columns), and the ratio of
+    each label to reference_label (default: the first label).
+    """
+    labels = list(pd.unique(results['Label']))
+    if reference_label is None:
+        reference_label = labels[0]
+    comparison = results \
+        .groupby(['Case', 'Projects', 'Stage', 'Label'], sort=False)['Wall time [s]'] \
+        .min() \
+        .unstack('Label') \
+        .filter(labels)
+    for label in labels:
+        if label != reference_label:
+            comparison[f"{label} / {reference_label}"] = \
+                comparison[label] / comparison[reference_label]
+    return comparison
+
+
+if __name__ == '__main__':
+    run_benchmarks(*sys.argv[1:])
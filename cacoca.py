@@ -1,6 +1,15 @@
 import sys
 from cacoca.run import run
+from cacoca.batch import run_batch
+from cacoca.service import serve
+from cacoca.setup.read_input import read_config
 
 
 config_filepath = sys.argv[1]
-run(config_filepath)
+config = read_config(config_filepath)
+if 'batch' in config:
+    run_batch(config=config)
+elif 'service' in config:
+    serve(config=config)
+else:
+    run(config=config)
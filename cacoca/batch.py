@@ -0,0 +1,143 @@
+import copy
+import itertools
+import os
+import time
+import traceback
+import pandas as pd
+from .setup.setup import Setup
+from .setup.read_input import read_config
+from .run import run_setup, streaming_defaults
+from .tools.parallel import imap_with_setup
+from .tools.results_store import clear_results, store_results
+from .tools.tools import log
+
+
+# Batch runs of variants of a base config (config key 'batch'):
+# Each variant is the base config with some values overridden. Variants are given as a list of
+# override dicts ('variants') and/or as a grid of values ('grid'), of which the cartesian product
+# is taken. Keys of nested values are joined by dots, e.g. 'scenarios_bidding.prices.Hydrogen';
+# List entries are given by their position, or by '*' for all entries, e.g.
+# 'auction_rounds.*.budget_BnEUR'.
+# The setup of the base config is read once and sent to the worker processes; Variants derive
+# their setup from it, so input files are only read again if a variant changes them (see
+# Setup.with_config). All variants write to one results store, partitioned by 'Variant' (the
+# position of the variant, as a string like all partition values). The dataset 'variants' holds
+# the overrides, status and wall time of each variant, and is appended to as soon as a variant is
+# finished. A failing variant is recorded as failed, and the others are continued.
+
+batch_defaults = {
+    'variants': [{}],
+    'grid': {},
+    'workers': 1,
+    'results_dir': 'output/batch/',
+}
+
+
+def run_batch(config_filepath: str = None, config: dict = None):
+    """
+    Runs all variants of the config on a pool of worker processes. Returns a data frame of the
+    variants (as the dataset 'variants'); Their results can be read with read_results from the
+    results directory of the batch.
+    """
+
+    if config_filepath is not None and config is None:
+        config = read_config(config_filepath)
+    elif config_filepath is not None or config is None:
+        raise Exception('Specify either config_filepath or config dict.')
+
+    batch_config = batch_defaults | config['batch']
+    base_config = {key: value for key, value in config.items() if key != 'batch'}
+    results_dir = batch_config['results_dir']
+
+    overrides = get_variant_overrides(batch_config)
+    items = [(i_variant, get_variant_config(base_config, variant_overrides, i_variant,
+                                            results_dir))
+             for i_variant, variant_overrides in enumerate(overrides)]
+
+    clear_results({'results_dir': results_dir})
+    setup = Setup(config=base_config)
+
+    log(f"Run {len(items)} variants on {batch_config['workers']} worker processes...")
+    variants = []
+    for i_done, (i_variant, status) in enumerate(
+            imap_with_setup(run_variant, setup, items, n_workers=batch_config['workers'])):
+        variant = pd.DataFrame([{'Variant': str(i_variant)}
+                                | {key: config_value_str(value)
+                                   for key, value in overrides[i_variant].items()}
+                                | status])
+        store_results({'results_dir': results_dir}, 'variants', variant)
+        variants.append(variant)
+        log(f"  Variant {i_variant} {status['Status']} after {status['Wall time [s]']:0.1f} s "
+            f"({i_done + 1}/{len(items)})")
+        if status['Status'] == 'failed':
+            log('    ' + status['Error'].strip().splitlines()[-1])
+
+    variants = pd.concat(variants, ignore_index=True) \
+        .sort_values('Variant', key=lambda variant: variant.astype(int)) \
+        .reset_index(drop=True)
+    n_failed = (variants['Status'] == 'failed').sum()
+    log(f"Batch finished: {len(variants) - n_failed} variants done, {n_failed} failed; "
+        f"Results in {results_dir}")
+    return variants
+
+
+def get_variant_overrides(batch_config: dict):
+    """ List of override dicts: Each variant combined with each point of the grid """
+    grid = batch_config['grid']
+    grid_points = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    return [variant | point for variant in batch_config['variants'] for point in grid_points]
+
+
+def get_variant_config(base_config: dict, overrides: dict, i_variant: int, results_dir: str):
+    config = apply_overrides(base_config, overrides)
+    config['results_dir'] = results_dir
+    config['results_partition'] = {'Variant': str(i_variant)}
+    if config.get('streaming') is not None:
+        stream_config = streaming_defaults | config['streaming']
+        config['streaming'] = stream_config | {
+            'output_dir': os.path.join(stream_config['output_dir'], f"Variant={i_variant}")}
+    return config
+
+
+def apply_overrides(config: dict, overrides: dict):
+    """ Copy of config with the values of overrides (by keys joined by dots, see above) set """
+    config = copy.deepcopy(config)
+    for key, value in overrides.items():
+        set_config_value(config, key.split('.'), value)
+    return config
+
+
+def set_config_value(config, keys: list, value):
+    key, *keys = keys
+    if isinstance(config, list):
+        positions = range(len(config)) if key == '*' else [int(key)]
+    else:
+        positions = [key]
+    for position in positions:
+        if keys:
+            set_config_value(config[position], keys, value)
+        else:
+            config[position] = copy.deepcopy(value)
+
+
+def config_value_str(value):
+    """ Overridden values in the variants table; Sub-dictionaries and lists as strings """
+    if isinstance(value, (dict, list)):
+        return str(value)
+    return value
+
+
+def run_variant(setup: Setup, item: tuple):
+    """ Run one variant; Returns its status, and the error traceback if it failed """
+    i_variant, config = item
+    start = time.perf_counter()
+    try:
+        run_setup(setup.with_config(config))
+        status, error = 'done', ''
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+    return {
+        'Status': status,
+        'Error': error,
+        'Wall time [s]': time.perf_counter() - start,
+    }
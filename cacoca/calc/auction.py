@@ -1,14 +1,24 @@
+import numpy as np
 import pandas as pd
 from ..setup.setup import Setup
+from .partitioned import calc_yearly
 from ..tools.tools import log
+from ..tools.profiling import profiled
 
 
+@profiled
 def auction(aggregate: pd.DataFrame, setup: Setup, config_ar: dict):
-    aggregate = aggregate.sort_values('score', ascending=False)
-    aggregate['budget_cumsum'] = aggregate['budget_cap'].cumsum()
+    """
+    Returns the list of chosen projects; If several input variants are evaluated at once,
+    the auction is cleared separately for each of them, and a dict {variant: list} is returned.
+    """
+    if 'Input variant' in aggregate.columns:
+        return {
+            i_variant: select_projects(agg_variant, config_ar)['Project name'].values.tolist()
+            for i_variant, agg_variant in aggregate.groupby('Input variant')
+        }
 
-    # select projects such that their combined budget does not exceed the budget cap
-    chosen_projects = aggregate[aggregate['budget_cumsum'] <= config_ar['budget_BnEUR'] * 1000.]
+    chosen_projects = select_projects(aggregate, config_ar)
 
     chosen_proj_list = chosen_projects['Project name'].values.tolist()
     n_chosen_proj = chosen_projects.shape[0]
@@ -21,29 +31,151 @@ def auction(aggregate: pd.DataFrame, setup: Setup, config_ar: dict):
     return chosen_proj_list
 
 
+def select_projects(aggregate: pd.DataFrame, config_ar: dict):
+    aggregate = aggregate.sort_values('score', ascending=False)
+    aggregate['budget_cumsum'] = aggregate['budget_cap'].cumsum()
+
+    # select projects such that their combined budget does not exceed the budget cap
+    return aggregate[aggregate['budget_cumsum'] <= config_ar['budget_BnEUR'] * 1000.]
+
+
+def filter_variant_projects(df: pd.DataFrame, variant_projects: dict, keep: bool = True):
+    """
+    Keep (or drop, if not keep) the rows of each input variant whose project is in the list
+    given for this variant in variant_projects.
+    """
+    pairs = pd.MultiIndex.from_arrays(
+        [
+            [i_variant for i_variant, projects in variant_projects.items() for _ in projects],
+            [p for projects in variant_projects.values() for p in projects],
+        ],
+        names=['Input variant', 'Project name']
+    )
+    rows = pd.MultiIndex.from_frame(df[['Input variant', 'Project name']]).isin(pairs)
+    return df[rows == keep]
+
+
+def summarize_auction_samples(results: pd.DataFrame, n_samples: int, quantiles: list):
+    """
+    Per-project selection probability and quantiles of budget cap and payout (which are zero in
+    samples where a project is not chosen), and totals per sample.
+    """
+    per_sample = results \
+        .pivot_table(index='Sample', columns='Project name', values=['budget_cap', 'Payout'],
+                     aggfunc='sum') \
+        .reindex(range(n_samples)) \
+        .fillna(0.)
+    project_quantiles = results \
+        .groupby('Project name') \
+        .agg(**{'Selection probability': ('Sample', 'nunique')})
+    project_quantiles['Selection probability'] /= n_samples
+    for vname in ['budget_cap', 'Payout']:
+        if vname not in per_sample.columns:
+            continue
+        values = per_sample[vname].quantile(quantiles)
+        for q in quantiles:
+            project_quantiles[f"{vname}_q{100. * q:g}"] = values.loc[q]
+
+    sample_totals = results \
+        .groupby('Sample') \
+        .agg(**{'budget_cap': ('budget_cap', 'sum'),
+                'Payout': ('Payout', 'sum'),
+                'Number of chosen projects': ('Project name', 'count')}) \
+        .reindex(range(n_samples), fill_value=0) \
+        .rename_axis('Sample')
+
+    return project_quantiles.reset_index(), sample_totals.reset_index()
+
+
 def prepare_setup_for_bidding(setup: Setup, all_chosen_projects: list, config_ar: dict):
-    """ Filtering of projects and selection of scenario data for bidding."""
+    """ Setup with filtered projects and scenario data for bidding."""
 
-    set_projects_ar(setup, all_chosen_projects, config_ar)
-    setup.select_scenario_data('scenarios_bidding')
-    setup.select_h2share(auction_year=config_ar['year'])
-    return
+    return setup \
+        .with_projects(get_projects_ar(setup, all_chosen_projects, config_ar)) \
+        .with_scenario_data('scenarios_bidding') \
+        .with_h2share(auction_year=config_ar['year'])
 
 
 def prepare_setup_for_payout(setup: Setup, chosen_projects: list, config_ar: dict):
-    setup.projects_current \
-        = setup.projects_all[setup.projects_all['Project name'].isin(chosen_projects)].copy()
-    setup.projects_current['Time of investment'] = config_ar['year'] + 3
-    setup.select_scenario_data(scenarios='scenarios_actual')
-    setup.select_h2share(auction_year=config_ar['year'])
-    return
+    """ Setup with the chosen projects and scenario data for the payout."""
+
+    return setup \
+        .with_projects(get_payout_projects(setup, chosen_projects, config_ar)) \
+        .with_scenario_data('scenarios_actual') \
+        .with_h2share(auction_year=config_ar['year'])
+
+
+@profiled
+def calc_yearly_cached(setup: Setup, cache: dict, keep_components: bool = False):
+    """
+    Cost, emissions and derived quantities of the current projects. Those of a project only
+    depend on its time of investment and h2 share scenario, and on the selected scenarios;
+    Results are therefore kept per project in cache, and only new or changed projects are
+    calculated. A cache is only valid for one config and one value of keep_components.
+    """
+
+    projects = setup.projects_current
+    if projects.empty:
+        # the empty result only depends on the selected scenarios
+        key = (None, setup.selected_scenarios)
+        if key not in cache:
+            cache[key] = calc_yearly(setup, keep_components=keep_components)
+        return cache[key].copy()
+
+    keys = [
+        (name, toi, h2share_scenario, setup.selected_scenarios)
+        for name, toi, h2share_scenario in zip(projects['Project name'],
+                                               projects['Time of investment'],
+                                               projects['H2 Share Scenario'])
+    ]
+
+    is_missing = [key not in cache for key in keys]
+    if any(is_missing):
+        yearly = calc_yearly(setup.with_projects(projects[is_missing]),
+                             keep_components=keep_components)
+        # the cache holds the whole result frame for each of its projects
+        for key, missing in zip(keys, is_missing):
+            if missing:
+                cache[key] = yearly
+
+    names_by_block = {}
+    for key in keys:
+        names_by_block.setdefault(id(cache[key]), (cache[key], []))[1].append(key[0])
+    yearly = pd.concat([
+        select_project_rows(block, names, cache) for block, names in names_by_block.values()
+    ])
+    return yearly.sort_values('Project name', kind='stable').reset_index(drop=True)
+
+
+def select_project_rows(df: pd.DataFrame, names: list, cache: dict):
+    """
+    Rows of df (in their order) which belong to the projects in names; For selections of few
+    projects from a large frame, the row positions of each project are looked up in an index,
+    which is built once per frame and kept in cache.
+    """
+    if len(names) > len(df) / 1000:
+        return df[df['Project name'].isin(names)]
+    key = ('positions', id(df))
+    if key not in cache:
+        # the frame is kept with its index, so that its id is not reused
+        cache[key] = (df, df.groupby('Project name', sort=False).indices)
+    positions = cache[key][1]
+    no_rows = np.array([], dtype=int)
+    return df.iloc[np.sort(np.concatenate([no_rows] + [positions.get(name, no_rows)
+                                                       for name in names]))]
+
+
+def get_payout_projects(setup: Setup, chosen_projects: list, config_ar: dict):
+    """ Chosen projects, with their start year set."""
+
+    return setup.projects_all[setup.projects_all['Project name'].isin(chosen_projects)] \
+        .assign(**{'Time of investment': config_ar['year'] + 3})
 
 
-def set_projects_ar(setup: Setup, all_chosen_projects: list, config_ar: dict):
-    """ Removes previously successful projects and sets their start year."""
+def get_projects_ar(setup: Setup, all_chosen_projects: list, config_ar: dict):
+    """ Projects without previously successful ones, with their start year set."""
 
-    setup.projects_current = setup.projects_all[
+    return setup.projects_all[
         ~setup.projects_all['Project name'].isin(all_chosen_projects)] \
-        .query(f"`Time of investment` - 3 <= {config_ar['year']}")
-    setup.projects_current['Time of investment'] = config_ar['year'] + 3
-    return
+        .query(f"`Time of investment` - 3 <= {config_ar['year']}") \
+        .assign(**{'Time of investment': config_ar['year'] + 3})
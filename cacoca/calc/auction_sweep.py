@@ -0,0 +1,218 @@
+import itertools
+import pandas as pd
+import numpy as np
+from ..setup.setup import Setup
+from .calc_derived_quantities import calc_payout
+from .partitioned import calc_yearly
+from .calc_auction_quantities import calc_strike_price, add_budget_cap_inputs, calc_delta_k, \
+    calc_yearly_budget_cap, calc_relative_emission_reduction, calc_rel_em_red_factor, \
+    calc_strike_price_factor
+from .auction import prepare_setup_for_bidding, prepare_setup_for_payout
+from ..tools.common_merges import merge_project_dfs, add_tech_and_industry
+
+
+# Cost, emissions, strike prices and relative emission reductions of the bidding projects do not
+# depend on the auction design parameters below; Only budget caps, scores and the auction itself
+# do. Bids are therefore computed once per auction round (for all projects which are still
+# bidding in any design point), and all design points are scored and cleared on arrays of shape
+# (design point x project). Payouts are computed once per round for all chosen projects.
+
+design_params = ['budget_cap_alpha', 'strike_price_a', 'rel_em_red_rr', 'rel_em_red_s',
+                 'budget_BnEUR']
+
+
+def sweep_auction_designs(setup: Setup, designs=None):
+    """
+    Run all auction rounds for each point of a grid of auction design parameters.
+    designs is either a dict {parameter: [values]}, of which the cartesian product is taken, or
+    a data frame with one row per design point (default: config key 'auction_design_sweep').
+    A given parameter value replaces the one of the config in all auction rounds.
+    Returns two data frames with the design parameters and the auction round in each row:
+    The chosen projects with their budget cap, score and payout, and per round the spent budget
+    cap, total payout and number of chosen projects.
+    """
+
+    if designs is None:
+        designs = setup.config['auction_design_sweep']
+    designs = get_design_points(designs)
+    n_designs = len(designs)
+
+    project_names = setup.projects_all['Project name'].values
+    all_chosen = np.zeros((n_designs, len(project_names)), dtype=bool)
+
+    chosen_projects = []
+    round_results = []
+
+    for config_ar_specific in setup.config['auction_rounds']:
+
+        config_ar = setup.config['auction_round_default'] | config_ar_specific
+        params = {
+            pname: designs[pname].values.astype(float) if pname in designs
+            else np.full(n_designs, config_ar[pname], dtype=float)
+            for pname in design_params
+        }
+
+        # projects chosen in all design points do not bid anymore, the others only in some
+        setup_bidding = prepare_setup_for_bidding(
+            setup, list(project_names[all_chosen.all(axis=0)]), config_ar)
+        alphas, i_alpha = np.unique(params['budget_cap_alpha'], return_inverse=True)
+        bids = calc_bids(setup_bidding, config_ar, alphas)
+
+        i_projects = pd.Index(project_names).get_indexer(bids['Project name'])
+        bidding = ~all_chosen[:, i_projects]
+
+        score = calc_scores(bids, params, bidding)
+        budget_cap = bids['budget_cap'][:, i_alpha].T
+        chosen = clear_auctions(score, budget_cap, bidding, params['budget_BnEUR'])
+        all_chosen[:, i_projects] |= chosen
+
+        payout = calc_project_payouts(setup, bids['Project name'][chosen.any(axis=0)], config_ar) \
+            .reindex(bids['Project name']).values
+
+        i_design, i_project = np.nonzero(chosen)
+        chosen_projects.append(pd.DataFrame({
+            'Design point': i_design,
+            'Auction round': config_ar['name'],
+            'Project name': bids['Project name'][i_project],
+            'budget_cap': budget_cap[i_design, i_project],
+            'score': score[i_design, i_project],
+            'Payout': payout[i_project],
+        }))
+        round_results.append(pd.DataFrame({
+            'Design point': np.arange(n_designs),
+            'Auction round': config_ar['name'],
+            'Spent budget': np.nansum(np.where(chosen, budget_cap, 0.), axis=1),
+            'Payout': np.nansum(np.where(chosen, payout[None, :], 0.), axis=1),
+            'Number of chosen projects': chosen.sum(axis=1),
+        }))
+
+    def with_designs(results: list):
+        return designs \
+            .rename_axis('Design point') \
+            .reset_index() \
+            .merge(pd.concat(results, ignore_index=True), how='right', on='Design point')
+
+    return with_designs(chosen_projects), with_designs(round_results)
+
+
+def get_design_points(designs):
+    if isinstance(designs, dict):
+        designs = pd.DataFrame(list(itertools.product(*designs.values())),
+                               columns=list(designs.keys()))
+    invalid = [pname for pname in designs.columns if pname not in design_params]
+    if invalid:
+        raise KeyError(f"Invalid auction design parameters: {', '.join(invalid)}; "
+                       f"Valid are: {', '.join(design_params)}")
+    return designs.reset_index(drop=True)
+
+
+def calc_bids(setup: Setup, config_ar: dict, alphas: np.ndarray):
+    """
+    Strike price, relative emission reduction and industry of all currently bidding projects
+    (sorted by name), and their budget cap for each value of alpha (project x alpha).
+    """
+
+    yearly = calc_yearly(setup)
+
+    strike_price = calc_strike_price(yearly, setup)
+    yearly = add_budget_cap_inputs(yearly, strike_price, setup, config_ar)
+
+    def column(name: str):
+        return yearly[name].values[:, None]
+
+    delta_k = calc_delta_k(alphas[None, :], column('Emissions_diff'), column('Energy cost'),
+                           column('Energy cost_ref'))
+    budget_cap = calc_yearly_budget_cap(column('Strike Price'), delta_k, column('min_co2_price'),
+                                        column('Emissions_diff'), column('Size'))
+
+    rel_em_red = calc_relative_emission_reduction(yearly, config_ar)
+    aggregate = add_tech_and_industry(merge_project_dfs(strike_price, rel_em_red), setup)
+
+    cap_aggregate = pd.DataFrame(budget_cap, index=yearly['Project name']) \
+        .groupby('Project name') \
+        .sum() \
+        .reindex(aggregate['Project name'])
+
+    return {
+        'Project name': aggregate['Project name'].values,
+        'Strike Price': aggregate['Strike Price'].values,
+        'rel_em_red': aggregate['rel_em_red'].values,
+        'Industry': aggregate['Industry'].values,
+        'budget_cap': cap_aggregate.values,
+    }
+
+
+def calc_scores(bids: dict, params: dict, bidding: np.ndarray):
+    """ Scores of shape (design point x project), as in calc_score. """
+
+    rel_em_red_fr = calc_rel_em_red_factor(bids['rel_em_red'][None, :],
+                                           params['rel_em_red_rr'][:, None],
+                                           params['rel_em_red_s'][:, None])
+    sp_hi, sp_hmax = get_highest_strike_prices(bids, bidding)
+    strike_price_pf = calc_strike_price_factor(bids['Strike Price'][None, :], sp_hi,
+                                               sp_hmax[:, None],
+                                               params['strike_price_a'][:, None])
+    return strike_price_pf * rel_em_red_fr
+
+
+def get_highest_strike_prices(bids: dict, bidding: np.ndarray):
+    """
+    Highest strike price among the bidding projects of the same industry (design point x
+    project), and the highest of these per design point.
+    """
+
+    strike_price = np.where(bidding, bids['Strike Price'][None, :], np.nan)
+    sp_hi = np.full(bidding.shape, np.nan)
+    sp_hmax = np.full(bidding.shape[0], -np.inf)
+
+    industries = bids['Industry']
+    for industry in pd.unique(industries[pd.notna(industries)]):
+        in_industry = industries == industry
+        # as groupby max: NaN strike prices are skipped; NaN if there is no other
+        sp_industry = np.max(np.where(in_industry & ~np.isnan(strike_price), strike_price,
+                                      -np.inf), axis=1)
+        sp_industry[sp_industry == -np.inf] = np.nan
+        sp_hi[:, in_industry] = sp_industry[:, None]
+        # as np.max over all industries with bids: NaN if any of them is NaN
+        has_bids = np.any(bidding[:, in_industry], axis=1)
+        sp_hmax = np.where(has_bids, np.maximum(sp_hmax, sp_industry), sp_hmax)
+
+    return sp_hi, sp_hmax
+
+
+def clear_auctions(score: np.ndarray, budget_cap: np.ndarray, bidding: np.ndarray,
+                   budget: np.ndarray):
+    """ Chosen projects (design point x project), as in auction. """
+
+    chosen = np.zeros(score.shape, dtype=bool)
+    for i_design in range(score.shape[0]):
+        i_bidding = np.flatnonzero(bidding[i_design])
+        order = i_bidding[sort_descending(score[i_design, i_bidding])]
+        budget_cumsum = nan_cumsum(budget_cap[i_design, order])
+        chosen[i_design, order[budget_cumsum <= budget[i_design] * 1000.]] = True
+    return chosen
+
+
+def sort_descending(values: np.ndarray):
+    """ Sort order of pandas sort_values(ascending=False), including the order of ties """
+    is_nan = np.isnan(values)
+    i_values = np.flatnonzero(~is_nan)[::-1]
+    order = i_values[values[i_values].argsort(kind='quicksort')][::-1]
+    return np.concatenate([order, np.flatnonzero(is_nan)])
+
+
+def nan_cumsum(values: np.ndarray):
+    """ Cumulative sum skipping NaN values, as pandas cumsum """
+    cumsum = np.nancumsum(values)
+    cumsum[np.isnan(values)] = np.nan
+    return cumsum
+
+
+def calc_project_payouts(setup: Setup, chosen_projects: np.ndarray, config_ar: dict):
+    """ Payout per project for all projects chosen in any design point """
+    if len(chosen_projects) == 0:
+        return pd.Series(dtype=float)
+    setup = prepare_setup_for_payout(setup, list(chosen_projects), config_ar)
+    cost_and_em_actual = calc_yearly(setup)
+    p_yearly, p_aggregate, payout_ar = calc_payout(cost_and_em_actual, setup)
+    return p_aggregate['Payout']
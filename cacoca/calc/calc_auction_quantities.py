@@ -1,16 +1,24 @@
 import pandas as pd
 import numpy as np
 from ..setup.setup import Setup
-from ..setup.select_scenario_data import select_prices
-from ..tools.common_merges import merge_project_dfs, add_tech_and_industry
+from ..tools.common_merges import merge_project_dfs, add_tech_and_industry, variant_keys
+from ..tools.profiling import profiled
 
 
+@profiled(max_growth=1)
 def calc_auction_quantities(yearly: pd.DataFrame, setup: Setup, auction_config: dict):
+    yearly, aggregate = calc_project_auction_quantities(yearly, setup, auction_config)
+    # the score is normalized across projects
+    aggregate = calc_score(aggregate, setup, auction_config)
+    return yearly, aggregate
+
+
+def calc_project_auction_quantities(yearly: pd.DataFrame, setup: Setup, auction_config: dict):
+    """ Strike price, budget cap and relative emission reduction, each only per project """
     strike_price = calc_strike_price(yearly, setup)
-    yearly, cap_aggregate = calc_budget_cap(yearly, strike_price, setup.prices_raw, auction_config)
+    yearly, cap_aggregate = calc_budget_cap(yearly, strike_price, setup, auction_config)
     rel_em_red = calc_relative_emission_reduction(yearly, auction_config)
     aggregate = merge_project_dfs(strike_price, cap_aggregate, rel_em_red)
-    aggregate = calc_score(aggregate, setup, auction_config)
     return yearly, aggregate
 
 
@@ -36,7 +44,7 @@ def calc_strike_price(yearly: pd.DataFrame, setup: Setup):
             **{'Emissions_NPV': lambda df:
                (df['CumInterest'] * df['Emissions_diff']) / df['Project duration [a]']}
         ) \
-        .groupby(['Project name']) \
+        .groupby(variant_keys(yearly) + ['Project name']) \
         .agg({'cost_NPV': 'sum', 'Emissions_NPV': 'sum'})
 
     # NPV(Cost_diff - SP*Emission_diff) = 0,
@@ -51,30 +59,42 @@ def calc_strike_price(yearly: pd.DataFrame, setup: Setup):
     return data
 
 
-def calc_budget_cap(yearly: pd.DataFrame, strike_price: pd.DataFrame, prices_raw: pd.DataFrame,
+def calc_budget_cap(yearly: pd.DataFrame, strike_price: pd.DataFrame, setup: Setup,
                     config_ar: dict):
-    alpha = config_ar['budget_cap_alpha']
+    yearly = add_budget_cap_inputs(yearly, strike_price, setup, config_ar)
+
+    yearly['delta_k'] = calc_delta_k(config_ar['budget_cap_alpha'], yearly['Emissions_diff'],
+                                     yearly['Energy cost'], yearly['Energy cost_ref'])
+    yearly['budget_cap'] = calc_yearly_budget_cap(yearly['Strike Price'], yearly['delta_k'],
+                                                  yearly['min_co2_price'],
+                                                  yearly['Emissions_diff'], yearly['Size'])
+
+    cap_aggregate = yearly \
+        .groupby(variant_keys(yearly) + ['Project name']) \
+        .agg({'budget_cap': 'sum'})
+
+    return yearly, cap_aggregate
+
+
+def add_budget_cap_inputs(yearly: pd.DataFrame, strike_price: pd.DataFrame, setup: Setup,
+                          config_ar: dict):
     scendict = {'prices': {'CO2': config_ar['budget_cap_co2_price_scen']}}
-    prices_co2 = select_prices(prices_raw, scendict)
+    prices_co2 = setup.get_selected_prices(scendict)
     prices_co2 = prices_co2 \
         .rename(columns={'Price': 'min_co2_price'}) \
         .filter(['Period', 'min_co2_price'])
 
-    yearly = yearly \
-        .merge(strike_price, how='left', on=['Project name']) \
+    return yearly \
+        .merge(strike_price, how='left', on=variant_keys(yearly) + ['Project name']) \
         .merge(prices_co2, how='left', on=['Period'])
 
-    yearly['delta_k'] = alpha / -yearly['Emissions_diff'] \
-        * (yearly['Energy cost'] + yearly['Energy cost_ref'] / (1. + alpha))
-    yearly['budget_cap'] \
-        = (yearly['Strike Price'] + yearly['delta_k'] - yearly['min_co2_price']) \
-        * -yearly['Emissions_diff'] * yearly['Size']
 
-    cap_aggregate = yearly \
-        .groupby(['Project name']) \
-        .agg({'budget_cap': 'sum'})
+def calc_delta_k(alpha, emissions_diff, energy_cost, energy_cost_ref):
+    return alpha / -emissions_diff * (energy_cost + energy_cost_ref / (1. + alpha))
 
-    return yearly, cap_aggregate
+
+def calc_yearly_budget_cap(strike_price, delta_k, min_co2_price, emissions_diff, size):
+    return (strike_price + delta_k - min_co2_price) * -emissions_diff * size
 
 
 def calc_relative_emission_reduction(yearly: pd.DataFrame, auction_config: dict):
@@ -82,30 +102,42 @@ def calc_relative_emission_reduction(yearly: pd.DataFrame, auction_config: dict)
     rel_em_red = yearly \
         .query(f"Period >= {auction_year + 3} & Period <= {auction_year + 7}") \
         .assign(**{'rel_em_red': lambda df: -df['Emissions_diff'] / df['Emissions_ref']}) \
-        .groupby(['Project name']) \
+        .groupby(variant_keys(yearly) + ['Project name']) \
         .agg({'rel_em_red': 'mean'})
     return rel_em_red
 
 
 def calc_score(aggregate: pd.DataFrame, setup: Setup, auction_config: dict):
 
-    s = auction_config['rel_em_red_s']
-    rr = auction_config['rel_em_red_rr']
-    aggregate['rel_em_red_fr'] = 1. + s * (aggregate['rel_em_red'] - rr)
-    aggregate['rel_em_red_fr'] = np.maximum(np.minimum(aggregate['rel_em_red_fr'], 1.2), 0.8)
+    aggregate['rel_em_red_fr'] = calc_rel_em_red_factor(aggregate['rel_em_red'],
+                                                        auction_config['rel_em_red_rr'],
+                                                        auction_config['rel_em_red_s'])
 
     aggregate = add_tech_and_industry(aggregate, setup) \
         .drop(columns=["Technology"])
+    keys = variant_keys(aggregate)
     sp_hi = aggregate \
-        .groupby('Industry') \
+        .groupby(keys + ['Industry']) \
         .agg({'Strike Price': 'max'}) \
         .rename(columns={'Strike Price': 'sp_hi'})
-    aggregate = aggregate.merge(sp_hi, how='left', on='Industry')
-    sp_hmax = np.max(sp_hi['sp_hi'].values)
-    sp_a = auction_config['strike_price_a']
-    aggregate['strike_price_pf'] = sp_a * (1. - aggregate['Strike Price'] / aggregate['sp_hi']) \
-        + (1. - sp_a) * (1. - aggregate['Strike Price'] / sp_hmax)
+    aggregate = aggregate.merge(sp_hi, how='left', on=keys + ['Industry'])
+    if keys:
+        sp_hmax = aggregate.groupby(keys)['sp_hi'].transform(lambda sp: np.max(sp.values))
+    else:
+        sp_hmax = np.max(sp_hi['sp_hi'].values)
+    aggregate['strike_price_pf'] = calc_strike_price_factor(aggregate['Strike Price'],
+                                                            aggregate['sp_hi'], sp_hmax,
+                                                            auction_config['strike_price_a'])
 
     aggregate['score'] = aggregate['strike_price_pf'] * aggregate['rel_em_red_fr']
 
     return aggregate
+
+
+def calc_rel_em_red_factor(rel_em_red, rr, s):
+    factor = 1. + s * (rel_em_red - rr)
+    return np.maximum(np.minimum(factor, 1.2), 0.8)
+
+
+def calc_strike_price_factor(strike_price, sp_hi, sp_hmax, sp_a):
+    return sp_a * (1. - strike_price / sp_hi) + (1. - sp_a) * (1. - strike_price / sp_hmax)
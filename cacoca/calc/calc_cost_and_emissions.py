@@ -2,17 +2,73 @@ import pandas as pd
 import numpy as np
 import numpy_financial as npf
 from ..setup.setup import Setup
-from ..tools.common_merges import add_tech_and_industry
+from ..tools.common_merges import add_tech_and_industry, variant_keys
+from ..tools.profiling import profiled
+from .calc_cost_and_emissions_array import calc_cost_and_emissions_array
 
 
+# Project properties which determine the specific (per unit of product) cost and emissions;
+# Projects with equal values only differ in size and are calculated only once.
+cost_signature = [
+    'Technology',
+    'Time of investment',
+    'H2 Share Scenario',
+    'Share of high CAPEX',
+    'WACC',
+    'Technical lifetime',
+    'Capacity per production volume',
+]
+
+
+@profiled
 def calc_cost_and_emissions(setup: Setup, keep_components: bool = False):
 
+    if setup.config.get('dedupe_projects', True):
+        representatives = get_cost_signature_representatives(setup.projects_current)
+        if representatives.nunique() < len(representatives):
+            setup_unique = setup.with_projects(setup.projects_current[
+                setup.projects_current['Project name'].isin(representatives)])
+            data_unique = calc_cost_and_emissions_unique(setup_unique, keep_components)
+            return broadcast_to_projects(data_unique, setup.projects_current, representatives)
+
+    return calc_cost_and_emissions_unique(setup, keep_components)
+
+
+def get_cost_signature_representatives(projects: pd.DataFrame):
+    """ For each project, the name of the first project with the same cost signature """
+    signature_ids = projects \
+        .assign(**{'Capacity per production volume': lambda df:
+                   df['Project size/Production capacity [Mt/a] or GW']
+                   / df['Planned production volume p.a.']}) \
+        .groupby(cost_signature, dropna=False, sort=False) \
+        .ngroup()
+    return projects['Project name'].groupby(signature_ids.values).transform('first')
+
+
+def broadcast_to_projects(data: pd.DataFrame, projects: pd.DataFrame,
+                          representatives: pd.Series):
+    """ Copy the results of each representative to all projects with the same signature """
+    return pd.DataFrame({'Project name': projects['Project name'].values,
+                         'Representative': representatives.values}) \
+        .sort_values('Project name') \
+        .merge(data.rename(columns={'Project name': 'Representative'}), on='Representative') \
+        .filter(data.columns) \
+        .sort_values(variant_keys(data) + ['Project name'], kind='stable') \
+        .reset_index(drop=True)
+
+
+def calc_cost_and_emissions_unique(setup: Setup, keep_components: bool = False):
+
     # three different operation modes
     data_old, data_new, data_ref = split_technology_names(setup)
 
-    data_new = calc_single_opmode(data_new, setup, keep_components)
-    data_old = calc_single_opmode(data_old, setup, keep_components)
-    data_ref = calc_single_opmode(data_ref, setup, keep_components)
+    if setup.config.get('calc_engine', 'pandas') == 'array':
+        return calc_cost_and_emissions_array(data_old, data_new, data_ref, setup, keep_components)
+
+    # all operation modes are stacked and calculated in one pass
+    data_opmodes = calc_operation_modes(
+        stack_operation_modes(data_old, data_new, data_ref), setup, keep_components)
+    data_old, data_new, data_ref = unstack_operation_modes(data_opmodes)
 
     # data old and new are combined vial fuel mix
     data_all, variables = merge_operation_modes(data_old, data_new, setup.h2share)
@@ -23,7 +79,7 @@ def calc_cost_and_emissions(setup: Setup, keep_components: bool = False):
 
     data_all = merge_with_reference(data_all, data_ref, variables)
 
-    data_all = add_co2_price(data_all, setup.prices)
+    data_all = add_co2_price(data_all.reset_index(), setup.prices)
 
     return data_all
 
@@ -61,22 +117,47 @@ def split_technology_names(setup: Setup):
     return data_old, data_new, data_ref
 
 
-def calc_single_opmode(data_in: pd.DataFrame, setup: Setup, keep_components: bool = False):
+def stack_operation_modes(data_old: pd.DataFrame, data_new: pd.DataFrame,
+                          data_ref: pd.DataFrame):
+    return pd.concat([
+        data.assign(**{'Operation mode': opmode})
+        for opmode, data in [('old', data_old), ('new', data_new), ('ref', data_ref)]
+    ], ignore_index=True)
+
+
+def unstack_operation_modes(data_opmodes: pd.DataFrame):
     """
-    Calc cost and emissions for one set of specific energy demands
+    Split stacked operation modes into frames indexed by project name and period;
+    New and reference are aligned to the rows of old.
+    """
+
+    def select(opmode: str):
+        return data_opmodes \
+            .loc[data_opmodes['Operation mode'] == opmode] \
+            .drop(columns=['Operation mode']) \
+            .set_index(['Project name', 'Period'])
+
+    data_old = select('old')
+    return data_old, select('new').reindex(data_old.index), select('ref').reindex(data_old.index)
+
+
+def calc_operation_modes(data_in: pd.DataFrame, setup: Setup, keep_components: bool = False):
+    """
+    Calc cost and emissions for stacked sets of specific energy demands (one per operation mode)
     """
 
     data_in = calc_capex(data_in, setup)
 
     yearly_data = expand_by_years(data_in, setup)
 
-    yearly_data = calc_cost_single_opmode(yearly_data, setup, keep_components)
+    yearly_data = calc_cost_operation_modes(yearly_data, setup, keep_components)
 
-    yearly_data = calc_emissions_single_opmode(yearly_data, setup)
+    yearly_data = calc_emissions_operation_modes(yearly_data, setup)
 
     return yearly_data
 
 
+@profiled(max_growth=1)
 def calc_capex(data_in: pd.DataFrame, setup: Setup):
 
     needed_project_info = [
@@ -95,13 +176,11 @@ def calc_capex(data_in: pd.DataFrame, setup: Setup):
         )
 
     def single_tech_param(name: str):
-        return setup.techdata.query(f"Type=='{name}'") \
-            .filter(["Technology", "Value"]) \
-            .rename(columns={"Value": name})
+        return lambda df: df['Technology'].map(setup.techdata_index[name])
 
     data_in = data_in \
-        .merge(single_tech_param('High CAPEX'), how='left', on='Technology') \
-        .merge(single_tech_param('Low CAPEX'), how='left', on='Technology') \
+        .assign(**{'High CAPEX': single_tech_param('High CAPEX'),
+                   'Low CAPEX': single_tech_param('Low CAPEX')}) \
         .assign(
             **{'CAPEX total': lambda df:
                 df['Share of high CAPEX'] * df['High CAPEX'].fillna(0.).astype(float)
@@ -128,55 +207,65 @@ def calc_capex(data_in: pd.DataFrame, setup: Setup):
     return data_in
 
 
+@profiled
 def expand_by_years(data_in: pd.DataFrame, setup: Setup):
+    """
+    Expand projects by calendar years of operation within the study horizon;
+    Only these rows are generated, by repeating each row once per year of operation.
+    """
+
+    time_of_investment = data_in['Project name'] \
+        .map(setup.projects_current.set_index('Project name')['Time of investment']) \
+        .values.astype(float)
+    years = setup.all_years['Period'].values
+
+    # NaN times of investment yield no years of operation
+    first_year = np.maximum(time_of_investment, years[0])
+    last_year = np.minimum(time_of_investment + setup.config['ccfd_duration'], years[-1])
+    n_years = np.nan_to_num(last_year - first_year + 1., nan=0.).clip(min=0.).astype(int)
+
+    i_rows = np.repeat(np.arange(len(data_in)), n_years)
+    offsets = np.arange(len(i_rows)) - np.repeat(np.cumsum(n_years) - n_years, n_years)
 
-    # expand projects by calendar years of operation
-    data_in = data_in \
-        .merge(
-            setup.projects_current.filter(['Project name', 'Time of investment']),
-            how='left',
-            on=['Project name']
-        ) \
-        .merge(
-            setup.all_years,
-            how='cross'
-        )
     yearly_data = data_in \
-        .query("Period >= `Time of investment` &"
-               + f" Period <= `Time of investment` + {setup.config['ccfd_duration']}") \
-        .drop(columns=['Time of investment'])
+        .iloc[i_rows] \
+        .assign(Period=(first_year[i_rows] + offsets).astype(years.dtype)) \
+        .reset_index(drop=True)
     return yearly_data
 
 
-def calc_cost_single_opmode(yearly_data: pd.DataFrame, setup: Setup, keep_components: bool = False):
+@profiled
+def calc_cost_operation_modes(yearly_data: pd.DataFrame, setup: Setup,
+                              keep_components: bool = False):
     """
-    Calc yearly cost for one set of specific energy demands
+    Calc yearly cost for stacked sets of specific energy demands;
+    Energy and feedstock cost are calculated once per technology and period.
     """
 
-    columns_keep = np.setdiff1d(yearly_data.columns, ['Project name', 'Period'])
+    keys = ['Operation mode', 'Project name', 'Period']
+    tech_keys = ['Technology', 'Period']
+    columns_keep = np.setdiff1d(yearly_data.columns, keys)
 
     # expand by unique list of all occuring components of energy demand
-    materials_in = setup.techdata \
-        .query("Type=='Energy demand' | Type=='Feedstock demand'") \
-        .filter(["Component"]) \
-        .drop_duplicates()
-    yearly_data = yearly_data.merge(materials_in, how='cross')
+    materials_in = pd.DataFrame({'Component': setup.techdata_index['Components']})
+    tech_cost = yearly_data \
+        .filter(tech_keys) \
+        .drop_duplicates() \
+        .merge(materials_in, how='cross')
 
     # get specific energy demand from techdata, accessed by technology and component
     # This is done after expanding by year to later enable time-dependent eneryg demands
-    yearly_data = yearly_data \
+    tech_cost = tech_cost \
         .merge(
-            setup.techdata
-            .query("Type=='Energy demand' | Type=='Feedstock demand'")
-            .filter(["Technology", "Type", "Component", "Value"]),
+            setup.techdata_index['Demand'],
             how='left',
             on=['Technology', 'Component']
         ) \
         .rename(columns={"Value": "Material demand"})
-    yearly_data["Material demand"].fillna(0., inplace=True)
+    tech_cost["Material demand"].fillna(0., inplace=True)
 
     # add prices to df and calculate cost = en.demand * price
-    yearly_data = yearly_data \
+    tech_cost = tech_cost \
         .merge(
             setup.prices.drop(columns=["Source Reference", "Unit"]),
             how='left',
@@ -185,43 +274,44 @@ def calc_cost_single_opmode(yearly_data: pd.DataFrame, setup: Setup, keep_compon
         .assign(**{'cost': lambda df: df['Material demand'] * df['Price']})
 
     if keep_components:
-        component_cost = yearly_data \
-            .pivot_table(values='cost', index=['Project name', 'Period'], columns='Component') \
+        component_cost = tech_cost \
+            .pivot_table(values='cost', index=tech_keys, columns='Component') \
             .rename(columns=lambda cn: 'cost_' + cn) \
             .reset_index()
 
-    yearly_data = yearly_data \
-        .groupby(['Project name', 'Period', 'Type'], as_index=False) \
-        .agg({'cost': 'sum'} | {cname: 'first' for cname in columns_keep})
+    tech_cost = tech_cost \
+        .groupby(tech_keys + ['Type'], as_index=False) \
+        .agg({'cost': 'sum'})
 
-    energy_cost = yearly_data \
+    energy_cost = tech_cost \
         .query("Type=='Energy demand'") \
-        .filter(['Project name', 'Period', 'cost']) \
+        .filter(tech_keys + ['cost']) \
         .rename(columns={'cost': 'Energy cost'})
 
+    tech_cost = tech_cost \
+        .groupby(tech_keys, as_index=False) \
+        .agg({'cost': 'sum'}) \
+        .merge(energy_cost, how='left', on=tech_keys)
+
+    # technologies without any demand data are dropped, as by the groupby above
     yearly_data = yearly_data \
-        .groupby(['Project name', 'Period'], as_index=False) \
-        .agg({'cost': 'sum'} | {cname: 'first' for cname in columns_keep}) \
-        .merge(energy_cost, how='left', on=['Project name', 'Period'])
+        .merge(tech_cost, how='inner', on=tech_keys) \
+        .filter(keys + ['cost'] + list(columns_keep) + ['Energy cost']) \
+        .sort_values(keys) \
+        .reset_index(drop=True)
 
     if keep_components:
         yearly_data = yearly_data \
             .merge(
                 component_cost,
                 how='left',
-                on=['Project name', 'Period']
+                on=tech_keys
             )
 
     # add additional OPEX and CAPEX
     yearly_data = yearly_data \
-        .merge(
-            setup.techdata
-            .query("Type=='OPEX'")
-            .filter(["Technology", "Value"]),
-            how='left',
-            on=['Technology']
-        ) \
-        .rename(columns={"Value": "Additional OPEX"})
+        .assign(**{'Additional OPEX':
+                   lambda df: df['Technology'].map(setup.techdata_index['OPEX'])})
     yearly_data["Additional OPEX"].fillna(0., inplace=True)
     return yearly_data
 
@@ -234,21 +324,15 @@ def calc_cost_wit_capex(yearly_data: pd.DataFrame):
     return yearly_data
 
 
-def calc_emissions_single_opmode(yearly_data: pd.DataFrame, setup: Setup):
+@profiled
+def calc_emissions_operation_modes(yearly_data: pd.DataFrame, setup: Setup):
     """
-    Calc emission prices for one set of specific energy demands
+    Calc emission prices for stacked sets of specific energy demands
     """
 
     # Add emissions to df
     yearly_data = yearly_data \
-        .merge(
-            setup.techdata
-            .query("Type=='Emissions' & Component == 'CO2'")
-            .filter(["Technology", "Value"]),
-            how='left',
-            on=['Technology']
-        ) \
-        .rename(columns={"Value": "Emissions"})
+        .assign(Emissions=lambda df: df['Technology'].map(setup.techdata_index['Emissions']))
 
     # add free allocations to df
     yearly_data = yearly_data \
@@ -263,64 +347,52 @@ def calc_emissions_single_opmode(yearly_data: pd.DataFrame, setup: Setup):
     return yearly_data
 
 
+@profiled(max_growth=1)
 def merge_operation_modes(data_old: pd.DataFrame, data_new: pd.DataFrame, h2share: pd.DataFrame):
+    """ Blend old and new operation mode (with aligned index) by H2 Share """
 
     variables = np.setdiff1d(
         np.intersect1d(data_old.columns, data_new.columns),
-        ['Project name', 'Period', 'Technology']
+        ['Technology']
     )
 
-    # merge old and new dataframes
-    # (CAPEX is not blended, but 100 % new technology, therefore dropped in old df)
-    data_all = data_old \
-        .drop(columns=['CAPEX annuity']) \
-        .merge(
-            data_new.drop(columns=['Technology']),
-            how='left',
-            on=['Project name', 'Period']
-        ) \
-        .merge(
-            h2share,
-            how='left',
-            on=['Project name', 'Period']
-        )
+    h2share = h2share \
+        .set_index(['Project name', 'Period'])['H2 Share'] \
+        .reindex(data_old.index)
+
+    # CAPEX is not blended, but 100 % new technology
+    data_all = {
+        'Technology': data_old['Technology'],
+        'CAPEX annuity': data_new['CAPEX annuity'],
+    }
 
     # blend cost and emissions of old and new operation mode to overall cost
     for vname in variables:
         if vname == 'CAPEX annuity':
             continue
-        data_all = data_all \
-            .assign(**{vname: lambda df:
-                       (1. - df['H2 Share']) * df[vname + '_x']
-                       + df['H2 Share'] * df[vname + '_y']})
-        data_all = data_all.drop(columns=[vname + '_x', vname + '_y'])
+        data_all[vname] = (1. - h2share) * data_old[vname] + h2share * data_new[vname]
 
-    data_all = data_all \
-        .drop(columns=['H2 Share'])
-
-    return data_all, variables
+    return pd.DataFrame(data_all, index=data_old.index), variables
 
 
+@profiled(max_growth=1)
 def merge_with_reference(data_all: pd.DataFrame, data_ref: pd.DataFrame, variables: list):
+    """ Add reference (with aligned index) variables and the differences to them """
 
     # add '_ref' to reference varable names
     data_ref = data_ref \
-        .rename(columns={v: v + '_ref' for v in variables}) \
-        .drop(columns=['Technology'])
-    # merge and calculate difference for all variables in input list
-    data_all = data_all \
-        .merge(
-            data_ref,
-            how='left',
-            on=['Project name', 'Period']
-        )
-    for vname in variables:
-        data_all = data_all \
-            .assign(**{vname + '_diff': lambda df: df[vname] - df[vname + '_ref']})
+        .drop(columns=['Technology']) \
+        .rename(columns=lambda vname: vname + '_ref')
+    # calculate difference for all variables in input list
+    data_diff = pd.DataFrame({
+        vname + '_diff': data_all[vname] - data_ref[vname + '_ref']
+        for vname in variables
+    }, index=data_all.index)
 
-    return data_all
+    return pd.concat([data_all, data_ref, data_diff], axis=1)
 
 
+@profiled(max_growth=1)
 def add_co2_price(yearly_data: pd.DataFrame, prices: pd.DataFrame):
     co2prices = prices \
         .query("Component == 'CO2'") \
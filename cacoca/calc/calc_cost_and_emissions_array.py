@@ -0,0 +1,358 @@
+import pandas as pd
+import numpy as np
+import numpy_financial as npf
+from ..setup.setup import Setup
+from ..setup.techdata_index import take_positions
+from ..tools.profiling import profiled
+
+
+# Array-backed engine for calc_cost_and_emissions, selected by `calc_engine: 'array'` in the
+# config. Instead of cross-merging projects with years and components, all quantities are held
+# as dense arrays of shape (input variant x project x year of operation), and component-resolved
+# quantities as (input variant x component x project x year of operation). The steps mirror
+# those of the pandas engine, and the result is converted to the same output DataFrame at the
+# very end.
+# Input variants are sets of prices and techdata; Normally, there is only the one of the setup,
+# but several (e.g. disturbed inputs for sensitivities) can be evaluated at once by setting
+# setup.input_variants. The output then has an additional column 'Input variant'.
+
+
+@profiled
+def calc_cost_and_emissions_array(data_old: pd.DataFrame, data_new: pd.DataFrame,
+                                  data_ref: pd.DataFrame, setup: Setup,
+                                  keep_components: bool = False):
+
+    projects = get_project_arrays(setup)
+    variants = get_input_variants(setup)
+    price_tables = get_price_tables(variants, setup)
+    components = get_active_components(setup.techdata_index, price_tables[0], projects)
+
+    opmodes = {}
+    for opmode, data in [('old', data_old), ('new', data_new), ('ref', data_ref)]:
+        technologies = get_technologies(data, projects)
+        opmodes[opmode] = calc_single_opmode_array(
+            technologies, projects, variants, price_tables, components, setup, keep_components)
+
+    h2share = lookup_by_period(setup.h2share, 'Project name', 'H2 Share',
+                               projects['Project name'], projects, setup)
+
+    data_all, variables = merge_operation_modes_array(opmodes['old'], opmodes['new'], h2share)
+
+    data_all = calc_cost_wit_capex_array(data_all)
+    data_ref = calc_cost_wit_capex_array(opmodes['ref'])
+
+    data_all = merge_with_reference_array(data_all, data_ref, variables)
+
+    data_all = add_co2_price_array(data_all, price_tables, projects)
+
+    return arrays_to_frame(data_all, projects, with_variants=setup.input_variants is not None)
+
+
+def get_input_variants(setup: Setup):
+    if setup.input_variants is not None:
+        return setup.input_variants
+    return [input_variant(setup)]
+
+
+def input_variant(setup: Setup):
+    """ The inputs of the cost calculation which can vary between input variants. """
+    return {'prices': setup.prices, 'techdata_index': setup.techdata_index}
+
+
+def get_project_arrays(setup: Setup):
+    """
+    Projects sorted by name (as in the output of the pandas engine), and for each of them the
+    calendar years of operation within the study horizon.
+    """
+    projects = setup.projects_current.sort_values('Project name')
+
+    years = setup.all_years['Period'].values
+    operation_years = np.arange(setup.config['ccfd_duration'] + 1)
+    period = projects['Time of investment'].values[:, None] + operation_years[None, :]
+
+    return {
+        'Project name': projects['Project name'].values,
+        'data': projects,
+        'Period': period,
+        'year_index': period - years[0],
+        'valid': (period >= years[0]) & (period <= years[-1]),
+    }
+
+
+def get_price_table(prices: pd.DataFrame, setup: Setup):
+    """ Component x calendar year price table over the study horizon. """
+    return prices \
+        .drop_duplicates(['Component', 'Period']) \
+        .pivot(index='Component', columns='Period', values='Price') \
+        .reindex(columns=setup.all_years['Period'].values)
+
+
+def get_price_tables(variants: list, setup: Setup):
+    """
+    Price tables of all input variants; Prices given in the same rows as those of the first
+    variant (e.g. disturbed samples) are filled into its table positions instead of pivoting.
+    """
+    first = variants[0]['prices']
+    if len(variants) == 1:
+        return [get_price_table(first, setup)]
+
+    positions = get_price_table(first.assign(Price=np.arange(len(first), dtype=float)), setup)
+
+    def has_same_rows(prices: pd.DataFrame):
+        return len(prices) == len(first) \
+            and np.array_equal(prices['Component'].values, first['Component'].values) \
+            and np.array_equal(prices['Period'].values, first['Period'].values)
+
+    return [
+        pd.DataFrame(take_positions(positions.values, v['prices']['Price'].values),
+                     index=positions.index, columns=positions.columns)
+        if has_same_rows(v['prices']) else get_price_table(v['prices'], setup)
+        for v in variants
+    ]
+
+
+def get_active_components(tech_tables: dict, prices: pd.DataFrame, projects: dict):
+    """
+    All components of energy and feedstock demand (as in the pandas engine, the unique list
+    over all technologies), and the subset which has a price in any period of operation.
+    """
+    components = tech_tables['Components']
+    price_matrix = gather_by_period(
+        prices.reindex(index=components).values[:, None, :], projects)
+    has_price = np.any(~np.isnan(price_matrix) & projects['valid'][None, :, :], axis=(1, 2))
+    return {
+        'all': components,
+        'priced': components[has_price],
+    }
+
+
+def gather_by_period(table: np.ndarray, projects: dict):
+    """
+    Turn an array with calendar years as last axis (..., year) into an array of shape
+    (..., project, year of operation), with NaN outside of the study horizon.
+    """
+    year_index = np.clip(projects['year_index'], 0, table.shape[-1] - 1)
+    gathered = np.take_along_axis(
+        np.broadcast_to(table, table.shape[:-2] + (year_index.shape[0], table.shape[-1])),
+        np.broadcast_to(year_index, table.shape[:-2] + year_index.shape),
+        axis=-1
+    )
+    return np.where(projects['valid'], gathered, np.nan)
+
+
+def lookup_by_period(df: pd.DataFrame, key: str, value: str, keys: np.ndarray,
+                     projects: dict, setup: Setup):
+    """
+    Look up a time-dependent quantity given in long format (key, 'Period', value) for each
+    project, where `keys` is the key value per project.
+    """
+    table = df \
+        .drop_duplicates([key, 'Period']) \
+        .pivot(index=key, columns='Period', values=value) \
+        .reindex(index=keys, columns=setup.all_years['Period'].values) \
+        .values
+    return gather_by_period(table, projects)
+
+
+def get_technologies(data: pd.DataFrame, projects: dict):
+    """ Technology of each project in the order of the project arrays. """
+    return data \
+        .set_index('Project name') \
+        .reindex(projects['Project name'])['Technology'] \
+        .values
+
+
+def get_demand_array(tech_tables: dict, dtype: str, technologies: np.ndarray, components: dict):
+    """ Specific demand of given type, shape (component x project x 1). """
+    return np.nan_to_num(lookup_demand(tech_tables, dtype, technologies, components), nan=0.)
+
+
+def lookup_demand(tech_tables: dict, dtype: str, technologies: np.ndarray, components: dict):
+    return tech_tables[dtype] \
+        .reindex(index=technologies, columns=components['all']) \
+        .values.T[:, :, None]
+
+
+def lookup_tech_param(tech_tables: dict, name: str, technologies: np.ndarray):
+    return tech_tables[name].reindex(technologies).values
+
+
+def get_price_array(price_tables: list, components: pd.Index, projects: dict):
+    """ Prices of shape (input variant x component x project x year of operation). """
+    table = np.stack([pt.reindex(index=components).values for pt in price_tables])
+    return gather_by_period(table[:, :, None, :], projects)
+
+
+def stack_variants(lookup, variants: list, fill_value: float = np.nan):
+    """
+    Evaluate lookup for the techdata index of each input variant and stack the results, where
+    missing values are replaced by fill_value. If the techdata indices of all variants were
+    filled into the same positions (see techdata_index.py), the lookup is done only once.
+    """
+    tech_tables = [v['techdata_index'] for v in variants]
+    positions = tech_tables[0].get('Positions')
+    if positions is not None and all(tt.get('Positions') is positions for tt in tech_tables):
+        values = take_positions(lookup(positions), np.stack([tt['Values'] for tt in tech_tables]))
+    else:
+        looked_up = {}
+        for tt in tech_tables:
+            if id(tt) not in looked_up:
+                looked_up[id(tt)] = lookup(tt)
+        values = np.stack([looked_up[id(tt)] for tt in tech_tables])
+    return np.where(np.isnan(values), fill_value, values)
+
+
+def per_project(values: np.ndarray, projects: dict):
+    """ Broadcast a value per project (and input variant) to all years of operation. """
+    values = values.astype(float)
+    return np.broadcast_to(values[..., None], values.shape + projects['Period'].shape[-1:])
+
+
+def calc_single_opmode_array(technologies: np.ndarray, projects: dict, variants: list,
+                             price_tables: list, components: dict, setup: Setup,
+                             keep_components: bool = False):
+    """
+    Calc cost and emissions for one set of specific energy demands;
+    Variables are kept in the column order of the pandas engine.
+    """
+
+    data = {}
+
+    capex = calc_capex_from_params(
+        stack_variants(lambda tt: lookup_tech_param(tt, 'High CAPEX', technologies), variants, 0.),
+        stack_variants(lambda tt: lookup_tech_param(tt, 'Low CAPEX', technologies), variants, 0.),
+        projects)
+
+    energy_demand = stack_variants(
+        lambda tt: lookup_demand(tt, 'Energy demand', technologies, components), variants, 0.)
+    feedstock_demand = stack_variants(
+        lambda tt: lookup_demand(tt, 'Feedstock demand', technologies, components), variants, 0.)
+    price_matrix = get_price_array(price_tables, components['all'], projects)
+    # summing over components skips missing prices, as pandas groupby sums do
+    component_cost = (energy_demand + feedstock_demand) * price_matrix
+    has_energy = np.isin(technologies, setup.techdata_index['Energy demand'].index)
+
+    data['cost'] = np.nansum(component_cost, axis=1)
+    data['CAPEX annuity'] = per_project(capex['CAPEX annuity'], projects)
+    data['CAPEX total'] = per_project(capex['CAPEX total'], projects)
+    data['Technology'] = technologies
+    data['Energy cost'] = np.where(
+        has_energy[:, None], np.nansum(energy_demand * price_matrix, axis=1), np.nan)
+
+    if keep_components:
+        for i_comp, component in enumerate(components['all']):
+            if component in components['priced']:
+                data['cost_' + component] = component_cost[:, i_comp]
+
+    data['Additional OPEX'] = per_project(
+        stack_variants(lambda tt: lookup_tech_param(tt, 'OPEX', technologies), variants, 0.),
+        projects)
+
+    data['Emissions'] = per_project(
+        stack_variants(lambda tt: lookup_tech_param(tt, 'Emissions', technologies), variants),
+        projects)
+
+    free_allocations = lookup_by_period(setup.free_allocations, 'Technology', 'Free Allocations',
+                                        technologies, projects, setup)
+    data['Free Allocations'] = np.broadcast_to(
+        np.nan_to_num(free_allocations, nan=0.), data['cost'].shape)
+
+    return data
+
+
+def calc_capex_array(technologies: np.ndarray, projects: dict, tech_tables: dict):
+
+    def single_tech_param(name: str):
+        return np.nan_to_num(lookup_tech_param(tech_tables, name, technologies), nan=0.)
+
+    return calc_capex_from_params(single_tech_param('High CAPEX'), single_tech_param('Low CAPEX'),
+                                  projects)
+
+
+def calc_capex_from_params(capex_high: np.ndarray, capex_low: np.ndarray, projects: dict):
+    """ CAPEX per project (and input variant, if the parameters have that leading axis). """
+
+    pdata = projects['data']
+
+    share_high = pdata['Share of high CAPEX'].values
+    capex_total = share_high * capex_high + (1. - share_high) * capex_low
+
+    # NB: npf.pmt already divides by lifetime to get cost per t of product
+    capex_annuity = npf.pmt(pdata['WACC'].values, pdata['Technical lifetime'].values,
+                            -capex_total) \
+        * pdata['Project size/Production capacity [Mt/a] or GW'].values \
+        / pdata['Planned production volume p.a.'].values
+
+    return {'CAPEX total': capex_total, 'CAPEX annuity': capex_annuity}
+
+
+def calc_cost_wit_capex_array(data: dict):
+    data = data.copy()
+    data['cost'] = data['cost'] + data['Additional OPEX'] + data['CAPEX annuity']
+    return data
+
+
+def merge_operation_modes_array(data_old: dict, data_new: dict, h2share: np.ndarray):
+
+    variables = sorted(
+        (set(data_old) & set(data_new)) - {'Project name', 'Period', 'Technology'}
+    )
+
+    # CAPEX is not blended, but 100 % new technology
+    data_all = {
+        'Technology': data_old['Technology'],
+        'CAPEX annuity': data_new['CAPEX annuity'],
+    }
+
+    # blend cost and emissions of old and new operation mode to overall cost
+    for vname in variables:
+        if vname == 'CAPEX annuity':
+            continue
+        data_all[vname] = (1. - h2share) * data_old[vname] + h2share * data_new[vname]
+
+    return data_all, variables
+
+
+def merge_with_reference_array(data_all: dict, data_ref: dict, variables: list):
+
+    data_all = data_all.copy()
+    for vname, values in data_ref.items():
+        if vname == 'Technology':
+            continue
+        data_all[vname + '_ref'] = values
+    for vname in variables:
+        data_all[vname + '_diff'] = data_all[vname] - data_all[vname + '_ref']
+
+    return data_all
+
+
+def add_co2_price_array(data: dict, price_tables: list, projects: dict):
+    data = data.copy()
+    data['CO2 Price'] = get_price_array(price_tables, pd.Index(['CO2']), projects)[:, 0]
+    return data
+
+
+def arrays_to_frame(data: dict, projects: dict, with_variants: bool = False):
+    """
+    Flatten (input variant x project x year of operation) arrays to the long output format;
+    Input variants are stacked and numbered in the column 'Input variant' if with_variants.
+    """
+
+    valid = projects['valid']
+    n_years = valid.shape[1]
+    n_variants = data['cost'].shape[0]
+
+    columns = {
+        'Project name': np.tile(np.repeat(projects['Project name'], n_years)[valid.ravel()],
+                                n_variants),
+        'Period': np.tile(projects['Period'][valid], n_variants),
+    }
+    for vname, values in data.items():
+        if values.ndim == 1:
+            columns[vname] = np.tile(np.repeat(values, n_years)[valid.ravel()], n_variants)
+        else:
+            columns[vname] = values[:, valid].ravel()
+    if with_variants:
+        columns['Input variant'] = np.repeat(np.arange(n_variants), int(valid.sum()))
+
+    return pd.DataFrame(columns)
@@ -1,9 +1,11 @@
 import pandas as pd
 import numpy as np
 from ..setup.setup import Setup
-from ..tools.common_merges import merge_project_dfs
+from ..tools.common_merges import merge_project_dfs, variant_keys
+from ..tools.profiling import profiled
 
 
+@profiled(max_growth=1)
 def calc_derived_quantities(cost_and_em: pd.DataFrame, setup: Setup):
     yearly = add_size(cost_and_em, setup)
     yearly = add_effective_co2_price(yearly)
@@ -30,15 +32,12 @@ def add_effective_co2_price(cost_and_em: pd.DataFrame):
 
 def add_abatement_cost(cost_and_em: pd.DataFrame, setup: Setup):
     cost_and_em = cost_and_em \
-        .merge(
-            setup.techdata.filter(['Technology', 'Industry']).drop_duplicates(),
-            how='left',
-            on=['Technology']
-        ) \
+        .assign(Industry=lambda df: df['Technology'].map(setup.techdata_index['Industry'])) \
         .assign(**{'Abatement_cost': lambda df: df["cost_diff"] / -df['Emissions_diff']})
     return cost_and_em
 
 
+@profiled
 def calc_payout(cost_and_em: pd.DataFrame, setup: Setup):
     # caution: payout is still yearly.
     payout_yearly = cost_and_em \
@@ -52,7 +51,7 @@ def calc_payout(cost_and_em: pd.DataFrame, setup: Setup):
                 df["Difference Price"] * -df["Emissions_diff"] * df["Size"]}
         )
     payout_aggregate = payout_yearly \
-        .groupby('Project name') \
+        .groupby(variant_keys(payout_yearly) + ['Project name']) \
         .agg({'Payout': 'sum'})
     payout_sum = np.sum(payout_yearly['Payout'].values)
     return payout_yearly, payout_aggregate, payout_sum
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from ..setup.setup import Setup
+from ..tools.common_merges import add_tech_and_industry, variant_keys
+from ..tools.parallel import map_with_setup, available_workers
+from ..tools.profiling import profiled
+from .calc_cost_and_emissions import calc_cost_and_emissions
+from .calc_derived_quantities import calc_derived_quantities
+
+
+# Cost, emissions and derived quantities of a project do not depend on any other project. They
+# are therefore calculated for partitions of the current projects on a pool of worker processes
+# (config key 'workers') and concatenated. Partitions are formed along industries, so that
+# projects with the same technologies (and cost signatures, see calc_cost_and_emissions) are
+# calculated together. Steps across projects, i.e. the score normalization per industry and the
+# budget cumsum of the auction, are carried out on the concatenated results afterwards.
+
+
+@profiled
+def calc_yearly(setup: Setup, keep_components: bool = False):
+    """ Cost, emissions and derived quantities of the current projects """
+
+    n_workers = available_workers(setup.config.get('workers', 1))
+    partitions = get_partitions(setup, n_workers)
+    if len(partitions) <= 1:
+        return calc_yearly_partition(setup, (None, keep_components))
+
+    yearly = map_with_setup(calc_yearly_partition, setup,
+                            [(project_names, keep_components) for project_names in partitions],
+                            n_workers=n_workers)
+    yearly = pd.concat(yearly, ignore_index=True)
+    # same row order as without partitions
+    return yearly \
+        .sort_values(variant_keys(yearly) + ['Project name'], kind='stable') \
+        .reset_index(drop=True)
+
+
+def get_partitions(setup: Setup, n_partitions: int):
+    """ Project names of up to n_partitions partitions of about equal size, ordered by industry """
+    project_names = add_tech_and_industry(
+        setup.projects_current.filter(['Project name', 'Technology']), setup) \
+        .sort_values('Industry', kind='stable')['Project name'] \
+        .values
+    return [list(names) for names in np.array_split(project_names, max(n_partitions, 1))
+            if len(names)]
+
+
+def calc_yearly_partition(setup: Setup, partition: tuple):
+    """ Calc cost, emissions and derived quantities for one partition (all projects if None) """
+
+    project_names, keep_components = partition
+    if project_names is not None:
+        setup = setup.with_projects(setup.projects_current[
+            setup.projects_current['Project name'].isin(project_names)])
+
+    cost_and_em = calc_cost_and_emissions(setup, keep_components=keep_components)
+    return calc_derived_quantities(cost_and_em, setup)
@@ -0,0 +1,198 @@
+import itertools
+import pandas as pd
+import numpy as np
+from ..setup.setup import Setup
+from .calc_cost_and_emissions import split_technology_names
+from .calc_cost_and_emissions_array import get_project_arrays, get_price_table, gather_by_period, \
+    lookup_by_period, get_technologies, get_demand_array, calc_capex_array
+
+
+# Cost is linear in prices: For the blended operation modes minus the reference,
+#   cost_diff = (price-independent part) + sum_c demand_diff_c * price_c,
+# where demand_diff_c = (1 - H2 Share) * demand_old_c + H2 Share * demand_new_c - demand_ref_c.
+# The demand trajectories are therefore computed only once, and the cost for all combinations of
+# price scenarios follows from a single matrix product.
+
+
+def sweep_prices(setup: Setup, price_alternatives: dict = None,
+                 scenarios: dict = 'scenarios_actual'):
+    """
+    Calculate cost_diff, Abatement_cost and Effective CO2 Price for the cartesian product of the
+    price scenarios in price_alternatives ({component: [scenario names]}; default: config key
+    'price_sweep'). Prices of all other components are chosen according to scenarios.
+    Returns a long data frame with one row per price scenario combination, project and period;
+    The scenario chosen for each swept component is given in a column named by the component.
+    """
+
+    if price_alternatives is None:
+        price_alternatives = setup.config['price_sweep']
+    if isinstance(scenarios, str):
+        scenarios = setup.config[scenarios]
+
+    setup = setup.with_scenario_data(scenarios).with_h2share()
+
+    projects = get_project_arrays(setup)
+    linear = calc_linear_decomposition(setup, projects)
+
+    combinations = pd.DataFrame(
+        list(itertools.product(*price_alternatives.values())),
+        columns=list(price_alternatives.keys())
+    )
+
+    contributions, selection = get_price_contributions(
+        setup, projects, linear, price_alternatives, combinations)
+
+    n_comb = len(combinations)
+    cost_diff = linear['cost_fixed_diff'][None, :, :] \
+        + (selection @ contributions.reshape(contributions.shape[0], -1)) \
+        .reshape((n_comb,) + projects['Period'].shape)
+
+    co2_price = get_co2_price(setup, projects, price_alternatives, combinations)
+
+    emissions_diff = linear['Emissions_diff'][None, :, :]
+    free_allocations_diff = linear['Free Allocations_diff'][None, :, :]
+    yearly = {
+        'cost_diff': cost_diff,
+        'Emissions_diff': np.broadcast_to(emissions_diff, cost_diff.shape),
+        'CO2 Price': np.broadcast_to(co2_price, cost_diff.shape),
+        'Effective CO2 Price': co2_price * (emissions_diff - free_allocations_diff)
+        / emissions_diff,
+        'Abatement_cost': cost_diff / -emissions_diff,
+    }
+
+    return sweep_arrays_to_frame(yearly, combinations, projects, linear['Industry'])
+
+
+def calc_linear_decomposition(setup: Setup, projects: dict):
+    """
+    Demand differences (component x project x year of operation) to the reference and all
+    price-independent parts of cost and emission differences (project x year of operation).
+    """
+
+    tech_tables = setup.techdata_index
+    components = {'all': tech_tables['Components']}
+
+    data_old, data_new, data_ref = split_technology_names(setup)
+
+    h2share = lookup_by_period(setup.h2share, 'Project name', 'H2 Share',
+                               projects['Project name'], projects, setup)
+    weights = {'old': 1. - h2share, 'new': h2share, 'ref': -np.ones_like(h2share)}
+
+    linear = {
+        'demand_diff': 0.,
+        'cost_fixed_diff': 0.,
+        'Emissions_diff': 0.,
+        'Free Allocations_diff': 0.,
+    }
+    for opmode, data in [('old', data_old), ('new', data_new), ('ref', data_ref)]:
+        technologies = get_technologies(data, projects)
+        weight = weights[opmode]
+
+        demand = get_demand_array(tech_tables, 'Energy demand', technologies, components) \
+            + get_demand_array(tech_tables, 'Feedstock demand', technologies, components)
+        opex = tech_tables['OPEX'].reindex(technologies).fillna(0.).values[:, None]
+        emissions = tech_tables['Emissions'].reindex(technologies).values[:, None]
+        free_allocations = lookup_by_period(setup.free_allocations, 'Technology',
+                                            'Free Allocations', technologies, projects, setup)
+
+        linear['demand_diff'] = linear['demand_diff'] + weight[None, :, :] * demand
+        linear['cost_fixed_diff'] = linear['cost_fixed_diff'] + weight * opex
+        linear['Emissions_diff'] = linear['Emissions_diff'] + weight * emissions
+        linear['Free Allocations_diff'] = linear['Free Allocations_diff'] \
+            + weight * np.nan_to_num(free_allocations, nan=0.)
+
+        # CAPEX is not blended, but 100 % new technology
+        if opmode != 'old':
+            capex_annuity = calc_capex_array(technologies, projects, tech_tables)['CAPEX annuity']
+            sign = -1. if opmode == 'ref' else 1.
+            linear['cost_fixed_diff'] = linear['cost_fixed_diff'] + sign * capex_annuity[:, None]
+
+        if opmode == 'old':
+            linear['Industry'] = tech_tables['Industry'].reindex(technologies).values
+
+    linear['Components'] = components['all']
+
+    return linear
+
+
+def get_price_contributions(setup: Setup, projects: dict, linear: dict, price_alternatives: dict,
+                            combinations: pd.DataFrame):
+    """
+    Cost contributions (contribution x project x year of operation), where the first
+    contribution is the one of all components with fixed price scenarios, followed by one for
+    each price alternative; And the matrix selecting contributions for each combination.
+    """
+
+    components = list(linear['Components'])
+    demand_diff = linear['demand_diff']
+
+    def cost_contribution(component: str, prices: pd.DataFrame):
+        if component not in components:
+            return np.zeros(projects['Period'].shape)
+        price = gather_by_period(
+            get_price_table(prices, setup).reindex(index=[component]).values[:, None, :],
+            projects)[0]
+        # missing prices are skipped, as in the sums over components in the cost calculation
+        return demand_diff[components.index(component)] * np.nan_to_num(price, nan=0.)
+
+    fixed = [c for c in components if c not in price_alternatives]
+    contributions = [
+        sum(cost_contribution(c, setup.prices) for c in fixed) + np.zeros(projects['Period'].shape)
+    ]
+    selection = [np.ones(len(combinations))]
+
+    for component, alternatives in price_alternatives.items():
+        for alternative in alternatives:
+            prices = get_alternative_prices(setup, component, alternative)
+            contributions.append(cost_contribution(component, prices))
+            selection.append((combinations[component] == alternative).values.astype(float))
+
+    return np.stack(contributions), np.stack(selection, axis=1)
+
+
+def get_alternative_prices(setup: Setup, component: str, scenario: str):
+    prices = setup.get_selected_prices({'prices': {component: scenario}})
+    if prices.empty:
+        raise KeyError(f"Price scenario '{scenario}' not found for component '{component}'")
+    return prices
+
+
+def get_co2_price(setup: Setup, projects: dict, price_alternatives: dict,
+                  combinations: pd.DataFrame):
+    """ CO2 price of shape (combination x project x year of operation). """
+
+    def co2_price(prices: pd.DataFrame):
+        return gather_by_period(
+            get_price_table(prices, setup).reindex(index=['CO2']).values[:, None, :], projects)
+
+    if 'CO2' not in price_alternatives:
+        return co2_price(setup.prices)
+
+    alternatives = price_alternatives['CO2']
+    co2_prices = np.concatenate([
+        co2_price(get_alternative_prices(setup, 'CO2', alternative))
+        for alternative in alternatives
+    ])
+    return co2_prices[[alternatives.index(a) for a in combinations['CO2']]]
+
+
+def sweep_arrays_to_frame(yearly: dict, combinations: pd.DataFrame, projects: dict,
+                          industries: np.ndarray):
+
+    valid = projects['valid']
+    n_comb = len(combinations)
+    n_rows = int(valid.sum())
+    n_years = valid.shape[1]
+
+    columns = {
+        cname: pd.Categorical(np.repeat(values.values, n_rows))
+        for cname, values in combinations.items()
+    }
+    columns['Project name'] = np.tile(
+        np.repeat(projects['Project name'], n_years)[valid.ravel()], n_comb)
+    columns['Period'] = np.tile(projects['Period'][valid], n_comb)
+    columns['Industry'] = np.tile(np.repeat(industries, n_years)[valid.ravel()], n_comb)
+    for vname, values in yearly.items():
+        columns[vname] = values[:, valid].ravel()
+
+    return pd.DataFrame(columns)
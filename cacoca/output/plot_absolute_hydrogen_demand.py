@@ -1,17 +1,17 @@
 import plotly as pl
 import pandas as pd
 import numpy as np
-from .plot_tools import add_color, show_and_save, set_yrange_min_zero
+from .plot_tools import add_color, show_and_save, set_yrange_min_zero, get_projects
 from .plot_tools import display_name as dn, to_rgba
 from ..setup.setup import Setup
-from ..tools.tools import filter_df
 
 
-def plot_absolute_hydrogen_demand(projects: pd.DataFrame,
+def plot_absolute_hydrogen_demand(projects: pd.DataFrame | str,
                                   setup: Setup,
-                                  project_names: list):
+                                  project_names: list,
+                                  partition: dict = None):
 
-    projects = filter_df(projects, filter_by={'Project name': project_names})
+    projects = get_projects(projects, {'Project name': project_names}, partition)
 
     fig = pl.graph_objs.Figure()
 
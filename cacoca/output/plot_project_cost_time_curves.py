@@ -1,18 +1,17 @@
 import plotly as pl
 import pandas as pd
-from .plot_tools import add_color, show_and_save, set_yrange_min_zero
+from .plot_tools import add_color, show_and_save, set_yrange_min_zero, get_projects
 from .plot_tools import display_name as dn, to_rgba
-from ..tools.tools import filter_df
 
 
-def plot_project_cost_time_curves(projects: pd.DataFrame,
+def plot_project_cost_time_curves(projects: pd.DataFrame | str,
                                   config: dict,
                                   color_by: str = 'Project name',
                                   print_name: str = None,
                                   one_per_color: bool = False,
                                   **filter_by: dict):
 
-    projects = filter_df(projects, filter_by=filter_by)
+    projects = get_projects(projects, filter_by)
 
     fig = pl.graph_objs.Figure()
 
@@ -2,7 +2,7 @@ import os
 import plotly as pl
 import pandas as pd
 import numpy as np
-from .plot_tools import show_and_save
+from .plot_tools import show_and_save, get_projects
 from .plot_tools import display_name as dn
 
 
@@ -29,16 +29,17 @@ colors = {
     'Electricity': '#F1C40F',
 }
 
-def plot_stacked_bars_multi(projects: pd.DataFrame, config: dict, project_names: list[str],
+def plot_stacked_bars_multi(projects: pd.DataFrame | str, config: dict, project_names: list[str],
                       project_ref: str = None, cost_per: str = 'product',
-                      emission_diff: bool = False, export_csv: bool = False, csv_dir: str = None):
+                      emission_diff: bool = False, export_csv: bool = False, csv_dir: str = None,
+                      partition: dict = None):
     """
     Plot stacked bar charts for multiple projects and a single reference.
     
     Parameters:
     -----------
-    projects : pd.DataFrame
-        DataFrame containing project data
+    projects : pd.DataFrame or str
+        DataFrame containing project data, or the directory of a results store
     config : dict
         Configuration dictionary
     project_names : list[str]
@@ -54,6 +55,8 @@ def plot_stacked_bars_multi(projects: pd.DataFrame, config: dict, project_names:
         If True, export the data used for plotting to a CSV file.
     csv_dir : str
         Directory to save the CSV file if export_csv is True. If None, saves to current directory.
+    partition : dict
+        Partition of a results store to plot, e.g. {'Auction round': ...} (see get_projects)
     """
     if cost_per == 'product':
         yunit = '€/t Produkt'
@@ -69,7 +72,7 @@ def plot_stacked_bars_multi(projects: pd.DataFrame, config: dict, project_names:
     if project_ref is not None and project_ref not in all_projects:
         all_projects.append(project_ref)
 
-    projects = projects[projects['Project name'].isin(all_projects)].copy()
+    projects = get_projects(projects, {'Project name': all_projects}, partition).copy()
 
     years = [2025, 2030, 2035, 2040, 2045]
     years = np.intersect1d(years, projects['Period'].values)
@@ -308,8 +311,9 @@ def plot_stacked_bars_multi(projects: pd.DataFrame, config: dict, project_names:
         filename += f'_ref_{project_ref}'
     show_and_save(fig, config, filename)
 
-def plot_stacked_bars(projects: pd.DataFrame, config: dict, project_name: str,
-                      cost_per: str = 'product', emission_diff: bool = False, export_csv: bool = False, csv_dir: str = None):
+def plot_stacked_bars(projects: pd.DataFrame | str, config: dict, project_name: str,
+                      cost_per: str = 'product', emission_diff: bool = False, export_csv: bool = False, csv_dir: str = None,
+                      partition: dict = None):
 
     if cost_per == 'product':
         yunit = '€/t Produkt'
@@ -320,7 +324,7 @@ def plot_stacked_bars(projects: pd.DataFrame, config: dict, project_name: str,
     else:
         raise Exception(f'Invalid parameter cost_per={cost_per}')
 
-    projects = projects.query(f"`Project name` == '{project_name}'")
+    projects = get_projects(projects, {'Project name': [project_name]}, partition)
 
     years = [2025, 2030, 2035, 2040, 2045]
     years = np.intersect1d(years, projects['Period'].values)
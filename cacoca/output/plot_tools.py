@@ -1,6 +1,29 @@
 import plotly as pl
 import pandas as pd
 import os
+from ..tools.tools import filter_df
+from ..tools.results_store import read_results, partition_keys
+
+
+def get_projects(projects: pd.DataFrame | str, filter_by: dict, partition: dict = None):
+    """
+    Filtered yearly project data; projects can also be the directory of a results store (see
+    results_store.py), from which only the selected rows are read. Of a store, only one partition
+    may be read, which is selected by partition and filter_by: 'Scenarios' defaults to 'actual',
+    and e.g. 'Auction round' or 'Variant' have to be given if there are several.
+    """
+    if isinstance(projects, str):
+        keys = partition_keys(projects, 'yearly')
+        filter_by = ({'Scenarios': 'actual'} if 'Scenarios' in keys else {}) \
+            | (partition or {}) | filter_by
+        df = read_results(projects, 'yearly', **filter_by)
+        combinations = df.filter(keys).drop_duplicates()
+        if keys and len(combinations) > 1:
+            raise Exception(
+                f"Results of several partitions match, which would be plotted together; Select "
+                f"one by {', '.join(keys)}:\n{combinations.to_string(index=False)}")
+        return df
+    return filter_df(projects, filter_by=filter_by)
 
 
 # define colors to use
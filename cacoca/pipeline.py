@@ -0,0 +1,420 @@
+import collections
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from .setup.setup import Setup, with_filter_by
+from .setup.read_input import read_config, input_filepaths
+from .setup.input_cache import input_cache_dir, content_hash
+from .setup.select_scenario_data import select_prices, select_free_allocations, \
+    select_h2share, scenario_key
+from .calc.partitioned import calc_yearly
+from .calc.calc_auction_quantities import calc_auction_quantities
+from .calc.calc_derived_quantities import calc_payout
+from .calc.auction import auction, get_projects_ar, get_payout_projects, select_project_rows
+from .run import run_setup, calc_analyze
+from .tools.parallel import run_pool
+from .tools.sensitivities import keeps_jacobian
+from .tools.results_store import clear_results, store_results
+from .tools.tools import log
+
+
+# Pipeline of memoized stages for repeated runs in one session, e.g. in notebooks
+# (usage: run_pipeline instead of run):
+# Each stage is a function of the setup, with declared inputs: config values (passed to it by
+# their config keys, joined by dots), raw frames of the setup, and the outputs of upstream
+# stages. A stage is only executed again if one of its inputs changed; Inputs are compared by
+# content (frames by a hash of their values, upstream outputs by the keys of the stages).
+# Stages with project_columns are evaluated per project: A project is only calculated again if
+# its values in these columns or its rows in per-project upstream outputs changed. E.g. if only
+# scenarios_actual.prices.Hydrogen changes, the h2 share is not selected again; If only the WACC
+# of one project changes, only this project is calculated again.
+# Streaming and Monte Carlo auction runs are passed to run_setup without memoization, and
+# sensitivity_keep_jacobian is not supported.
+# The memo is bounded (see Pipeline.evict): After each run, the outputs of the least recently
+# used stage keys beyond 'pipeline_cache_stages' are removed, and per-project stages keep the
+# outputs of at most 'pipeline_cache_project_versions' times the number of projects.
+
+pipeline_cache_defaults = {
+    'pipeline_cache_stages': 64,
+    'pipeline_cache_project_versions': 2,
+}
+
+calc_config = {
+    'ccfd_duration': 'ccfd_duration',
+    'calc_engine': 'calc_engine',
+    'dedupe_projects': 'dedupe_projects',
+    'study_horizon': 'study_horizon',
+}
+sensitivity_config = {
+    'uncertain_parameters': 'uncertain_parameters',
+    'sensitivity_mode': 'sensitivity_mode',
+    'monte_carlo': 'monte_carlo',
+}
+calc_frames = ['techdata', 'reference_tech']
+h2share_columns = ['H2 Share Scenario', 'Time of investment']
+
+
+class Stage():
+    """
+    A step of the pipeline, func(setup, **config values, **upstream outputs), and its inputs:
+    - config: {argument name: config key}
+    - frames: names of setup attributes read by func
+    - upstream: {argument name: stage name}
+    - project_columns: if given, func is evaluated per project, with the columns of the projects
+      it depends on ('all' for all), and has to return frames with a column 'Project name'
+    """
+
+    def __init__(self, func: callable, config: dict = None, frames: list = None,
+                 upstream: dict = None, project_columns=None):
+        self.func = func
+        self.config = config or {}
+        self.frames = frames or []
+        self.upstream = upstream or {}
+        self.project_columns = project_columns
+
+    @property
+    def is_per_project(self):
+        return self.project_columns is not None
+
+
+def select_stage_prices(setup: Setup, prices: dict):
+    return select_prices(setup.prices_raw, {'prices': prices})
+
+
+def select_stage_free_allocations(setup: Setup, free_allocations: str):
+    return select_free_allocations(setup.free_allocations_raw,
+                                   {'free_allocations': free_allocations})
+
+
+def select_stage_h2share(setup: Setup):
+    return select_h2share(setup.h2share_raw, setup.projects_current)
+
+
+def calc_stage_yearly(setup: Setup, prices: pd.DataFrame, free_allocations: pd.DataFrame,
+                      h2share: pd.DataFrame, **config):
+    return calc_yearly(setup.replace(prices=prices, free_allocations=free_allocations,
+                                     h2share=h2share))
+
+
+def calc_stage_analyze(setup: Setup, prices: pd.DataFrame, free_allocations: pd.DataFrame,
+                       h2share: pd.DataFrame, **config):
+    return calc_analyze(setup.replace(prices=prices, free_allocations=free_allocations,
+                                      h2share=h2share))
+
+
+def calc_stage_auction(setup: Setup, config_ar: dict, yearly: pd.DataFrame):
+    """ Auction quantities and chosen projects of an auction round """
+    yearly, aggregate = calc_auction_quantities(yearly, setup, config_ar)
+    return yearly, aggregate, auction(aggregate, setup, config_ar)
+
+
+def calc_stage_payout(setup: Setup, yearly: pd.DataFrame):
+    return calc_payout(yearly, setup)
+
+
+def get_scenario_stages(scenarios: str, prefix: str = ''):
+    """ Stages selecting the scenario data of the scenario dict at config key scenarios """
+    return {
+        prefix + 'prices': Stage(select_stage_prices, config={'prices': f"{scenarios}.prices"},
+                                 frames=['prices_raw']),
+        prefix + 'free_allocations': Stage(
+            select_stage_free_allocations,
+            config={'free_allocations': f"{scenarios}.free_allocations"},
+            frames=['free_allocations_raw']),
+        prefix + 'h2share': Stage(select_stage_h2share, frames=['h2share_raw'],
+                                  project_columns=h2share_columns),
+    }
+
+
+def get_yearly_stage(func: callable, config: dict, prefix: str = ''):
+    return Stage(func, config=config, frames=calc_frames + ['abs_std_raw'],
+                 upstream={name: prefix + name for name in ['prices', 'free_allocations',
+                                                            'h2share']},
+                 project_columns='all')
+
+
+analyze_stages = get_scenario_stages('scenarios_actual') | {
+    'yearly': get_yearly_stage(calc_stage_analyze, calc_config | sensitivity_config),
+}
+
+auction_stages = \
+    get_scenario_stages('scenarios_bidding', 'bidding_') \
+    | get_scenario_stages('scenarios_actual', 'actual_') \
+    | {
+        'bidding_yearly': get_yearly_stage(calc_stage_yearly, calc_config, 'bidding_'),
+        'actual_yearly': get_yearly_stage(calc_stage_yearly, calc_config, 'actual_'),
+        # the config of the auction round is added to the config of the round's setups
+        'auction': Stage(calc_stage_auction, config={'config_ar': 'auction_round'},
+                         frames=['prices_raw', 'techdata'],
+                         upstream={'yearly': 'bidding_yearly'}),
+        'payout': Stage(calc_stage_payout, upstream={'yearly': 'actual_yearly'}),
+    }
+
+
+class Pipeline():
+    """
+    Memoized stages of analyze and auction runs; The memo is kept across runs, so that only the
+    stages (and projects) whose inputs changed are executed.
+    """
+
+    def __init__(self):
+        self.setup = None
+        self.input_hashes = None
+        # stage outputs by stage key, in the order of their last use; For per-project stages,
+        # the outputs by project key, also in the order of their last use
+        self.memo = collections.OrderedDict()
+        # row positions of the projects in per-project outputs (see select_project_rows)
+        self.row_indices = {}
+        # hashes of frames by id, with the frame (so that its id is not reused)
+        self.frame_hashes = {}
+        # (stage name, number of executed projects or None) of the last run
+        self.executed = []
+
+    def run(self, config_filepath: str = None, config: dict = None, filter_by: dict = None):
+        """ Same as run(), but only executes the stages whose inputs changed since earlier runs """
+
+        if config_filepath is not None and config is None:
+            config = read_config(config_filepath)
+        elif config_filepath is not None or config is None:
+            raise Exception('Specify either config_filepath or config dict.')
+        config = with_filter_by(config, filter_by)
+
+        setup = self.get_setup(config)
+        self.executed = []
+        if config['mode'] == 'analyze_cost' and config.get('streaming') is None \
+                and not keeps_jacobian(config):
+            with run_pool(setup, config.get('workers', 1)):
+                result = self.run_analyze(setup)
+        elif config['mode'] == 'auction' \
+                and config.get('sensitivity_mode', 'rerun') != 'monte_carlo':
+            with run_pool(setup, config.get('workers', 1)):
+                result = self.run_auction(setup)
+        else:
+            return run_setup(setup)
+        self.evict(config)
+
+        log("Executed stages: " + (", ".join(
+            name if n_projects is None else f"{name} ({n_projects} projects)"
+            for name, n_projects in self.executed) or "none"))
+        return result
+
+    def get_setup(self, config: dict):
+        """ Setup of the config, which shares all unchanged inputs with the previous one """
+        input_hashes = [content_hash(fp, input_cache_dir(config))
+                        for fp in input_filepaths(config)]
+        if self.setup is None or input_hashes != self.input_hashes:
+            self.setup = Setup(config=config)
+        else:
+            self.setup = self.setup.with_config(config)
+        self.input_hashes = input_hashes
+        return self.setup
+
+    def run_analyze(self, setup: Setup):
+        """ As run_analyze """
+
+        clear_results(setup.config)
+        outputs = self.evaluate(analyze_stages, ['yearly'], setup)
+        setup = setup.replace(
+            selected_scenarios=scenario_key(setup.config['scenarios_actual']),
+            prices=outputs['prices'],
+            free_allocations=outputs['free_allocations'],
+            h2share=outputs['h2share'],
+        )
+        store_results(setup.config, 'yearly', outputs['yearly'], Scenarios='actual')
+        return setup, outputs['yearly']
+
+    def run_auction(self, setup: Setup):
+        """ As run_auction """
+
+        clear_results(setup.config)
+        all_chosen_projects = []
+
+        for config_ar_specific in setup.config['auction_rounds']:
+
+            config_ar = setup.config['auction_round_default'] | config_ar_specific
+            log(f"Enter auction round {config_ar['name']}...")
+            setup_ar = setup.replace(config=setup.config | {'auction_round': config_ar})
+
+            setup_bidding = setup_ar.with_projects(
+                get_projects_ar(setup, all_chosen_projects, config_ar))
+            if setup_bidding.projects_current.empty:
+                log("  No projects bidding")
+                log("")
+                continue
+            outputs = self.evaluate(auction_stages, ['auction'], setup_bidding)
+            yearly, aggregate, chosen_projects = outputs['auction']
+            all_chosen_projects += chosen_projects
+
+            setup_payout = setup_ar.with_projects(
+                get_payout_projects(setup, chosen_projects, config_ar))
+            p_yearly, p_aggregate, payout_ar = \
+                self.evaluate(auction_stages, ['payout'], setup_payout)['payout']
+
+            bidding = {'Auction round': config_ar['name'], 'Scenarios': 'bidding'}
+            actual = {'Auction round': config_ar['name'], 'Scenarios': 'actual'}
+            store_results(setup.config, 'yearly', yearly, **bidding)
+            store_results(setup.config, 'aggregate', aggregate, **bidding)
+            store_results(setup.config, 'yearly', p_yearly, **actual)
+            store_results(setup.config, 'payout', p_aggregate.reset_index(), **actual)
+            log(f"  {len(chosen_projects)} projects chosen; Payout: {payout_ar/1000.:0.3f} Bn €")
+            log("")
+
+        return all_chosen_projects
+
+    def evaluate(self, stages: dict, names: list, setup: Setup):
+        """ Outputs of the given stages and all stages upstream of them, by stage name """
+        resolved = {}
+        for name in names:
+            self.resolve(stages, name, setup, resolved)
+        return {name: output for name, (key, output) in resolved.items()}
+
+    def resolve(self, stages: dict, name: str, setup: Setup, resolved: dict):
+        """ Add (key, output) of the stage to resolved; Keys are strings for whole stages, and for
+        per-project stages tuples of the stage key and an array with one key per current project """
+
+        if name in resolved:
+            return
+        stage = stages[name]
+        for upstream_name in stage.upstream.values():
+            self.resolve(stages, upstream_name, setup, resolved)
+
+        key = self.stage_key(stage, setup, resolved)
+        config_values = {arg: get_config_value(setup.config, config_key)
+                         for arg, config_key in stage.config.items()}
+
+        if not stage.is_per_project:
+            if key not in self.memo:
+                upstream = {arg: resolved[upstream_name][1]
+                            for arg, upstream_name in stage.upstream.items()}
+                self.memo[key] = stage.func(setup, **config_values, **upstream)
+                self.executed.append((name, None))
+            self.memo.move_to_end(key)
+            resolved[name] = (key, self.memo[key])
+            return
+
+        projects = setup.projects_current
+        project_keys = self.project_keys(stage, key, setup, resolved)
+        entries = self.memo.setdefault(key, collections.OrderedDict())
+        self.memo.move_to_end(key)
+        is_missing = np.array([pk not in entries for pk in project_keys], dtype=bool)
+
+        if is_missing.any() or projects.empty:
+            missing_names = list(projects['Project name'].values[is_missing])
+            upstream = {
+                arg: select_project_rows(resolved[upstream_name][1], missing_names,
+                                         self.row_indices)
+                if stages[upstream_name].is_per_project else resolved[upstream_name][1]
+                for arg, upstream_name in stage.upstream.items()
+            }
+            output = stage.func(setup.with_projects(projects[is_missing]), **config_values,
+                                **upstream)
+            if projects.empty:
+                resolved[name] = ((key, project_keys), output)
+                return
+            # the memo holds the whole output frame for each of its projects
+            for project_key in project_keys[is_missing]:
+                entries[project_key] = output
+            self.executed.append((name, int(is_missing.sum())))
+
+        names_by_block = {}
+        for project_name, project_key in zip(projects['Project name'], project_keys):
+            block = entries[project_key]
+            entries.move_to_end(project_key)
+            names_by_block.setdefault(id(block), (block, []))[1].append(project_name)
+        output = pd.concat([select_project_rows(block, names, self.row_indices)
+                            for block, names in names_by_block.values()])
+        resolved[name] = ((key, project_keys),
+                          output.sort_values('Project name', kind='stable')
+                          .reset_index(drop=True))
+
+    def stage_key(self, stage: Stage, setup: Setup, resolved: dict):
+        """ Hash of the function, config values, frames and whole upstream outputs of the stage """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{stage.func.__module__}.{stage.func.__qualname__}".encode('utf-8'))
+        config_values = [get_config_value(setup.config, config_key)
+                         for config_key in stage.config.values()]
+        h.update(json.dumps(config_values, sort_keys=True, default=str).encode('utf-8'))
+        for frame_name in stage.frames:
+            h.update(self.frame_hash(getattr(setup, frame_name)))
+        for upstream_name in stage.upstream.values():
+            upstream_key = resolved[upstream_name][0]
+            if isinstance(upstream_key, str):
+                h.update(upstream_key.encode('utf-8'))
+            else:
+                # the stage key of per-project stages, i.e. everything but the project rows
+                h.update(upstream_key[0].encode('utf-8'))
+                if not stage.is_per_project:
+                    # per-project keys of all current projects, in their order
+                    h.update(np.ascontiguousarray(upstream_key[1]).tobytes())
+        return h.hexdigest()
+
+    def project_keys(self, stage: Stage, key: str, setup: Setup, resolved: dict):
+        """
+        One key per current project, from its values in the project columns of the stage and
+        its keys in per-project upstream stages
+        """
+        projects = setup.projects_current
+        columns = list(projects.columns) if stage.project_columns == 'all' \
+            else ['Project name'] + stage.project_columns
+        parts = {'row': pd.util.hash_pandas_object(projects[columns], index=False).values}
+        for upstream_name in stage.upstream.values():
+            upstream_key = resolved[upstream_name][0]
+            if not isinstance(upstream_key, str):
+                parts[upstream_name] = upstream_key[1]
+        return pd.util.hash_pandas_object(pd.DataFrame(parts), index=False).values
+
+    def frame_hash(self, df: pd.DataFrame):
+        if id(df) not in self.frame_hashes:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))])
+                     .encode('utf-8'))
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+            self.frame_hashes[id(df)] = (df, h.digest())
+        return self.frame_hashes[id(df)][1]
+
+    def evict(self, config: dict):
+        """
+        Remove the least recently used stage outputs beyond the sizes in the config, and the
+        row indices and frame hashes which are no longer needed
+        """
+        cache_config = pipeline_cache_defaults | config
+        while len(self.memo) > cache_config['pipeline_cache_stages']:
+            self.memo.popitem(last=False)
+        max_projects = cache_config['pipeline_cache_project_versions'] \
+            * max(len(self.setup.projects_all), 1)
+        blocks = set()
+        for output in self.memo.values():
+            if isinstance(output, collections.OrderedDict):
+                while len(output) > max_projects:
+                    output.popitem(last=False)
+                blocks.update(id(block) for block in output.values())
+        self.row_indices = {key: value for key, value in self.row_indices.items()
+                            if key[1] in blocks}
+        frames = set(id(value) for value in self.setup.__dict__.values())
+        self.frame_hashes = {key: value for key, value in self.frame_hashes.items()
+                             if key in frames}
+
+    def clear(self):
+        """ Remove all memoized outputs """
+        self.memo = collections.OrderedDict()
+        self.row_indices = {}
+        self.frame_hashes = {}
+
+
+def get_config_value(config: dict, config_key: str):
+    """ Value at a config key with keys of nested values joined by dots; None if not given """
+    value = config
+    for key in config_key.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+_pipeline = Pipeline()
+
+
+def run_pipeline(config_filepath: str = None, config: dict = None, filter_by: dict = None):
+    """ run() with a pipeline kept in this module, i.e. memoized across calls in a session """
+    return _pipeline.run(config_filepath, config, filter_by)
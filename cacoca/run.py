@@ -1,32 +1,87 @@
-from .setup.setup import Setup
-from .calc.calc_cost_and_emissions import calc_cost_and_emissions
-from .calc.calc_derived_quantities import calc_derived_quantities, calc_payout
-from .calc.calc_auction_quantities import calc_auction_quantities
-from .calc.auction import prepare_setup_for_bidding, auction, prepare_setup_for_payout
-from .tools.sensitivities import with_sensitivities
+import os
+import shutil
+import pandas as pd
+from .setup.setup import Setup, with_filter_by
+from .setup.read_input import read_config, read_projects_batches
+from .calc.calc_derived_quantities import calc_payout
+from .calc.calc_auction_quantities import calc_auction_quantities, calc_strike_price
+from .calc.partitioned import calc_yearly
+from .calc.auction import prepare_setup_for_bidding, auction, prepare_setup_for_payout, \
+    calc_yearly_cached, filter_variant_projects, summarize_auction_samples
+from .tools.sensitivities import with_sensitivities, keeps_jacobian, get_monte_carlo_config, \
+    get_sample_chunks, draw_samples, get_sample_variants, get_sample_techdata_indices
+from .tools.parallel import map_with_setup, run_pool
+from .tools.columnar import write_part
+from .tools.results_store import clear_results, store_results, is_dataset
+from .tools.run_cache import cached_run
+from .tools.profiling import start_profiling, stop_profiling, set_context
 from .tools.tools import log
 
 
-def run(config_filepath: str = None, config: dict = None):
+def run(config_filepath: str = None, config: dict = None, filter_by: dict = None):
     """
     Creates Setup object with all necessary data from the config path.
     Depending on config, it runs either auction or analyze mode.
+    If config, input files and code are unchanged, results are taken from the run cache.
+    filter_by ({column: value(s)} of the projects file, e.g. 'Project name', 'Industry' or
+    'Technology') restricts the run to the matching projects; Only their data is read.
     """
 
-    setup = Setup(config_filepath, config)
+    if config_filepath is not None and config is None:
+        config = read_config(config_filepath)
+    elif config_filepath is not None or config is None:
+        raise Exception('Specify either config_filepath or config dict.')
+    config = with_filter_by(config, filter_by)
 
-    mode = setup.config['mode']
-    if mode == 'auction':
-        all_chosen_projects = run_auction(setup)
-        return all_chosen_projects
-    elif mode == 'analyze_cost':
-        cost_and_em = run_analyze(setup)
-        return setup, cost_and_em
+    result = cached_run(run_config, config)
 
+    # a cached setup gets the current config, which may differ in output settings
+    if isinstance(result, tuple) and isinstance(result[0], Setup):
+        result = (result[0].replace(config=config),) + result[1:]
+    return result
 
-def run_auction(setup: Setup):
+
+def run_config(config: dict):
+
+    start_profiling(config)
+    try:
+        return run_mode(config)
+    finally:
+        stop_profiling()
+
+
+def run_mode(config: dict):
+    return run_setup(Setup(config=config))
+
+
+def run_setup(setup: Setup):
+
+    clear_results(setup.config)
+
+    # all partitioned calculations of the run share one worker pool
+    with run_pool(setup, setup.config.get('workers', 1)):
+        mode = setup.config['mode']
+        if mode == 'auction':
+            if setup.config.get('sensitivity_mode', 'rerun') == 'monte_carlo':
+                return run_auction_monte_carlo(setup)
+            all_chosen_projects = run_auction(setup)
+            return all_chosen_projects
+        elif mode == 'analyze_cost':
+            if setup.config.get('streaming') is not None:
+                return run_analyze_streaming(setup)
+            return run_analyze(setup)
+
+
+def run_auction(setup: Setup, yearly_cache: dict = None):
+    """
+    Runs all auction rounds; Returns the list of chosen projects.
+    yearly_cache keeps the per-project results of cost, emissions and derived quantities, which
+    are reused across rounds (and across runs with the same config, if a cache is given).
+    """
 
     all_chosen_projects = []
+    if yearly_cache is None:
+        yearly_cache = {}
 
     # loop over auction rounds (ar)
     for config_ar_specific in setup.config['auction_rounds']:
@@ -34,36 +89,196 @@ def run_auction(setup: Setup):
         config_ar = setup.config['auction_round_default'] | config_ar_specific
 
         log(f"Enter auction round {config_ar['name']}...")
+        set_context(**{'Auction round': config_ar['name']})
 
-        prepare_setup_for_bidding(setup, all_chosen_projects, config_ar)
+        setup_bidding = prepare_setup_for_bidding(setup, all_chosen_projects, config_ar)
+        if setup_bidding.projects_current.empty:
+            log("  No projects bidding")
+            log("")
+            continue
 
         # calculate cost and emissions for bidding
-        cost_and_em_bidding = calc_cost_and_emissions(setup)
-        yearly = calc_derived_quantities(cost_and_em_bidding, setup)
-        yearly, aggregate = calc_auction_quantities(yearly, setup, config_ar)
+        yearly = calc_yearly_cached(setup_bidding, yearly_cache)
+        yearly, aggregate = calc_auction_quantities(yearly, setup_bidding, config_ar)
 
-        chosen_projects = auction(aggregate, setup, config_ar)
+        chosen_projects = auction(aggregate, setup_bidding, config_ar)
         all_chosen_projects += chosen_projects
 
-        prepare_setup_for_payout(setup, chosen_projects, config_ar)
-        cost_and_em_actual = calc_cost_and_emissions(setup)
-        cost_and_em_actual = calc_derived_quantities(cost_and_em_actual, setup)
-        p_yearly, p_aggregate, payout_ar = calc_payout(cost_and_em_actual, setup)
+        setup_payout = prepare_setup_for_payout(setup, chosen_projects, config_ar)
+        cost_and_em_actual = calc_yearly_cached(setup_payout, yearly_cache)
+        p_yearly, p_aggregate, payout_ar = calc_payout(cost_and_em_actual, setup_payout)
+
+        bidding = {'Auction round': config_ar['name'], 'Scenarios': 'bidding'}
+        actual = {'Auction round': config_ar['name'], 'Scenarios': 'actual'}
+        store_results(setup.config, 'yearly', yearly, **bidding)
+        store_results(setup.config, 'aggregate', aggregate, **bidding)
+        store_results(setup.config, 'yearly', p_yearly, **actual)
+        store_results(setup.config, 'payout', p_aggregate.reset_index(), **actual)
         log(f"  Payout: {payout_ar/1000.:0.3f} Bn €")
         log("")
 
+    set_context()
     return all_chosen_projects
 
 
+def run_auction_monte_carlo(setup: Setup):
+    """
+    Runs all auction rounds for random samples of the uncertain parameters.
+    Returns the selection probability and quantiles of budget cap and payout per project,
+    and the totals per sample.
+    """
+
+    mc_config = get_monte_carlo_config(setup.config)
+    results = map_with_setup(run_auction_samples, setup, get_sample_chunks(mc_config),
+                             n_workers=mc_config['workers'])
+    results = pd.concat(results, ignore_index=True)
+    project_quantiles, sample_totals = summarize_auction_samples(
+        results, mc_config['n_samples'], mc_config['quantiles'])
+    store_results(setup.config, 'project_quantiles', project_quantiles)
+    store_results(setup.config, 'sample_totals', sample_totals)
+
+    log(f"Monte Carlo auction with {mc_config['n_samples']} samples")
+    payout_quantiles = sample_totals['Payout'].quantile(mc_config['quantiles'])
+    log("  Payout: " + " | ".join(f"{100. * q:g} %: {payout / 1000.:0.3f} Bn €"
+                                  for q, payout in payout_quantiles.items()))
+
+    return project_quantiles, sample_totals
+
+
+def run_auction_samples(setup: Setup, chunk: tuple):
+    """
+    Runs all auction rounds for one chunk of samples, which are evaluated at once as input
+    variants of the array engine. Each sample has its own list of chosen projects.
+    """
+
+    setup = setup.replace(config=setup.config | {'calc_engine': 'array'})
+    cfg_dicts = setup.config.get('uncertain_parameters', [])
+    samples = draw_samples(get_monte_carlo_config(setup.config), len(cfg_dicts), chunk)
+    techdata_indices = get_sample_techdata_indices(setup, cfg_dicts, samples)
+
+    all_chosen_projects = {i_sample: [] for i_sample in range(len(samples))}
+    results = []
+
+    for config_ar_specific in setup.config['auction_rounds']:
+
+        config_ar = setup.config['auction_round_default'] | config_ar_specific
+
+        # projects chosen in all samples are removed here, the others only from their samples
+        chosen_everywhere = set.intersection(*map(set, all_chosen_projects.values()))
+        setup_bidding = prepare_setup_for_bidding(setup, list(chosen_everywhere), config_ar)
+        setup_bidding = setup_bidding.replace(input_variants=get_sample_variants(
+            setup_bidding, cfg_dicts, samples, techdata_indices))
+
+        yearly = calc_yearly(setup_bidding)
+        yearly = filter_variant_projects(yearly, all_chosen_projects, keep=False)
+        yearly, aggregate = calc_auction_quantities(yearly, setup_bidding, config_ar)
+
+        chosen_projects = auction(aggregate, setup_bidding, config_ar)
+        chosen_projects = {i_sample: chosen_projects.get(i_sample, [])
+                           for i_sample in all_chosen_projects}
+        for i_sample, projects in chosen_projects.items():
+            all_chosen_projects[i_sample] += projects
+
+        chosen_any = sorted(set().union(*chosen_projects.values()))
+        if not chosen_any:
+            continue
+
+        setup_payout = prepare_setup_for_payout(setup, chosen_any, config_ar)
+        setup_payout = setup_payout.replace(input_variants=get_sample_variants(
+            setup_payout, cfg_dicts, samples, techdata_indices))
+        cost_and_em_actual = calc_yearly(setup_payout)
+        cost_and_em_actual = filter_variant_projects(cost_and_em_actual, chosen_projects)
+        p_yearly, p_aggregate, payout_ar = calc_payout(cost_and_em_actual, setup_payout)
+
+        results.append(
+            filter_variant_projects(aggregate, chosen_projects)
+            .filter(['Input variant', 'Project name', 'budget_cap'])
+            .merge(p_aggregate.reset_index(), how='left', on=['Input variant', 'Project name'])
+            .assign(**{'Auction round': config_ar['name']})
+        )
+
+    if not results:
+        return pd.DataFrame(columns=['Sample', 'Project name', 'budget_cap', 'Payout',
+                                     'Auction round'])
+    return pd.concat(results, ignore_index=True) \
+        .assign(Sample=lambda df: df.pop('Input variant') + chunk[1]) \
+        .filter(['Sample', 'Project name', 'budget_cap', 'Payout', 'Auction round'])
+
+
 def run_analyze(setup: Setup):
-    """ First selects relevant scenario data, then initializes calculation. """
+    """
+    First selects relevant scenario data, then initializes calculation.
+    Returns the setup with the selected data and the yearly results (and with
+    sensitivity_keep_jacobian the jacobian of the sensitivities, see calc_jacobian).
+    """
+
+    setup = setup.with_scenario_data('scenarios_actual').with_h2share()
 
-    setup.select_scenario_data(scenarios='scenarios_actual')
-    setup.select_h2share()
+    if keeps_jacobian(setup.config):
+        yearly, jacobian = calc_analyze(setup)
+        store_results(setup.config, 'yearly', yearly, Scenarios='actual')
+        return setup, yearly, jacobian
 
     yearly = calc_analyze(setup)
+    store_results(setup.config, 'yearly', yearly, Scenarios='actual')
 
-    return yearly
+    return setup, yearly
+
+
+streaming_defaults = {
+    'batch_size': 10000,
+    'output_dir': 'output/streaming/',
+}
+
+
+def run_analyze_streaming(setup: Setup):
+    """
+    Runs analyze mode on batches of the projects file, so that memory use depends on the batch
+    size instead of the number of projects. Yearly results and strike prices of each batch are
+    written as parts (see read_parts) to the subdirectories 'yearly' and 'aggregate' of the
+    streaming output directory. Returns the setup with the selected scenario data and the
+    streaming output directory.
+    """
+
+    if keeps_jacobian(setup.config):
+        raise Exception('sensitivity_keep_jacobian is not supported in streaming runs.')
+    stream_config = streaming_defaults | setup.config['streaming']
+    output_dir = stream_config['output_dir']
+    clear_streaming_output(output_dir)
+
+    setup = setup.with_scenario_data('scenarios_actual')
+
+    n_projects = 0
+    batches = read_projects_batches(setup.config, stream_config['batch_size'])
+    for i_batch, projects in enumerate(batches):
+        # selections for single batches are not kept
+        setup_batch = setup \
+            .replace(projects_all=projects, projects_current=projects,
+                     selection_cache=setup.selection_cache.copy()) \
+            .with_h2share()
+
+        yearly = calc_analyze(setup_batch)
+        write_part(yearly, os.path.join(output_dir, 'yearly'), i_batch)
+        write_part(calc_strike_price(yearly, setup_batch).reset_index(),
+                   os.path.join(output_dir, 'aggregate'), i_batch)
+        n_projects += len(projects)
+
+    log(f"Streamed {n_projects} projects to {output_dir}")
+    return setup, output_dir
+
+
+def clear_streaming_output(output_dir: str):
+    """ Remove the output of a previous streaming run; Raises if the directory holds other files """
+    if not os.path.isdir(output_dir):
+        return
+    invalid = [name for name in os.listdir(output_dir)
+               if name not in ['yearly', 'aggregate']
+               or not is_dataset(os.path.join(output_dir, name))]
+    if invalid:
+        raise Exception(f"Streaming output directory {output_dir} contains files not written by "
+                        f"a streaming run ({', '.join(sorted(invalid))}); Use a separate "
+                        f"directory.")
+    shutil.rmtree(output_dir)
 
 
 @with_sensitivities
@@ -73,6 +288,5 @@ def calc_analyze(setup: Setup):
     @with_sensitivities decorator calls function multiple times for statistics.
     """
 
-    cost_and_em = calc_cost_and_emissions(setup, keep_components=True)
-    yearly = calc_derived_quantities(cost_and_em, setup)
+    yearly = calc_yearly(setup, keep_components=True)
     return yearly
@@ -0,0 +1,250 @@
+import collections
+import json
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from .setup.setup import Setup
+from .setup.read_input import read_config
+from .setup.select_scenario_data import select_h2share
+from .calc.auction import calc_yearly_cached
+from .calc.calc_auction_quantities import calc_strike_price
+from .batch import apply_overrides
+from .run import run_auction, calc_analyze
+from .tools.sensitivities import keeps_jacobian
+from .tools.tools import log
+
+
+# Local what-if service (config key 'service'; usage: python cacoca.py <config with service>):
+# The setup is read once, and scenario selections, h2 shares and (with warm_up) the yearly results
+# of all projects for the actual scenarios are calculated at start. The service then answers JSON
+# POST requests to /analyze and /auction from memory. A request body may contain:
+# - overrides: config values to override, with keys joined by dots (as in batch runs)
+# - prices: {component: scenario} picks, applied to the actual and bidding scenarios
+# - projects: list of project names, and/or filters: {column: [values]} of the projects
+# - aggregate (only /analyze): return the strike price per project instead of yearly results
+# - columns (only /analyze): columns of the result to return
+# With sensitivity_keep_jacobian, /analyze additionally returns the jacobian (see calc_jacobian).
+# For each distinct config of the requests (up to cache_size configs), the derived setup with its
+# selections and the per-project results are kept, so repeated queries only calculate projects
+# not seen before with this config. The per-project results of a config hold at most one result
+# per project (and auction round), so they are bounded by the results of all projects; They are
+# not evicted before their config. Requests are handled in parallel threads; They never modify
+# the setups or their data, only add to the caches. The results of a config are calculated by one
+# request at a time (with a lock per cache), so that concurrent requests do not duplicate work.
+# Invalid requests are answered with status 400 and the error message; Other errors with status
+# 500, and their traceback is logged.
+
+service_defaults = {
+    'host': '127.0.0.1',
+    'port': 8050,
+    'warm_up': True,
+    'cache_size': 16,
+}
+
+
+class ServiceRequestError(Exception):
+    """ Invalid request to the what-if service """
+
+
+def serve(config_filepath: str = None, config: dict = None):
+    """ Start the what-if service and handle requests until interrupted """
+
+    if config_filepath is not None and config is None:
+        config = read_config(config_filepath)
+    elif config_filepath is not None or config is None:
+        raise Exception('Specify either config_filepath or config dict.')
+
+    service = WhatIfService(config)
+    server = make_server(service)
+    log(f"What-if service listening on http://{server.server_address[0]}:"
+        f"{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def make_server(service: 'WhatIfService'):
+    service_config = service.service_config
+    server = ThreadingHTTPServer((service_config['host'], service_config['port']), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class WhatIfService():
+    """ Warm setup and per-config result caches answering what-if requests """
+
+    def __init__(self, config: dict):
+
+        self.service_config = service_defaults | config['service']
+        self.base_config = {key: value for key, value in config.items() if key != 'service'}
+        self.setup = Setup(config=self.base_config)
+        # by config: the setup and the per-project yearly results (see calc_yearly_cached) of
+        # analyze and auction requests
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        start = time.perf_counter()
+        warm_setup = self.setup.with_scenario_data('scenarios_actual').with_h2share()
+        if self.service_config['warm_up'] and not warm_setup.projects_all.empty:
+            entry = self.get_entry(self.base_config)
+            with entry['locks']['analyze']:
+                calc_yearly_cached(warm_setup, entry['analyze'], keep_components=True)
+            # builds the lookup of single projects in the results (see select_project_rows)
+            self.analyze({'projects': list(warm_setup.projects_all['Project name'][:1])})
+        log(f"Warm-up finished after {time.perf_counter() - start:0.2f} s")
+
+    def handle(self, path: str, request: dict):
+        if path == '/analyze':
+            return self.analyze(request)
+        elif path == '/auction':
+            return self.auction(request)
+        raise ServiceRequestError(f"Invalid path: {path}; Valid are: /analyze, /auction")
+
+    def analyze(self, request: dict):
+        """ Yearly results (or strike prices) of the requested projects for the actual scenarios """
+
+        entry = self.get_entry(self.get_config(request))
+        setup = entry['setup'].with_scenario_data('scenarios_actual')
+        projects = self.filter_projects(setup, request)
+        if len(projects) == len(setup.projects_all):
+            setup = setup.with_h2share()
+        else:
+            # not memoized, so that the selection cache does not grow with each request
+            setup = setup \
+                .with_projects(projects) \
+                .replace(h2share=select_h2share(setup.h2share_raw, projects))
+
+        response = {}
+        if keeps_jacobian(setup.config):
+            yearly, jacobian = calc_analyze(setup)
+            response['jacobian'] = to_records(jacobian)
+        elif setup.config.get('uncertain_parameters'):
+            yearly = calc_analyze(setup)
+        else:
+            with entry['locks']['analyze']:
+                yearly = calc_yearly_cached(setup, entry['analyze'], keep_components=True)
+
+        if request.get('aggregate', False):
+            yearly = calc_strike_price(yearly, setup).reset_index()
+        if 'columns' in request:
+            yearly = yearly.filter(request['columns'])
+        return {'data': to_records(yearly)} | response
+
+    def auction(self, request: dict):
+        """ Projects chosen in all auction rounds among the requested projects """
+
+        entry = self.get_entry(self.get_config(request))
+        setup = entry['setup']
+        if 'projects' in request or 'filters' in request:
+            # auction rounds select from projects_all; Only h2 share selections depend on it
+            projects = self.filter_projects(setup, request)
+            setup = setup.replace(
+                projects_all=projects, projects_current=projects,
+                selection_cache=setup.selection_cache.copy(lambda key: key[0] != 'h2share'))
+        with entry['locks']['auction']:
+            chosen_projects = run_auction(setup, entry['auction'])
+        return {'chosen_projects': chosen_projects}
+
+    def get_config(self, request: dict):
+        if not isinstance(request, dict):
+            raise ServiceRequestError('The request has to be a JSON object.')
+        invalid = [key for key in request if key not in
+                   ['overrides', 'prices', 'projects', 'filters', 'aggregate', 'columns']]
+        if invalid:
+            raise ServiceRequestError(f"Invalid request keys: {', '.join(invalid)}")
+        for key in ['overrides', 'prices', 'filters']:
+            if not isinstance(request.get(key, {}), dict):
+                raise ServiceRequestError(f"'{key}' has to be a JSON object.")
+
+        try:
+            config = apply_overrides(self.base_config, request.get('overrides', {}))
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise ServiceRequestError(f"Invalid overrides: {type(e).__name__}: {e}")
+        prices = request.get('prices', {})
+        for scenarios in ['scenarios_actual', 'scenarios_bidding']:
+            if scenarios in config:
+                config[scenarios]['prices'] = config[scenarios]['prices'] | prices
+        return config
+
+    def filter_projects(self, setup: Setup, request: dict):
+        projects = setup.projects_all
+        filters = request.get('filters', {})
+        if 'projects' in request:
+            filters = filters | {'Project name': request['projects']}
+        for column, values in filters.items():
+            if column not in projects.columns:
+                raise ServiceRequestError(f"Invalid project column: {column}")
+            if not isinstance(values, list):
+                raise ServiceRequestError(f"The values of {column} have to be a list.")
+            projects = projects[projects[column].isin(values)]
+        if projects.empty:
+            raise ServiceRequestError('No projects match the request.')
+        return projects
+
+    def get_entry(self, config: dict):
+        """ Setup and result caches of the config; The least recently used config is dropped """
+        key = json.dumps(config, sort_keys=True, default=str)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            # derived outside the lock, as it may read input files
+            entry = {'setup': self.setup.with_config(config), 'analyze': {}, 'auction': {},
+                     'locks': {'analyze': threading.Lock(), 'auction': threading.Lock()}}
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.service_config['cache_size']:
+                self.entries.popitem(last=False)
+            return entry
+
+
+def to_records(df: pd.DataFrame):
+    # via to_json, so that NaN becomes null and numpy types are converted
+    return json.loads(df.to_json(orient='records'))
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError as e:
+                raise ServiceRequestError(f"Invalid JSON: {e}")
+            response = self.server.service.handle(self.path, request)
+            status = 200
+        except ServiceRequestError as e:
+            response = {'error': str(e)}
+            status = 400
+        except Exception as e:
+            log(f"Error in request to {self.path}:\n{traceback.format_exc()}")
+            response = {'error': f"Internal error: {type(e).__name__}"}
+            status = 500
+        response['time_ms'] = 1000. * (time.perf_counter() - start)
+        self.send_json(status, response)
+
+    def do_GET(self):
+        if self.path == '/projects':
+            self.send_json(200, {'data': to_records(self.server.service.setup.projects_all)})
+        else:
+            self.send_json(404, {'error': f"Invalid path: {self.path}"})
+
+    def send_json(self, status: int, response: dict):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # requests are not logged
+        pass
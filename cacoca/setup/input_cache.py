@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from ..tools.columnar import write_frame, read_frame_rows, matching_rows, is_frame
+from ..tools.tools import log
+
+
+# Persistent cache of parsed input csv files.
+# Each file gets a cache entry (a directory named by the hash of its absolute path) containing
+# the parsed frame in the binary columnar format of tools/columnar.py and a source.json with
+# size, mtime and content hash of the csv file. An entry is used if size and mtime match; If
+# only those changed but the content hash is the same, the entry is still valid.
+
+CACHE_VERSION = 1
+SOURCE_FILE = 'source.json'
+
+
+def input_cache_dir(config: dict):
+    """ Directory of the input cache, or None if disabled in the config. """
+    if not config.get('use_input_cache', True):
+        return None
+    return os.path.join(config.get('cache_dir', '.cache/'), 'inputs')
+
+
+def read_csv_files(filepaths: list, cache_dir: str = None):
+    """ Read several csv files; Files missing in the cache are parsed in parallel threads. """
+    if len(filepaths) <= 1:
+        return [read_csv(fp, cache_dir) for fp in filepaths]
+    with ThreadPoolExecutor(max_workers=min(len(filepaths), os.cpu_count() or 1)) as pool:
+        return list(pool.map(lambda fp: read_csv(fp, cache_dir), filepaths))
+
+
+def read_csv(filepath: str, cache_dir: str = None, filter_by: dict = None):
+    """
+    pd.read_csv, using the cache in cache_dir if given. filter_by ({column: values}) selects rows;
+    From a valid cache entry, only the selected rows are read.
+    """
+
+    if cache_dir is None:
+        return filter_rows(pd.read_csv(filepath), filter_by)
+
+    filepath = os.path.abspath(filepath)
+    entry_dir = os.path.join(cache_dir, hash_str(filepath))
+    stat = os.stat(filepath)
+    source = {
+        'path': filepath,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'version': CACHE_VERSION,
+    }
+
+    cached_source = read_source(entry_dir)
+    if cached_source is not None and is_frame(entry_dir):
+        if all(cached_source.get(k) == v for k, v in source.items()):
+            return read_frame_rows(entry_dir, filter_by, mmap=False)
+        source['content_hash'] = hash_file(filepath)
+        if cached_source.get('content_hash') == source['content_hash'] \
+                and cached_source.get('version') == CACHE_VERSION:
+            write_source(entry_dir, source)
+            return read_frame_rows(entry_dir, filter_by, mmap=False)
+
+    df = pd.read_csv(filepath)
+
+    source.setdefault('content_hash', hash_file(filepath))
+    try:
+        write_frame(df, entry_dir)
+        write_source(entry_dir, source)
+    except OSError as e:
+        log(f"Could not write input cache for {filepath}: {e}")
+
+    return filter_rows(df, filter_by)
+
+
+def filter_rows(df: pd.DataFrame, filter_by: dict = None):
+    if not filter_by:
+        return df
+    missing = [key for key in filter_by if key not in df.columns]
+    if missing:
+        raise KeyError(f"Columns not found: {', '.join(missing)}")
+    return df[matching_rows(df, filter_by)].reset_index(drop=True)
+
+
+def content_hash(filepath: str, cache_dir: str = None):
+    """ Content hash of a file; Taken from its cache entry if size and mtime are unchanged. """
+    if cache_dir is not None:
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        cached_source = read_source(os.path.join(cache_dir, hash_str(filepath)))
+        if cached_source is not None and 'content_hash' in cached_source \
+                and cached_source.get('size') == stat.st_size \
+                and cached_source.get('mtime_ns') == stat.st_mtime_ns:
+            return cached_source['content_hash']
+    return hash_file(filepath)
+
+
+def read_source(entry_dir: str):
+    try:
+        with open(os.path.join(entry_dir, SOURCE_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_source(entry_dir: str, source: dict):
+    tmp_path = os.path.join(entry_dir, SOURCE_FILE + f'.tmp-{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        json.dump(source, f)
+    os.replace(tmp_path, os.path.join(entry_dir, SOURCE_FILE))
+
+
+def hash_str(s: str):
+    return hashlib.blake2b(s.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def hash_file(filepath: str):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
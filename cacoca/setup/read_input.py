@@ -1,6 +1,7 @@
 import yaml
 import os
 import pandas as pd
+from .input_cache import read_csv, read_csv_files, input_cache_dir, filter_rows
 
 
 def read_config(filepath: str):
@@ -11,41 +12,131 @@ def read_config(filepath: str):
 
 
 def read_projects(config: dict):
-    projects = pd.read_csv(config['projects_file'])
+    """ Active projects; With filter_by in the config, only the matching rows are read. """
+    projects = read_csv(config['projects_file'], input_cache_dir(config),
+                        filter_by=config.get('filter_by'))
     # projects = pd.read_excel(filepath, sheet_name='Projects')
+    projects = prepare_projects(projects, config)
+    if not projects['Project name'].is_unique:
+        raise Exception('Duplicate project names are prohibited.')
+    if projects.empty and config.get('filter_by'):
+        raise Exception(f"No active projects match filter_by: {config['filter_by']}")
+    return projects
+
+
+def read_projects_batches(config: dict, batch_size: int):
+    """
+    Generator of the projects in batches read from consecutive rows of the projects file;
+    Only the project names are kept across batches (to check for duplicates).
+    """
+    project_names = set()
+    for projects in pd.read_csv(config['projects_file'], chunksize=batch_size):
+        projects = prepare_projects(filter_rows(projects, config.get('filter_by')), config)
+        if not projects['Project name'].is_unique \
+                or not project_names.isdisjoint(projects['Project name']):
+            raise Exception('Duplicate project names are prohibited.')
+        project_names.update(projects['Project name'])
+        if not projects.empty:
+            yield projects
+
+
+def read_projects_header(config: dict):
+    """ Empty projects frame with the columns of the projects file """
+    return prepare_projects(pd.read_csv(config['projects_file'], nrows=0), config)
+
+
+def prepare_projects(projects: pd.DataFrame, config: dict):
     projects = projects.query("Active == 1")
     projects = projects.fillna({'WACC': config['default_wacc']})
     if config['do_overwrite_project_start_year']:
         projects['Time of investment'] = config['project_start_year_overwrite']
-    if not projects['Project name'].is_unique:
-        raise Exception('Duplicate project names are prohibited.')
     return projects
 
 
-def read_techdata(dir_path: str, filenames_base: list):
-    techdata = [
-        pd.read_csv(
-            os.path.join(dir_path, fnb + '.csv')
-        ) for fnb in filenames_base
-    ]
-    for df, fnb in zip(techdata, filenames_base):
-        df.insert(0, "Industry", fnb, True)
-    techdata = pd.concat(techdata)
+def read_techdata(dir_path: str, filenames_base: list, cache_dir: str = None,
+                  projects: pd.DataFrame = None):
+    """
+    Techdata of all files, or if projects are given, only of the files needed for them: the
+    files of their industries, and further files only if they contain technologies of the projects
+    or their reference technologies not found there.
+    """
+    if projects is None:
+        *techdata, reference_tech = read_csv_files(
+            techdata_filepaths(dir_path, filenames_base), cache_dir)
+        techdata = dict(zip(filenames_base, techdata))
+    else:
+        techdata, reference_tech = read_project_techdata(dir_path, filenames_base, cache_dir,
+                                                         projects)
 
-    reference_tech = pd.read_csv(
-        os.path.join(dir_path, 'technology_reference_mapping.csv')
-    )
+    for fnb, df in techdata.items():
+        df.insert(0, "Industry", fnb, True)
+    techdata = pd.concat(techdata.values())
 
     return techdata, reference_tech
 
 
-def read_raw_scenario_data(dirpath: str):
-    co2prices = pd.read_csv(os.path.join(dirpath, 'prices_co2.csv'))
+def read_project_techdata(dir_path: str, filenames_base: list, cache_dir: str,
+                          projects: pd.DataFrame):
+    reference_tech = read_csv(reference_filepath(dir_path), cache_dir)
+    technologies = project_technologies(projects, reference_tech)
+
+    industries = set(projects['Industry']) if 'Industry' in projects.columns else set()
+    first = [fnb for fnb in filenames_base if fnb in industries]
+    techdata = dict(zip(first, read_csv_files(industry_filepaths(dir_path, first), cache_dir)))
+    missing = technologies.difference(*[df['Technology'] for df in techdata.values()])
+    if missing:
+        others = [fnb for fnb in filenames_base if fnb not in techdata]
+        for fnb, df in zip(others, read_csv_files(industry_filepaths(dir_path, others),
+                                                  cache_dir)):
+            if not missing.isdisjoint(df['Technology']):
+                techdata[fnb] = df
+
+    if not techdata:
+        raise Exception('No techdata found for the technologies of the projects.')
+    # in the order of the techdata files, as when all are read
+    return {fnb: techdata[fnb] for fnb in filenames_base if fnb in techdata}, reference_tech
+
+
+def project_technologies(projects: pd.DataFrame, reference_tech: pd.DataFrame):
+    """ Technologies for which the projects need techdata (see split_technology_names) """
+    technologies = set(projects['Technology'])
+    technologies |= set(reference_tech.loc[reference_tech['Technology'].isin(technologies),
+                                           'Reference Technology'])
+    if 'Industry' in projects.columns:
+        dri = projects.loc[projects['Industry'] == 'steel_dri', 'Technology']
+        technologies |= set(dri + '-H2') | set(dri + '-NG')
+    return technologies
+
+
+def techdata_filepaths(dir_path: str, filenames_base: list):
+    return industry_filepaths(dir_path, filenames_base) + [reference_filepath(dir_path)]
+
+
+def industry_filepaths(dir_path: str, filenames_base: list):
+    return [os.path.join(dir_path, fnb + '.csv') for fnb in filenames_base]
+
+
+def reference_filepath(dir_path: str):
+    return os.path.join(dir_path, 'technology_reference_mapping.csv')
+
+
+def read_raw_scenario_data(dirpath: str, cache_dir: str = None):
+    co2prices, fuel_prices, h2share, free_allocations, absolute_standard_deviations \
+        = read_csv_files(scenario_filepaths(dirpath), cache_dir)
     co2prices.insert(0, 'Component', 'CO2', True)
-    fuel_prices = pd.read_csv(os.path.join(dirpath, 'prices_fuels.csv'))
     prices = pd.concat([co2prices, fuel_prices])
-    h2share = pd.read_csv(os.path.join(dirpath, 'h2share.csv'))
-    free_allocations = pd.read_csv(os.path.join(dirpath, 'free_allocations.csv'))
-    absolute_standard_deviations = pd.read_csv(os.path.join(dirpath, 'standard_deviations.csv'))
     # cbam_factor = pd.read_csv(os.path.join(dirpath,'cbam_factor.csv'))
     return prices, free_allocations, h2share, absolute_standard_deviations
+
+
+def scenario_filepaths(dirpath: str):
+    filenames = ['prices_co2', 'prices_fuels', 'h2share', 'free_allocations',
+                 'standard_deviations']
+    return [os.path.join(dirpath, fn + '.csv') for fn in filenames]
+
+
+def input_filepaths(config: dict):
+    """ All input files read by the setup """
+    return [config['projects_file']] \
+        + techdata_filepaths(config['techdata_dir'], config['techdata_files']) \
+        + scenario_filepaths(config['scenarios_dir'])
@@ -29,6 +29,15 @@ def select_h2share(h2share_raw: pd.DataFrame,
     return h2share
 
 
+def scenario_key(scenarios):
+    """ Hashable (and order-preserving) representation of a scenario selection. """
+    if isinstance(scenarios, dict):
+        return tuple((k, scenario_key(v)) for k, v in scenarios.items())
+    if isinstance(scenarios, list):
+        return tuple(scenario_key(v) for v in scenarios)
+    return scenarios
+
+
 def choose_by_scenario_dict(data_all: pd.DataFrame, scenarios: dict):
     return pd.concat([
         data_all
@@ -1,7 +1,23 @@
+import copy
+import threading
 import numpy as np
 import pandas as pd
-from .read_input import read_config, read_projects, read_techdata, read_raw_scenario_data
-from .select_scenario_data import select_prices, select_free_allocations, select_h2share
+from .read_input import read_config, read_projects, read_projects_header, read_techdata, \
+    read_raw_scenario_data
+from .select_scenario_data import select_prices, select_free_allocations, select_h2share, \
+    scenario_key
+from .techdata_index import build_techdata_index, fill_techdata_index
+from .input_cache import input_cache_dir
+from ..tools.profiling import profiled
+from ..tools.tools import with_column
+
+
+# attributes from which the selections in the selection cache are made
+selection_inputs = ['prices_raw', 'free_allocations_raw', 'h2share_raw', 'projects_all']
+# config keys on which the data read by the setup depends (see with_config)
+input_keys = ['techdata_dir', 'techdata_files', 'scenarios_dir', 'projects_file', 'streaming',
+              'study_horizon', 'use_input_cache', 'cache_dir', 'filter_by']
+project_keys = ['default_wacc', 'do_overwrite_project_start_year', 'project_start_year_overwrite']
 
 
 class Setup():
@@ -11,9 +27,12 @@ class Setup():
     Prices, free allocations and h2share are read in as "raw" and can then be selected/modified by
     the class methods below.
     For the projects DF, a version with all projects and one with currently selected ones exists.
+    A setup is immutable once constructed: The with_* methods and replace return a new setup, which
+    shares all unchanged data with the original one. Shared data frames must not be modified in
+    place.
     """
 
-    def __init__(self, config_filepath: str = None, config: dict = None):
+    def __init__(self, config_filepath: str = None, config: dict = None, filter_by: dict = None):
 
         # parameter dictionary read in from a yml file
         self.config = None
@@ -22,11 +41,16 @@ class Setup():
         self.projects_current = None
         # techno-economic parameters (energy demands, costs, emissions) per technology
         self.techdata = None
+        # lookup structures for techdata, with its row positions (see techdata_index.py);
+        # rebuilt with with_techdata
+        self.techdata_index = None
         # reference technology under EU ETS
         self.reference_tech = None
         # time series for co2, energy carrier and feedstock prices
         self.prices_raw = None
         self.prices = None
+        # hashable key of the scenarios currently selected by with_scenario_data
+        self.selected_scenarios = None
         # ETS free allocations
         self.free_allocations_raw = None
         self.free_allocations = None
@@ -36,6 +60,11 @@ class Setup():
         self.h2share = None
         # absolute standard deviation scenarios for sensitivities implementation
         self.abs_std_raw = None
+        # list of several sets of prices and techdata to be evaluated at once by the array engine
+        # (see calc_cost_and_emissions_array.py); None means only the setup's own inputs
+        self.input_variants = None
+        # memoized results of scenario selections from the raw data (see memoized)
+        self.selection_cache = SelectionCache()
 
         if config_filepath is None and config is not None:
             self.config = config
@@ -43,40 +72,214 @@ class Setup():
             self.config = read_config(config_filepath)
         else:
             raise Exception('Specify either config_filepath or config dict.')
+        self.config = with_filter_by(self.config, filter_by)
 
-        if self.config['mode'] not in ['analyze_cost', 'auction']:
-            raise Exception('Invalid mode')
+        check_mode(self.config)
 
-        self.all_years = pd.DataFrame.from_dict({'Period': np.arange(2020, 2061)})
+        first_year, last_year = self.config.get('study_horizon', [2020, 2060])
+        self.all_years = pd.DataFrame.from_dict({'Period': np.arange(first_year, last_year + 1)})
 
-        self.projects_all = read_projects(self.config)
+        self.projects_all = read_setup_projects(self.config)
         self.projects_current = self.projects_all
 
+        # with filter_by, only the techdata files needed for the filtered projects are read
         self.techdata, self.reference_tech = read_techdata(
             self.config['techdata_dir'],
-            self.config['techdata_files']
+            self.config['techdata_files'],
+            cache_dir=input_cache_dir(self.config),
+            projects=self.projects_all if self.config.get('filter_by')
+            and self.config.get('streaming') is None else None
         )
+        self.techdata_index = build_techdata_index(self.techdata)
 
         # h2_share is actually share of "new" fuel mix, name is slightly misleading
         # everything is read in as raw data first, scenarios later pick the relevant data
         self.prices_raw, self.free_allocations_raw, self.h2share_raw, self.abs_std_raw \
-            = read_raw_scenario_data(dirpath=self.config['scenarios_dir'])
+            = read_raw_scenario_data(dirpath=self.config['scenarios_dir'],
+                                     cache_dir=input_cache_dir(self.config))
 
+        self._is_frozen = True
         return
 
-    def select_scenario_data(self, scenarios: dict):
+    def __setattr__(self, name: str, value):
+        if self.__dict__.get('_is_frozen', False):
+            raise AttributeError(f"Setup is immutable; Use setup.replace({name}=...) or the "
+                                 f"with_* methods to derive a modified setup.")
+        super().__setattr__(name, value)
+
+    def replace(self, **changes):
+        """
+        Setup with the given attributes replaced, which shares all other data with this one.
+        The selection cache is not kept if data it is selected from is replaced.
+        """
+        invalid = [name for name in changes if name not in self.__dict__]
+        if invalid:
+            raise AttributeError(f"Invalid setup attributes: {', '.join(invalid)}")
+        if any(name in changes for name in selection_inputs) and 'selection_cache' not in changes:
+            changes['selection_cache'] = SelectionCache()
+        setup = copy.copy(self)
+        # copies are frozen as well, so the attributes are set directly
+        setup.__dict__.update(changes)
+        return setup
+
+    def with_config(self, config: dict):
+        """
+        Setup for another config; Input data is only read again if the config keys it depends on
+        differ, otherwise it is shared with this setup.
+        """
+        changed = [key for key in set(config) | set(self.config)
+                   if config.get(key) != self.config.get(key)]
+        if any(key in changed for key in input_keys):
+            return Setup(config=config)
+        check_mode(config)
+        if any(key in changed for key in project_keys):
+            projects = read_setup_projects(config)
+            return self.replace(config=config, projects_all=projects, projects_current=projects)
+        return self.replace(config=config)
+
+    def with_projects(self, projects_current: pd.DataFrame):
+        """ Setup with another selection of current projects """
+        return self.replace(projects_current=projects_current)
+
+    def with_techdata(self, techdata: pd.DataFrame):
+        """
+        Setup with other techdata and its lookup index;
+        Always use this instead of replacing techdata directly.
         """
-        - Select by the scenario names given in the config;
+        return self.replace(techdata=techdata, techdata_index=build_techdata_index(techdata))
+
+    def with_techdata_values(self, values: np.ndarray):
+        """
+        Setup with other techdata values (one per row); All other techdata columns are shared, and
+        the lookup index is filled from the row positions instead of being rebuilt.
+        """
+        return self.replace(techdata=with_column(self.techdata, 'Value', values),
+                            techdata_index=fill_techdata_index(self.techdata_positions(), values))
+
+    def techdata_positions(self):
+        """ Techdata index of row positions (see techdata_index.py) """
+        return self.techdata_index['Positions']
+
+    def with_price_values(self, values: np.ndarray):
+        """ Setup with other values of the selected prices; All other columns are shared. """
+        return self.replace(prices=with_column(self.prices, 'Price', values))
+
+    @profiled
+    def with_scenario_data(self, scenarios: dict):
+        """
+        Setup with the scenario data selected
+        - by the scenario names given in the config (or the config key of a scenario dict);
         - Transform: Calendar years are columns in the raw data and rows in the selected data.
         """
         if isinstance(scenarios, str):
             scenarios = self.config[scenarios]
-        self.prices = select_prices(self.prices_raw, scenarios)
-        self.free_allocations = select_free_allocations(self.free_allocations_raw, scenarios)
+        return self.replace(
+            selected_scenarios=scenario_key(scenarios),
+            prices=self.get_selected_prices(scenarios),
+            free_allocations=self.memoized(
+                ('free_allocations', scenario_key(scenarios['free_allocations'])),
+                lambda: select_free_allocations(self.free_allocations_raw, scenarios)
+            ),
+        )
+
+    def get_selected_prices(self, scenarios: dict):
+        """ Prices selected by the scenario dict (without setting them as current prices). """
+        return self.memoized(
+            ('prices', scenario_key(scenarios['prices'])),
+            lambda: select_prices(self.prices_raw, scenarios)
+        )
 
-    def select_h2share(self, auction_year: int = None):
+    @profiled
+    def with_h2share(self, auction_year: int = None):
         """
-        - Select by the h2 share scenario names given in the projects df for each project
+        Setup with the h2share of the current projects selected
+        - by the h2 share scenario names given in the projects df for each project
         - Transform: Ooperation years are columns in the raw data and rows in the selected data.
         """
-        self.h2share = select_h2share(self.h2share_raw, self.projects_current, auction_year)
+        if auction_year is None:
+            # periods depend on the projects' individual time of investment
+            if self.projects_current is self.projects_all:
+                # the selection cache is not kept if projects_all is replaced
+                projects_key = 'all projects'
+            else:
+                projects_key = scenario_key(
+                    self.projects_current.filter(
+                        ['Project name', 'H2 Share Scenario', 'Time of investment']
+                    ).values.tolist()
+                )
+            h2share = self.memoized(
+                ('h2share', projects_key),
+                lambda: select_h2share(self.h2share_raw, self.projects_current)
+            )
+        else:
+            # periods only depend on the auction year, so all projects are selected at once
+            h2share_all = self.memoized(
+                ('h2share', auction_year),
+                lambda: select_h2share(self.h2share_raw, self.projects_all, auction_year)
+            )
+            h2share = h2share_all[
+                h2share_all['Project name'].isin(self.projects_current['Project name'])] \
+                .reset_index(drop=True)
+        return self.replace(h2share=h2share)
+
+    def memoized(self, key: tuple, select_func):
+        """
+        Return the result of select_func() for this key from the selection cache, or calculate and
+        store it. Cached frames are shared, so they must not be modified in place.
+        """
+        return self.selection_cache.get(key, select_func)
+
+
+class SelectionCache():
+    """
+    Memoized scenario selections by key, shared by the setups derived from one setup (until the
+    data they are selected from is replaced). Setups may be used by several threads, so entries
+    are only read and added under a lock; A selection is calculated by one thread only.
+    """
+
+    def __init__(self, entries: dict = None):
+        self.entries = {} if entries is None else dict(entries)
+        self.lock = threading.RLock()
+
+    def get(self, key: tuple, select_func):
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = select_func()
+            return self.entries[key]
+
+    def copy(self, keep=None):
+        """ New cache with the entries (or those whose key is kept by keep(key)) """
+        with self.lock:
+            return SelectionCache({key: value for key, value in self.entries.items()
+                                   if keep is None or keep(key)})
+
+    def __getstate__(self):
+        # the lock is not picklable; Unpickled caches get their own
+        with self.lock:
+            return {'entries': dict(self.entries)}
+
+    def __setstate__(self, state: dict):
+        self.entries = state['entries']
+        self.lock = threading.RLock()
+
+
+def check_mode(config: dict):
+    if config['mode'] not in ['analyze_cost', 'auction']:
+        raise Exception('Invalid mode')
+
+
+def with_filter_by(config: dict, filter_by: dict = None):
+    """
+    Config with the project filters ({column: value(s)} of the projects file) added to those of
+    its key 'filter_by'
+    """
+    if not filter_by:
+        return config
+    return config | {'filter_by': config.get('filter_by', {}) | filter_by}
+
+
+def read_setup_projects(config: dict):
+    if config.get('streaming') is None:
+        return read_projects(config)
+    # projects are read batch by batch when they are processed (see run_analyze_streaming)
+    return read_projects_header(config)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+
+def build_techdata_index(techdata: pd.DataFrame):
+    """
+    Lookup structures for the techdata (see build_index_tables), built once when the techdata is
+    set. They are filled from the index of row positions, which the index keeps with the values
+    (see fill_techdata_index), so that indices of other values can be filled from it as well.
+    """
+    return fill_techdata_index(build_techdata_positions(techdata),
+                               techdata['Value'].values.astype(float))
+
+
+def build_index_tables(techdata: pd.DataFrame):
+    """
+    Lookup structures for the techdata:
+    - 'Industry': Technology -> Industry
+    - 'Energy demand', 'Feedstock demand': Technology x Component demand matrices
+    - 'Demand': energy and feedstock demand in long format (Technology, Type, Component, Value)
+    - 'Components': unique list of all components of energy and feedstock demand, in the order
+      of their first occurrence (the order in which their cost is summed)
+    - 'High CAPEX', 'Low CAPEX', 'OPEX', 'Emissions': values per Technology
+    """
+
+    check_unique_techdata_keys(techdata)
+
+    def single_tech_param(query: str):
+        return techdata.query(query).set_index('Technology')['Value']
+
+    def demand_matrix(dtype: str):
+        return techdata \
+            .query(f"Type=='{dtype}'") \
+            .pivot(index='Technology', columns='Component', values='Value')
+
+    demand = techdata \
+        .query("Type=='Energy demand' | Type=='Feedstock demand'") \
+        .filter(["Technology", "Type", "Component", "Value"])
+
+    return {
+        'Industry': techdata
+        .filter(["Technology", "Industry"])
+        .drop_duplicates()
+        .set_index('Technology')['Industry'],
+        'Energy demand': demand_matrix('Energy demand'),
+        'Feedstock demand': demand_matrix('Feedstock demand'),
+        'Demand': demand,
+        'Components': pd.Index(demand['Component'].unique()),
+        'High CAPEX': single_tech_param("Type=='High CAPEX'"),
+        'Low CAPEX': single_tech_param("Type=='Low CAPEX'"),
+        'OPEX': single_tech_param("Type=='OPEX'"),
+        'Emissions': single_tech_param("Type=='Emissions' & Component == 'CO2'"),
+    }
+
+
+def build_techdata_positions(techdata: pd.DataFrame):
+    """
+    Techdata index holding the row positions in techdata instead of the values. The index of
+    any techdata with the same rows but other values can then be obtained by fill_techdata_index.
+    """
+    return build_index_tables(techdata.assign(Value=np.arange(len(techdata), dtype=float)))
+
+
+def fill_techdata_index(positions: dict, values: np.ndarray):
+    """
+    Techdata index for the given values (one per techdata row) from an index of row positions.
+    It additionally keeps the positions and values, such that lookups can be done for several
+    such indices at once (see stack_variants in calc_cost_and_emissions_array.py).
+    """
+
+    def fill(name: str, table):
+        if name in ['Industry', 'Components']:
+            return table
+        elif name == 'Demand':
+            return table.assign(Value=take_positions(table['Value'].values, values))
+        elif isinstance(table, pd.DataFrame):
+            return pd.DataFrame(take_positions(table.values, values),
+                                index=table.index, columns=table.columns)
+        else:
+            return pd.Series(take_positions(table.values, values),
+                             index=table.index, name=table.name)
+
+    index = {name: fill(name, table) for name, table in positions.items()}
+    index['Positions'] = positions
+    index['Values'] = values
+    return index
+
+
+def take_positions(positions: np.ndarray, values: np.ndarray):
+    """ values at the (float) row positions, NaN where positions are NaN """
+    positions = np.nan_to_num(positions, nan=-1.).astype(int)
+    values = np.concatenate([values, np.full(values.shape[:-1] + (1,), np.nan)], axis=-1)
+    return values[..., positions]
+
+
+def check_unique_techdata_keys(techdata: pd.DataFrame):
+    """
+    Duplicate (Technology, Type, Component) keys would silently multiply rows in the
+    downstream merges, and a technology must belong to exactly one industry.
+    """
+    duplicates = techdata[techdata.duplicated(['Technology', 'Type', 'Component'], keep=False)]
+    if not duplicates.empty:
+        keys = duplicates \
+            .filter(['Industry', 'Technology', 'Type', 'Component']) \
+            .drop_duplicates() \
+            .to_string(index=False)
+        raise Exception(f'Duplicate (Technology, Type, Component) entries in techdata:\n{keys}')
+
+    n_industries = techdata.groupby('Technology')['Industry'].nunique()
+    if (n_industries > 1).any():
+        techs = ", ".join(n_industries.index[n_industries > 1])
+        raise Exception(f'Technologies listed in several techdata files: {techs}')
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+
+
+# Minimal binary columnar storage format for data frames:
+# A frame is a directory with one .npy file per column and a meta.json with column names and
+# kinds. Numeric columns can be memory-mapped on read. String columns are dictionary-encoded,
+# i.e. stored as integer codes and a fixed-width unicode array of the unique values.
+# The index is not stored.
+# A frame can also be written in parts (e.g. batch by batch), i.e. as a directory of frames.
+
+META_FILE = 'meta.json'
+PART_PATTERN = re.compile(r'part-\d+')
+
+
+def write_frame(df: pd.DataFrame, dirpath: str):
+    """ Write df to dirpath; The directory is written to a temporary location and then moved. """
+
+    tmp_dirpath = f"{dirpath}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dirpath)
+
+    columns = []
+    for i_col, (cname, values) in enumerate(df.items()):
+        fname = f"c{i_col}"
+        if values.dtype.kind in 'biuf':
+            kind = 'numeric'
+            np.save(os.path.join(tmp_dirpath, fname + '.npy'), values.to_numpy())
+        elif values.dtype.kind == 'O' \
+                and pd.api.types.infer_dtype(values, skipna=True) in ['string', 'empty']:
+            kind = 'str'
+            codes, uniques = pd.factorize(values)
+            np.save(os.path.join(tmp_dirpath, fname + '.npy'), codes)
+            np.save(os.path.join(tmp_dirpath, fname + '_uniques.npy'),
+                    np.asarray(uniques, dtype=str))
+        else:
+            kind = 'object'
+            np.save(os.path.join(tmp_dirpath, fname + '.npy'), values.to_numpy(dtype=object),
+                    allow_pickle=True)
+        columns.append({'name': cname, 'file': fname, 'kind': kind, 'dtype': str(values.dtype)})
+
+    with open(os.path.join(tmp_dirpath, META_FILE), 'w') as f:
+        json.dump({'columns': columns, 'n_rows': len(df)}, f)
+
+    shutil.rmtree(dirpath, ignore_errors=True)
+    os.replace(tmp_dirpath, dirpath)
+
+
+def read_frame(dirpath: str, columns: list = None, mmap: bool = True, rows: np.ndarray = None):
+    """
+    Read a frame written by write_frame;
+    If mmap is True, numeric columns are memory-mapped instead of read into memory.
+    If rows (positions) are given, only these rows are read, and string columns only decoded for
+    them.
+    """
+
+    meta = read_meta(dirpath)
+    # with rows, the selected rows are copied from the memory-mapped columns
+    mmap_mode = 'r' if mmap or rows is not None else None
+
+    data = {}
+    for col in meta['columns']:
+        if columns is not None and col['name'] not in columns:
+            continue
+        fpath = os.path.join(dirpath, col['file'] + '.npy')
+        if col['kind'] == 'numeric':
+            values = np.load(fpath, mmap_mode=mmap_mode)
+            if meta['n_rows'] == 0:
+                values = values.astype(col['dtype'])
+        elif col['kind'] == 'str':
+            # code -1 (missing value) picks the NaN appended to the uniques
+            uniques = np.load(os.path.join(dirpath, col['file'] + '_uniques.npy'))
+            codes = np.load(fpath, mmap_mode='r')
+            if rows is not None:
+                codes = codes[rows]
+            values = np.append(uniques.astype(object), np.nan)[codes]
+        else:
+            values = np.load(fpath, allow_pickle=True)
+        if rows is not None and col['kind'] != 'str':
+            values = values[rows]
+        data[col['name']] = values
+
+    if columns is not None:
+        data = {cname: data[cname] for cname in columns if cname in data}
+
+    # Without memory-mapping, columns are copied into consolidated blocks like pd.read_csv does;
+    # Some pandas operations (e.g. pd.concat with all-NaN columns) depend on the block layout.
+    n_rows = meta['n_rows'] if rows is None else len(rows)
+    return pd.DataFrame(data, index=pd.RangeIndex(n_rows), copy=not mmap)
+
+
+def read_frame_rows(dirpath: str, row_filter: dict, columns: list = None, mmap: bool = True):
+    """ Read only the rows of a frame whose values are among the given ones for each column """
+    if not row_filter:
+        return read_frame(dirpath, columns, mmap=mmap)
+
+    filter_values = read_frame(dirpath, list(row_filter), mmap=True)
+    missing = [key for key in row_filter if key not in filter_values.columns]
+    if missing:
+        raise KeyError(f"Columns not found: {', '.join(missing)}")
+    return read_frame(dirpath, columns, mmap=mmap,
+                      rows=np.flatnonzero(matching_rows(filter_values, row_filter)))
+
+
+def matching_rows(df: pd.DataFrame, row_filter: dict):
+    """ Boolean mask of the rows of df whose values are among the given value(s) of each column """
+    rows = np.ones(len(df), dtype=bool)
+    for key, values in row_filter.items():
+        rows &= df[key].isin(np.atleast_1d(values)).values
+    return rows
+
+
+def read_meta(dirpath: str):
+    with open(os.path.join(dirpath, META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def is_frame(dirpath: str):
+    return os.path.isfile(os.path.join(dirpath, META_FILE))
+
+
+def write_part(df: pd.DataFrame, dirpath: str, i_part: int):
+    """ Write df as part i_part of the frame in dirpath """
+    write_frame(df, os.path.join(dirpath, f"part-{i_part:05d}"))
+
+
+def read_parts(dirpath: str, columns: list = None, mmap: bool = False):
+    """ Read all parts written by write_part, concatenated in the order of their number """
+    part_dirs = list_parts(dirpath)
+    if not part_dirs:
+        return pd.DataFrame(columns=columns)
+    return pd.concat([read_frame(pdir, columns, mmap) for pdir in part_dirs], ignore_index=True)
+
+
+def list_parts(dirpath: str):
+    """ Directories of all complete parts in dirpath, in the order of their number """
+    if not os.path.isdir(dirpath):
+        return []
+    return sorted(
+        os.path.join(dirpath, dname) for dname in os.listdir(dirpath)
+        if PART_PATTERN.fullmatch(dname) and is_frame(os.path.join(dirpath, dname))
+    )
+
@@ -1,7 +1,9 @@
 import pandas as pd
 from ..setup.setup import Setup
+from .profiling import profiled
 
 
+@profiled(max_growth=1)
 def merge_project_dfs(*dfs: pd.DataFrame):
     # if one df has 'Period' column, use that as 'left' (else the first)
     df_lhs = next((df for df in dfs if 'Period' in df.columns), dfs[0])
@@ -9,15 +11,29 @@ def merge_project_dfs(*dfs: pd.DataFrame):
     for df_rhs in dfs:
         if df_lhs is df_rhs:
             continue
-        elif 'Period' in df_rhs.columns:
-            df_out = df_out.merge(df_rhs, how='left', on=['Project name', 'Period'])
-        else:
-            df_out = df_out.merge(df_rhs, how='left', on=['Project name'])
+        keys = [k for k in ['Input variant', 'Project name', 'Period']
+                if has_key(df_out, k) and has_key(df_rhs, k)]
+        df_out = df_out.merge(df_rhs, how='left', on=keys)
     return df_out
 
 
+def has_key(df: pd.DataFrame, key: str):
+    return key in df.columns or key in df.index.names
+
+
+def variant_keys(df: pd.DataFrame):
+    """
+    With several input variants evaluated at once (see calc_cost_and_emissions_array.py),
+    all per-project aggregations are done separately for each variant.
+    """
+    return ['Input variant'] if has_key(df, 'Input variant') else []
+
+
+@profiled(max_growth=1)
 def add_tech_and_industry(project_df: pd.DataFrame, setup: Setup):
     if 'Technology' not in project_df.columns:
+        if 'Input variant' in project_df.index.names:
+            project_df = project_df.reset_index('Input variant')
         project_df = project_df \
             .merge(
                 setup.projects_current.filter(['Project name', 'Technology']),
@@ -25,14 +41,6 @@ def add_tech_and_industry(project_df: pd.DataFrame, setup: Setup):
                 on='Project name'
             )
 
-    industries = setup.techdata \
-        .filter(["Technology", "Industry"]) \
-        .drop_duplicates()
-
     project_df = project_df \
-        .merge(
-            industries,
-            how='left',
-            on="Technology"
-        )
+        .assign(Industry=lambda df: df['Technology'].map(setup.techdata_index['Industry']))
     return project_df
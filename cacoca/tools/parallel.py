@@ -0,0 +1,150 @@
+import contextlib
+import copy
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .shared_memory import SharedSetup, share_setup, attach_setup
+from ..setup.setup import SelectionCache
+
+
+# Worker processes receive the (read-only) setup once when they are started and keep it in
+# this module-level variable, so that only the small per-task items are sent for each task.
+# By default, the data of the setup is passed in shared memory (see shared_memory.py), such that
+# it is neither pickled for nor copied into each worker.
+# Within a worker, map_with_setup runs serially, so that nested pools are not started.
+# Within run_pool (e.g. a whole run), all calls with its number of workers share one pool, which
+# is started with the setup of the run on first use. Setups derived from it (e.g. with other
+# prices or projects) are sent to the workers as the attributes in which they differ from it
+# (see setup_changes).
+_worker_setup = None
+_in_worker = False
+_run_pool = None
+_run_pool_lock = threading.Lock()
+
+
+def map_with_setup(func: callable, setup, items: list, n_workers: int = 1):
+    """
+    Return [func(setup, item) for item in items], computed on a pool of n_workers processes
+    if n_workers > 1. Results are always returned in the order of items.
+    func has to be a module-level function, and must not modify the setup.
+    """
+    items = list(items)
+    n_workers = available_workers(n_workers)
+    if n_workers <= 1 or len(items) <= 1 or _in_worker:
+        return [func(setup, item) for item in items]
+
+    if use_run_pool(n_workers):
+        return list(get_run_pool().map(
+            functools.partial(call_with_worker_setup, func, setup_changes(setup)), items))
+    with worker_pool(setup, min(n_workers, len(items))) as pool:
+        return list(pool.map(functools.partial(call_with_worker_setup, func, {}), items))
+
+
+def imap_with_setup(func: callable, setup, items: list, n_workers: int = 1):
+    """
+    Generator of (position in items, func(setup, item)) in the order in which the items are
+    finished, computed as in map_with_setup.
+    """
+    items = list(items)
+    n_workers = available_workers(n_workers)
+    if n_workers <= 1 or len(items) <= 1 or _in_worker:
+        for i_item, item in enumerate(items):
+            yield i_item, func(setup, item)
+        return
+
+    with contextlib.ExitStack() as stack:
+        if use_run_pool(n_workers):
+            pool, changes = get_run_pool(), setup_changes(setup)
+        else:
+            pool = stack.enter_context(worker_pool(setup, min(n_workers, len(items))))
+            changes = {}
+        futures = {pool.submit(call_with_worker_setup, func, changes, item): i_item
+                   for i_item, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+@contextlib.contextmanager
+def run_pool(setup, n_workers: int):
+    """
+    Context in which calls of map_with_setup and imap_with_setup with n_workers use one pool,
+    started with this setup on first use, instead of a pool per call. Nested contexts use the
+    outer pool.
+    """
+    global _run_pool
+    n_workers = available_workers(n_workers)
+    if n_workers <= 1 or _in_worker or _run_pool is not None:
+        yield
+        return
+    with contextlib.ExitStack() as stack:
+        _run_pool = {'setup': setup, 'n_workers': n_workers, 'stack': stack, 'pool': None}
+        try:
+            yield
+        finally:
+            _run_pool = None
+
+
+def available_workers(n_workers: int):
+    """ Number of worker processes to use: at most one per CPU available to this process """
+    if n_workers is None:
+        return 1
+    if hasattr(os, 'sched_getaffinity'):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count() or 1
+    return max(min(n_workers, n_cpus), 1)
+
+
+def use_run_pool(n_workers: int):
+    return _run_pool is not None and _run_pool['n_workers'] == n_workers
+
+
+def get_run_pool():
+    with _run_pool_lock:
+        if _run_pool['pool'] is None:
+            _run_pool['pool'] = _run_pool['stack'].enter_context(
+                worker_pool(_run_pool['setup'], _run_pool['n_workers']))
+        return _run_pool['pool']
+
+
+def setup_changes(setup):
+    """ Attributes of setup which are not shared with the setup of the run pool """
+    run_setup = _run_pool['setup']
+    changes = {name: value for name, value in setup.__dict__.items()
+               if run_setup.__dict__.get(name) is not value}
+    if 'selection_cache' in changes:
+        # the workers select data again if needed, instead of receiving all selections
+        changes['selection_cache'] = SelectionCache()
+    return changes
+
+
+@contextlib.contextmanager
+def worker_pool(setup, n_workers: int):
+    with share_setup_if_enabled(setup) as shared, \
+            ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                initargs=(shared,)) as pool:
+        yield pool
+
+
+def share_setup_if_enabled(setup):
+    if setup.config.get('shared_memory', True):
+        return share_setup(setup)
+    return contextlib.nullcontext(setup)
+
+
+def init_worker(setup):
+    global _worker_setup, _in_worker
+    if isinstance(setup, SharedSetup):
+        setup = attach_setup(setup)
+    _worker_setup = setup
+    _in_worker = True
+
+
+def call_with_worker_setup(func: callable, changes: dict, item):
+    setup = _worker_setup
+    if changes:
+        # as in Setup.replace, without resetting the selection cache
+        setup = copy.copy(setup)
+        setup.__dict__.update(changes)
+    return func(setup, item)
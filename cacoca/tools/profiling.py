@@ -0,0 +1,145 @@
+import functools
+import json
+import os
+import time
+import tracemalloc
+import pandas as pd
+from .tools import log
+
+
+# Opt-in profiling of pipeline stages (config sub-dictionary 'profiling'):
+# Each call of a function decorated with @profiled is recorded with its wall time, the number of
+# rows of its largest input and of its output frame, and the number of output columns, together
+# with the current context (e.g. the auction round). With 'memory: True', the peak memory traced
+# by tracemalloc during the call is recorded as well (which slows down the run considerably).
+# Stages which must not add rows (merges on unique keys) are flagged if their output has more
+# rows than max_growth times their largest input.
+# When profiling is off, a stage call only adds the check of the module-level variable _profile.
+# Stages running in worker processes are not recorded.
+
+# profiling:
+#   report: 'output/profile.json'   # or .csv
+#   memory: False
+
+profiling_defaults = {
+    'report': 'output/profile.json',
+    'memory': False,
+}
+
+_profile = None
+
+
+def profiled(func: callable = None, max_growth: float = None):
+    if func is None:
+        return functools.partial(profiled, max_growth=max_growth)
+
+    @functools.wraps(func)
+    def profiled_wrapper(*args, **kwargs):
+        if _profile is None:
+            return func(*args, **kwargs)
+        return call_profiled(func, max_growth, args, kwargs)
+
+    return profiled_wrapper
+
+
+def start_profiling(config: dict):
+    """ Start recording stages, if enabled in the config """
+    global _profile
+    if config.get('profiling') is None:
+        return
+    profile_config = profiling_defaults | config['profiling']
+    if profile_config['memory']:
+        tracemalloc.start()
+    _profile = {
+        'config': profile_config,
+        'records': [],
+        'context': {},
+        'stack': [],
+        'start': time.perf_counter(),
+    }
+
+
+def stop_profiling():
+    """ Stop recording and write the report; Returns the records as a data frame """
+    global _profile
+    if _profile is None:
+        return None
+    profile, _profile = _profile, None
+    if profile['config']['memory']:
+        tracemalloc.stop()
+
+    records = pd.DataFrame(profile['records'])
+    write_report(records, profile['config']['report'])
+    log(f"Profiling report written to {profile['config']['report']}")
+    return records
+
+
+def set_context(**context):
+    """ Context (like the auction round) added to all following records """
+    if _profile is not None:
+        _profile['context'] = context
+
+
+def call_profiled(func: callable, max_growth: float, args: tuple, kwargs: dict):
+
+    profile = _profile
+    stack = profile['stack']
+    measure_memory = profile['config']['memory']
+
+    if measure_memory:
+        # peaks of nested stages are passed on to the enclosing stage
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    entry = {'peak': 0}
+    stack.append(entry)
+
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        wall_time = time.perf_counter() - start
+        stack.pop()
+
+    record = profile['context'] | {
+        'Stage': func.__name__,
+        'Depth': len(stack),
+        'Start [s]': start - profile['start'],
+        'Wall time [s]': wall_time,
+    }
+
+    if measure_memory:
+        peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        record['Peak memory [MB]'] = peak / 1e6
+
+    input_rows = max((len(arg) for arg in list(args) + list(kwargs.values())
+                      if isinstance(arg, pd.DataFrame)), default=None)
+    output = result if not isinstance(result, tuple) \
+        else next((r for r in result if isinstance(r, pd.DataFrame)), None)
+    is_frame = isinstance(output, pd.DataFrame)
+    record['Input rows'] = input_rows
+    record['Rows'] = len(output) if is_frame else None
+    record['Columns'] = len(output.columns) if is_frame else None
+
+    record['Row blow-up'] = max_growth is not None and is_frame and input_rows is not None \
+        and len(output) > max_growth * input_rows
+    if record['Row blow-up']:
+        log(f"  Warning: {func.__name__} returned {len(output)} rows "
+            f"for an input of {input_rows} rows")
+
+    profile['records'].append(record)
+    return result
+
+
+def write_report(records: pd.DataFrame, filepath: str):
+    dirpath = os.path.dirname(filepath)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+    if filepath.endswith('.csv'):
+        records.to_csv(filepath, index=False)
+    else:
+        with open(filepath, 'w') as f:
+            json.dump(json.loads(records.to_json(orient='records')), f, indent=1)
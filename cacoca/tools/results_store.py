@@ -0,0 +1,114 @@
+import os
+import shutil
+from urllib.parse import quote, unquote
+import numpy as np
+import pandas as pd
+from .columnar import write_part, list_parts, read_frame_rows, PART_PATTERN
+
+
+# Store of run results on disk (config key 'results_dir'):
+# Each dataset (e.g. 'yearly') is a directory, which is partitioned into subdirectories named
+# 'key=value' (e.g. 'Auction round=...' and 'Scenarios=bidding'). Each partition holds the frames
+# appended to it as numbered parts in the columnar format of columnar.py. On read, partitions are
+# selected by their directory names, rows are filtered part by part (with memory-mapped columns),
+# and the partition keys are added as columns.
+# Several runs can write to one store, each to its own partition (config key 'results_partition',
+# e.g. {'Variant': '0'} in batch runs, see batch.py), which is put first in each dataset.
+
+
+def clear_results(config: dict):
+    """
+    Start a new results store for a run, if enabled in the config; If the run writes to a
+    partition of a shared store (config key 'results_partition'), only this partition is removed.
+    Only datasets are removed: A results directory holding anything else raises an exception.
+    """
+    results_dir = config.get('results_dir')
+    if results_dir is None or not os.path.isdir(results_dir):
+        return
+    invalid = [name for name in os.listdir(results_dir)
+               if not is_dataset(os.path.join(results_dir, name))]
+    if invalid:
+        raise Exception(f"Results directory {results_dir} contains files not written by the "
+                        f"results store ({', '.join(sorted(invalid))}); Use a separate "
+                        f"directory.")
+    run_partition = config.get('results_partition', {})
+    for dataset in os.listdir(results_dir):
+        shutil.rmtree(os.path.join(results_dir, dataset, *partition_dirnames(run_partition)),
+                      ignore_errors=True)
+
+
+def is_dataset(dataset_dir: str):
+    """ Whether the directory only holds partition directories and parts (see write_part) """
+    if not os.path.isdir(dataset_dir):
+        return False
+    for dirpath, dirnames, filenames in os.walk(dataset_dir):
+        # parts, including those left in temporary directories (see write_frame)
+        dirnames[:] = [dname for dname in dirnames if not PART_PATTERN.match(dname)]
+        if filenames or not all('=' in dname for dname in dirnames):
+            return False
+    return True
+
+
+def store_results(config: dict, dataset: str, df: pd.DataFrame, **partition):
+    """ Append df to the partition of dataset, if the results store is enabled in the config """
+    results_dir = config.get('results_dir')
+    if results_dir is None:
+        return
+    partition = config.get('results_partition', {}) | partition
+    dirpath = os.path.join(results_dir, dataset, *partition_dirnames(partition))
+    write_part(df, dirpath, len(list_parts(dirpath)))
+
+
+def partition_dirnames(partition: dict):
+    return [f"{key}={quote(str(value), safe=' ()')}" for key, value in partition.items()]
+
+
+def read_results(results_dir: str, dataset: str, columns: list = None, mmap: bool = True,
+                 **filter_by):
+    """
+    Read a dataset from the results store. filter_by gives a value or list of values for
+    partition keys or columns (e.g. 'Project name', 'Industry' or 'Period'); Only matching rows
+    are read.
+    """
+
+    filter_by = {key: np.atleast_1d(values) for key, values in filter_by.items()}
+
+    frames = []
+    for partition, dirpath in get_partitions(os.path.join(results_dir, dataset)):
+        # partition values are strings
+        if not all(np.isin(value, filter_by[key].astype(str)) for key, value in partition.items()
+                   if key in filter_by):
+            continue
+        row_filter = {key: values for key, values in filter_by.items() if key not in partition}
+        part_columns = None if columns is None else [c for c in columns if c not in partition]
+        for part_dir in list_parts(dirpath):
+            df = read_frame_rows(part_dir, row_filter, part_columns, mmap=mmap)
+            if not df.empty:
+                frames.append(df.assign(**partition))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    return df if columns is None else df.filter(columns)
+
+
+def partition_keys(results_dir: str, dataset: str):
+    """ Partition keys of a dataset in the results store, in the order of its directories """
+    keys = []
+    for partition, _ in get_partitions(os.path.join(results_dir, dataset)):
+        keys += [key for key in partition if key not in keys]
+    return keys
+
+
+def get_partitions(dataset_dir: str):
+    """ (partition dict, directory) of all partitions of a dataset which contain parts """
+    partitions = []
+    for dirpath, dirnames, _ in os.walk(dataset_dir):
+        dirnames.sort()
+        if list_parts(dirpath):
+            keys_values = [dname.split('=', 1)
+                           for dname in os.path.relpath(dirpath, dataset_dir).split(os.sep)
+                           if '=' in dname]
+            partitions.append(({key: unquote(value) for key, value in keys_values}, dirpath))
+    return partitions
+
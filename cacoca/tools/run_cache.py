@@ -0,0 +1,112 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from ..setup.read_input import input_filepaths
+from ..setup.input_cache import input_cache_dir, content_hash
+from .tools import log
+
+
+# Cache of the results of whole runs (config key 'use_run_cache', default True):
+# An entry is keyed by a hash of the config, the contents of all input files read by the setup,
+# and the source code of this package (without the plotting routines in output/, which runs do not
+# use); It holds the pickled return value of the run.
+# Entries are stored in <cache_dir>/runs/. If their total size exceeds 'run_cache_max_mb', the
+# least recently used entries are removed.
+
+CACHE_VERSION = 1
+
+# config keys which only affect plotting and output, not the results of a run
+output_keys = ['show_figures', 'show_figs_in_browser', 'save_figures', 'crop_figures',
+               'output_dir', 'use_run_cache', 'run_cache_max_mb']
+
+
+def cached_run(run_func: callable, config: dict):
+    """ Return run_func(config) from the run cache, or calculate and store it. """
+
+    if not use_run_cache(config):
+        return run_func(config)
+
+    cache_dir = run_cache_dir(config)
+    key = run_key(config)
+    entry_path = os.path.join(cache_dir, key + '.pkl')
+
+    result = read_entry(entry_path)
+    if result is not None:
+        log(f"Using cached results of run {key[:12]}")
+        return result
+
+    result = run_func(config)
+    try:
+        write_entry(result, entry_path)
+        evict_entries(cache_dir, config.get('run_cache_max_mb', 1000) * 1e6, keep=entry_path)
+    except (OSError, pickle.PicklingError) as e:
+        log(f"Could not write run cache: {e}")
+    return result
+
+
+def use_run_cache(config: dict):
+    # runs writing their results to disk or profiling their stages are not cached
+    return config.get('use_run_cache', True) \
+        and config.get('results_dir') is None \
+        and config.get('streaming') is None \
+        and config.get('profiling') is None
+
+
+def run_cache_dir(config: dict):
+    return os.path.join(config.get('cache_dir', '.cache/'), 'runs')
+
+
+def run_key(config: dict):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(CACHE_VERSION).encode('utf-8'))
+    relevant_config = {k: v for k, v in config.items() if k not in output_keys}
+    h.update(json.dumps(relevant_config, sort_keys=True, default=str).encode('utf-8'))
+    for filepath in input_filepaths(config):
+        h.update(content_hash(filepath, input_cache_dir(config)).encode('utf-8'))
+    for filepath in source_filepaths():
+        with open(filepath, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def source_filepaths():
+    """ Source files on which the results of runs depend """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join(package_dir, 'output', '')
+    return sorted(fp for fp in glob.glob(os.path.join(package_dir, '**', '*.py'), recursive=True)
+                  if not fp.startswith(output_dir))
+
+
+def read_entry(entry_path: str):
+    try:
+        with open(entry_path, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    # mark as recently used
+    os.utime(entry_path)
+    return result
+
+
+def write_entry(result, entry_path: str):
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    tmp_path = f"{entry_path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, entry_path)
+
+
+def evict_entries(cache_dir: str, max_bytes: float, keep: str = None):
+    """ Remove least recently used entries (except keep) until the total size is below max_bytes """
+    entries = sorted(
+        ((os.stat(path), path) for path in glob.glob(os.path.join(cache_dir, '*.pkl'))),
+        key=lambda entry: entry[0].st_mtime_ns, reverse=True
+    )
+    total_bytes = 0
+    for stat, path in entries:
+        total_bytes += stat.st_size
+        if total_bytes > max_bytes and path != keep:
+            os.remove(path)
@@ -1,9 +1,13 @@
 import pandas as pd
 import numpy as np
-import copy
+import functools
 from ..setup.setup import Setup
 from ..setup.select_scenario_data import choose_by_scenario, years_to_rows
 from .common_merges import merge_project_dfs
+from .parallel import map_with_setup
+from ..setup.techdata_index import fill_techdata_index
+from .tools import with_column
+from ..calc.calc_cost_and_emissions_array import input_variant
 
 
 # format in config:
@@ -16,29 +20,219 @@ from .common_merges import merge_project_dfs
 #   filters:
 #     Component: 'CO2'
 
+# in sensitivity_mode 'monte_carlo', additionally (all keys optional):
+
+# monte_carlo:
+#   n_samples: 1000
+#   seed: 0
+#   chunk_size: 100
+#   workers: 1
+#   correlation:
+#   - [1., 0.5]
+#   - [0.5, 1.]
+#   bounds: [0.025, 0.975]
+#   quantiles: [0.05, 0.5, 0.95]
+
+monte_carlo_defaults = {
+    'n_samples': 1000,
+    'seed': 0,
+    'chunk_size': 100,
+    'workers': 1,
+    'correlation': None,
+    'bounds': [0.025, 0.975],
+    'quantiles': [0.05, 0.5, 0.95],
+}
+
 
 index_vars = ['Project name', 'Technology', 'Industry', 'Period']
 
+# outputs which do not depend on prices (also with the suffixes '_ref' and '_diff')
+price_independent_vars = ['CAPEX annuity', 'CAPEX total', 'Additional OPEX', 'Emissions',
+                          'Free Allocations', 'Size']
+
 
 def var_names(df: pd.DataFrame):
     return df.columns.difference(index_vars)
 
 
+def keeps_jacobian(config: dict):
+    """ Whether runs with sensitivities return the jacobian with their output """
+    return config.get('sensitivity_mode', 'rerun') == 'jacobian' \
+        and config.get('sensitivity_keep_jacobian', False)
+
+
 def with_sensitivities(run_func):
+    """
+    Adds bounds of all output variables for the uncertain parameters to the output of run_func;
+    With sensitivity_keep_jacobian, the wrapped function returns (output, jacobian).
+    """
+    @functools.wraps(run_func)
     def sensitivity_wrapper(setup: Setup):
-        output_base = run_func(setup)
-        variance_sum = init_variance_sum(output_base)
         cfg_dicts = setup.config.get('uncertain_parameters', [])
-        for cfg_uct_prm in cfg_dicts:
-            setup_disturbed = copy.copy(setup)
-            disturb_input(setup_disturbed, cfg_uct_prm)
-            output_disturbed = run_func(setup_disturbed)
-            variance_sum = sensitivity_to_variance(variance_sum, output_base, output_disturbed)
+        sensitivity_mode = setup.config.get('sensitivity_mode', 'rerun')
+        if sensitivity_mode == 'monte_carlo':
+            return calc_monte_carlo(sensitivity_wrapper, setup, cfg_dicts)
+        elif sensitivity_mode == 'jacobian':
+            output_base, jacobian = calc_jacobian(run_func, setup, cfg_dicts)
+            variance_sum = jacobian_to_variance(output_base, jacobian)
+            if keeps_jacobian(setup.config):
+                return get_bounds(output_base, variance_sum), jacobian
+        else:
+            output_base = run_func(setup)
+            variance_sum = init_variance_sum(output_base)
+            # the wrapper (not run_func itself) can be pickled to be sent to worker processes
+            outputs_disturbed = map_with_setup(
+                run_disturbed,
+                setup,
+                [(sensitivity_wrapper, cfg_uct_prm) for cfg_uct_prm in cfg_dicts],
+                n_workers=setup.config.get('sensitivity_workers', 1)
+            )
+            # reduce in the order of the uncertain parameters for reproducible results
+            for output_disturbed in outputs_disturbed:
+                variance_sum = sensitivity_to_variance(variance_sum, output_base, output_disturbed)
         output_base = get_bounds(output_base, variance_sum)
         return output_base
     return sensitivity_wrapper
 
 
+def run_disturbed(setup: Setup, wrapper_and_cfg: tuple):
+    """ Run the undecorated function with one disturbed uncertain parameter. """
+    sensitivity_wrapper, cfg_uct_prm = wrapper_and_cfg
+    return sensitivity_wrapper.__wrapped__(disturb_input(setup, cfg_uct_prm))
+
+
+def calc_jacobian(run_func: callable, setup: Setup, cfg_dicts: list):
+    """
+    The jacobian contains the differences of all output variables for each uncertain
+    parameter, disturbed by its standard deviation, i.e. q(p_i + sigma_i) - q(p_i).
+    As the output is linear in each price, those of price parameters are formed from the
+    per-component cost columns of the base output (see price_derivatives). Parameters for which
+    this is not possible (see has_price_derivatives) are evaluated as batched finite differences:
+    Each adds an input variant to the single run of the array engine for the base output.
+    The jacobian is returned in long format with the index of the uncertain parameter in the
+    column 'Uncertain parameter'.
+    """
+    i_prms_disturbed = [i_prm for i_prm, cfg_uct_prm in enumerate(cfg_dicts)
+                        if not has_price_derivatives(setup, cfg_uct_prm)]
+    setup_batched = setup.replace(
+        config=setup.config | {'calc_engine': 'array'},
+        input_variants=[input_variant(setup)] + [
+            input_variant(disturb_input(setup, cfg_dicts[i_prm])) for i_prm in i_prms_disturbed]
+    )
+
+    output_all = run_func(setup_batched)
+    outputs = [
+        sort_df(df.drop(columns=['Input variant']))
+        for _, df in output_all.groupby('Input variant', sort=True)
+    ]
+    output_base = outputs[0]
+    outputs_disturbed = dict(zip(i_prms_disturbed, outputs[1:]))
+    vns = var_names(output_base)
+
+    jacobian = []
+    for i_prm, cfg_uct_prm in enumerate(cfg_dicts):
+        derivatives = output_base.copy()
+        if i_prm in outputs_disturbed:
+            derivatives[vns] = outputs_disturbed[i_prm][vns].values - output_base[vns].values
+        else:
+            for vn, values in price_derivatives(setup, output_base, cfg_uct_prm).items():
+                derivatives[vn] = values
+        derivatives.insert(0, 'Uncertain parameter', i_prm)
+        jacobian.append(derivatives)
+    jacobian = pd.concat(jacobian) if jacobian \
+        else output_base.iloc[:0].assign(**{'Uncertain parameter': 0})
+
+    return output_base, jacobian
+
+
+def has_price_derivatives(setup: Setup, cfg_uct_prm: dict):
+    """
+    Whether the derivatives w.r.t. an uncertain parameter can be formed from the base output (see
+    price_derivatives): It has to be a price parameter, the disturbed prices must not be zero, and
+    no disturbed component may be both an energy and a feedstock component, since energy cost is
+    not kept per component.
+    """
+    if cfg_uct_prm['data_frame'] != 'prices':
+        return False
+    is_disturbed = get_disturbance(setup, cfg_uct_prm) != 0.
+    if np.any(setup.prices['Price'].values[is_disturbed] == 0.):
+        return False
+    both = setup.techdata_index['Energy demand'].columns \
+        .intersection(setup.techdata_index['Feedstock demand'].columns)
+    return not np.isin(setup.prices['Component'].values[is_disturbed], both).any()
+
+
+def price_derivatives(setup: Setup, output: pd.DataFrame, cfg_uct_prm: dict):
+    """
+    Derivatives of all output variables w.r.t. a price parameter (see has_price_derivatives):
+    The cost of a component, the CO2 price and the effective CO2 price are proportional to the
+    price of their component, so their derivatives are their values times the relative
+    disturbance (std / price) in their period. Cost and energy cost are sums of component cost,
+    and abatement cost is proportional to the cost difference. Missing prices are skipped in the
+    sums, as in the cost calculation. Returns a dict {output variable: derivatives}.
+    """
+    prices = setup.prices
+    std = get_disturbance(setup, cfg_uct_prm)
+    relative = pd.DataFrame({
+        'Component': prices['Component'].values,
+        'Period': prices['Period'].values,
+        'relative': np.divide(std, prices['Price'].values, out=np.zeros(len(prices)),
+                              where=std != 0.),
+    }).pivot(index='Period', columns='Component', values='relative')
+
+    relative_by_row = {}
+
+    def relative_disturbance(component: str):
+        if component not in relative_by_row:
+            relative_by_row[component] = np.zeros(len(output)) \
+                if component not in relative.columns \
+                else relative[component].reindex(output['Period'], fill_value=0.).values
+        return relative_by_row[component]
+
+    def sum_of_components(vn: str, name: str, components: list):
+        suffix = vn[len(name):]
+        terms = [np.zeros(len(output))] + [derivatives[f"cost_{c}{suffix}"] for c in components]
+        # NaN where the variable is NaN, as the difference of two runs would be
+        return np.nansum(np.stack(terms), axis=0) + 0. * output[vn].values
+
+    energy_components = setup.techdata_index['Energy demand'].columns
+    components = [vn[len('cost_'):] for vn in var_names(output)
+                  if vn.startswith('cost_') and not vn.endswith(('_ref', '_diff'))]
+    derivatives = {}
+    for vn in var_names(output):
+        name = vn.removesuffix('_ref').removesuffix('_diff')
+        if name.startswith('cost_'):
+            derivatives[vn] = relative_disturbance(name[len('cost_'):]) * output[vn].values
+        elif name in ['CO2 Price', 'Effective CO2 Price']:
+            derivatives[vn] = relative_disturbance('CO2') * output[vn].values
+        elif name in price_independent_vars:
+            derivatives[vn] = 0. * output[vn].values
+    for vn in var_names(output):
+        name = vn.removesuffix('_ref').removesuffix('_diff')
+        if name == 'cost':
+            derivatives[vn] = sum_of_components(vn, name, components)
+        elif name == 'Energy cost':
+            derivatives[vn] = sum_of_components(
+                vn, name, [c for c in components if c in energy_components])
+    if 'Abatement_cost' in output.columns:
+        derivatives['Abatement_cost'] = derivatives['cost_diff'] / -output['Emissions_diff'].values
+
+    invalid = [vn for vn in var_names(output) if vn not in derivatives]
+    if invalid:
+        raise Exception(f"Derivatives of {', '.join(invalid)} w.r.t. prices cannot be formed "
+                        f"from the output; Use sensitivity_mode 'rerun'.")
+    return derivatives
+
+
+def jacobian_to_variance(output_base: pd.DataFrame, jacobian: pd.DataFrame):
+    """ Linear error propagation for independent parameters: sum of squared derivatives. """
+    variance_sum = init_variance_sum(output_base)
+    for _, derivatives in jacobian.groupby('Uncertain parameter'):
+        for vn in var_names(output_base):
+            variance_sum[vn] += derivatives[vn].values ** 2
+    return variance_sum
+
+
 def init_variance_sum(base: pd.DataFrame):
     variance_sum = base.copy()
     variance_sum[var_names(base)] = 0.
@@ -60,6 +254,136 @@ def sensitivity_to_variance(variance_sum: pd.DataFrame, output_base: pd.DataFram
     return variance_sum
 
 
+def calc_monte_carlo(sensitivity_wrapper: callable, setup: Setup, cfg_dicts: list):
+    """
+    Evaluate random samples of all uncertain parameters (normally distributed, optionally
+    correlated). The samples of each chunk are evaluated as input variants in one batched run of
+    the array engine; Chunks can be distributed to worker processes.
+    Returns the undisturbed output with bounds and quantiles over all samples.
+    """
+    mc_config = get_monte_carlo_config(setup.config)
+    output_base = sort_df(sensitivity_wrapper.__wrapped__(setup))
+    sample_outputs = map_with_setup(
+        run_samples,
+        setup,
+        [(sensitivity_wrapper, chunk) for chunk in get_sample_chunks(mc_config)],
+        n_workers=mc_config['workers']
+    )
+    return get_quantiles(output_base, np.concatenate(sample_outputs), mc_config)
+
+
+def run_samples(setup: Setup, wrapper_and_chunk: tuple):
+    """
+    Run the undecorated function for one chunk of samples;
+    Returns the output variables as array of shape (sample x row x variable).
+    """
+    sensitivity_wrapper, chunk = wrapper_and_chunk
+    cfg_dicts = setup.config.get('uncertain_parameters', [])
+    samples = draw_samples(get_monte_carlo_config(setup.config), len(cfg_dicts), chunk)
+
+    setup_batched = setup.replace(config=setup.config | {'calc_engine': 'array'},
+                                  input_variants=get_sample_variants(setup, cfg_dicts, samples))
+
+    output = sensitivity_wrapper.__wrapped__(setup_batched) \
+        .sort_values(['Input variant', 'Project name', 'Period'])
+    vns = var_names(output.drop(columns=['Input variant']))
+    return output[vns].to_numpy(dtype=float).reshape(len(samples), -1, len(vns))
+
+
+def get_quantiles(base: pd.DataFrame, sample_values: np.ndarray, mc_config: dict):
+    """ Add bounds and quantiles over the samples (sample x row x variable) to base """
+    vns = var_names(base)
+    lower, upper = np.quantile(sample_values, mc_config['bounds'], axis=0)
+    quantiles = np.quantile(sample_values, mc_config['quantiles'], axis=0)
+    for i_vn, vname in enumerate(vns):
+        if np.any(upper[:, i_vn] - lower[:, i_vn] > 1.e-10):
+            base[vname + '_lower'] = lower[:, i_vn]
+            base[vname + '_upper'] = upper[:, i_vn]
+            for q, values in zip(mc_config['quantiles'], quantiles):
+                base[f"{vname}_q{100. * q:g}"] = values[:, i_vn]
+    return base
+
+
+def get_monte_carlo_config(config: dict):
+    return monte_carlo_defaults | config.get('monte_carlo', {})
+
+
+def get_sample_chunks(mc_config: dict):
+    """
+    (chunk index, index of first sample, number of samples) for all chunks of samples.
+    Each chunk has its own random stream, so that the samples do not depend on how the chunks
+    are distributed to worker processes.
+    """
+    n_samples, chunk_size = mc_config['n_samples'], mc_config['chunk_size']
+    return [
+        (i_chunk, first_sample, min(chunk_size, n_samples - first_sample))
+        for i_chunk, first_sample in enumerate(range(0, n_samples, chunk_size))
+    ]
+
+
+def draw_samples(mc_config: dict, n_params: int, chunk: tuple):
+    """ Samples of one chunk in units of standard deviations (sample x uncertain parameter) """
+    i_chunk, _, n_samples = chunk
+    seed_sequence = np.random.SeedSequence(mc_config['seed'], spawn_key=(i_chunk,))
+    samples = np.random.default_rng(seed_sequence).standard_normal((n_samples, n_params))
+    if mc_config['correlation'] is not None:
+        samples = samples @ get_cholesky_factor(mc_config['correlation'], n_params).T
+    return samples
+
+
+def get_cholesky_factor(correlation: list, n_params: int):
+    correlation = np.asarray(correlation, dtype=float)
+    if correlation.shape != (n_params, n_params):
+        raise Exception('Monte Carlo correlation matrix must be of size '
+                        f'{n_params} x {n_params} (number of uncertain parameters)')
+    try:
+        return np.linalg.cholesky(correlation)
+    except np.linalg.LinAlgError:
+        raise Exception('Monte Carlo correlation matrix must be positive definite')
+
+
+def get_sample_variants(setup: Setup, cfg_dicts: list, samples: np.ndarray,
+                        techdata_indices: list = None):
+    """
+    Input variants with all uncertain parameters disturbed by the sampled number of standard
+    deviations. The techdata indices can be passed if they were already computed for the samples.
+    """
+    prices = get_sample_values(setup, cfg_dicts, samples, 'prices')
+    if techdata_indices is None:
+        techdata_indices = get_sample_techdata_indices(setup, cfg_dicts, samples)
+    return [
+        {
+            'prices': setup.prices if prices is None
+            else with_column(setup.prices, 'Price', prices[i]),
+            'techdata_index': techdata_indices[i],
+        }
+        for i in range(len(samples))
+    ]
+
+
+def get_sample_techdata_indices(setup: Setup, cfg_dicts: list, samples: np.ndarray):
+    values = get_sample_values(setup, cfg_dicts, samples, 'techdata')
+    if values is None:
+        return [setup.techdata_index] * len(samples)
+    positions = setup.techdata_positions()
+    return [fill_techdata_index(positions, v) for v in values]
+
+
+def get_sample_values(setup: Setup, cfg_dicts: list, samples: np.ndarray, data_frame: str):
+    """
+    Disturbed values of the prices or techdata df (sample x row),
+    or None if it has no uncertain parameters.
+    """
+    if any(cfg['data_frame'] not in ['prices', 'techdata'] for cfg in cfg_dicts):
+        raise KeyError('Invalid data_frame name in uncertainties config')
+    i_prms = [i for i, cfg in enumerate(cfg_dicts) if cfg['data_frame'] == data_frame]
+    if not i_prms:
+        return None
+    values = setup.prices['Price'] if data_frame == 'prices' else setup.techdata['Value']
+    std = np.stack([get_disturbance(setup, cfg_dicts[i]) for i in i_prms])
+    return values.values[None, :] + samples[:, i_prms] @ std
+
+
 def select_std_scenario(setup: Setup, std_scenario: float):
     std_df = choose_by_scenario(setup.abs_std_raw, std_scenario)
     std_df = years_to_rows(std_df, year_name="Period", value_name="StD")
@@ -76,27 +400,39 @@ def get_bounds(base: pd.DataFrame, variance: pd.DataFrame):
     return base
 
 
-def disturb_input(setup_disturbed: Setup, cfg_uct_prm: dict):
-    # get disturbed df
+def disturb_input(setup: Setup, cfg_uct_prm: dict):
+    """ Setup with the prices or techdata disturbed by one standard deviation """
+    std = get_disturbance(setup, cfg_uct_prm)
+    if cfg_uct_prm['data_frame'] == 'prices':
+        return setup.with_price_values(setup.prices['Price'].values + std)
+    else:
+        return setup.with_techdata_values(setup.techdata['Value'].values + std)
+
+
+def get_disturbance(setup: Setup, cfg_uct_prm: dict):
+    """
+    Standard deviation of an uncertain parameter for all rows of the prices or techdata df
+    (zero outside of the filtered rows).
+    """
     if cfg_uct_prm['data_frame'] == 'prices':
-        disturb_prices(setup_disturbed, cfg_uct_prm)
+        return get_price_std(setup, cfg_uct_prm)
     elif cfg_uct_prm['data_frame'] == 'techdata':
-        disturb_techdata(setup_disturbed, cfg_uct_prm)
+        return get_techdata_std(setup, cfg_uct_prm)
     else:
         raise KeyError('Invalid data_frame name in uncertainties config')
 
 
-def disturb_prices(setup_disturbed: Setup, cfg_uct_prm: dict):
+def get_price_std(setup: Setup, cfg_uct_prm: dict):
 
     if 'std_scenario' in cfg_uct_prm == 'std_value' in cfg_uct_prm:
         raise KeyError("Please specify 'std_scenario' xor 'std_value' for each price uncertainty")
 
-    prices = setup_disturbed.prices.copy()
+    prices = setup.prices
     rows = get_rows_by_filters(prices, cfg_uct_prm['filters'])
 
     prices_filtered = prices.loc[rows, ['Period', 'Price']]
     if 'std_scenario' in cfg_uct_prm:
-        std_scen = select_std_scenario(setup_disturbed, cfg_uct_prm['std_scenario'])
+        std_scen = select_std_scenario(setup, cfg_uct_prm['std_scenario'])
         std = prices_filtered.merge(std_scen, on='Period', how='left') \
             .set_index(prices_filtered.index)['StD']
     else:
@@ -105,16 +441,17 @@ def disturb_prices(setup_disturbed: Setup, cfg_uct_prm: dict):
     if cfg_uct_prm['is_relative']:
         std *= prices_filtered['Price']
 
-    prices.loc[rows, 'Price'] = prices.loc[rows, 'Price'] + std
-    setup_disturbed.prices = prices
+    std_all = np.zeros(len(prices))
+    std_all[rows.values] = std.values
+    return std_all
 
 
-def disturb_techdata(setup_disturbed: Setup, cfg_uct_prm: dict):
+def get_techdata_std(setup: Setup, cfg_uct_prm: dict):
 
     if 'std_value' not in cfg_uct_prm:
         raise KeyError("Please specify 'std_value' for each techdata uncertainty")
 
-    techdata = setup_disturbed.techdata.copy()
+    techdata = setup.techdata
     rows = get_rows_by_filters(techdata, cfg_uct_prm['filters'])
 
     techdata_filtered = techdata.loc[rows, 'Value']
@@ -123,8 +460,9 @@ def disturb_techdata(setup_disturbed: Setup, cfg_uct_prm: dict):
     if cfg_uct_prm['is_relative']:
         std *= techdata_filtered
 
-    techdata.loc[rows, 'Value'] = techdata.loc[rows, 'Value'] + std
-    setup_disturbed.techdata = techdata
+    std_all = np.zeros(len(techdata))
+    std_all[rows.values] = std.values
+    return std_all
 
 
 def get_rows_by_filters(df: pd.DataFrame, filters: dict):
@@ -0,0 +1,193 @@
+import contextlib
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from ..setup.setup import SelectionCache
+
+
+# Transport of a setup to worker processes via shared memory (config key 'shared_memory',
+# default True; see map_with_setup):
+# share_setup copies all numeric columns, numeric indices and numeric arrays of the data frames
+# in the setup (including techdata index, selection cache and input variants) once into a single
+# shared memory segment. It returns a small handle, in which these are replaced by references
+# into the segment, while strings and other objects are kept. attach_setup maps the segment into
+# a worker process and rebuilds the setup on read-only views of it, without copying.
+# The segment is unlinked when share_setup is left; Workers keep it mapped until detach_setup is
+# called or the process ends.
+
+ALIGNMENT = 64
+
+_attached = []
+
+
+class SharedArray():
+    """ Reference to an array in the shared memory segment """
+    def __init__(self, offset: int, dtype: np.dtype, shape: tuple):
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+
+
+class SharedIndex():
+    def __init__(self, values: SharedArray, name):
+        self.values = values
+        self.name = name
+
+
+class SharedSeries():
+    def __init__(self, values, index, name):
+        self.values = values
+        self.index = index
+        self.name = name
+
+
+class SharedFrame():
+    def __init__(self, columns: pd.Index, values: list, index):
+        self.columns = columns
+        self.values = values
+        self.index = index
+
+
+class SharedSetup():
+    """ Handle of a setup in shared memory; picklable and small """
+    def __init__(self, segment_name: str, setup_class: type, attributes: dict):
+        self.segment_name = segment_name
+        self.setup_class = setup_class
+        self.attributes = attributes
+
+
+@contextlib.contextmanager
+def share_setup(setup):
+    """
+    Context manager exporting the setup to shared memory; Yields the handle to pass to
+    attach_setup in the worker processes. The segment is unlinked on exit.
+    """
+    exporter = Exporter()
+    attributes = {name: exporter.export(value) for name, value in setup.__dict__.items()}
+    segment = shared_memory.SharedMemory(create=True, size=max(exporter.size, 1))
+    try:
+        for array, shared in exporter.arrays:
+            view_array(segment, shared, writeable=True)[...] = array
+        yield SharedSetup(segment.name, type(setup), attributes)
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def attach_setup(handle: SharedSetup):
+    """ The setup of the handle, with its numeric data as read-only views of shared memory """
+    # worker processes share the resource tracker of the exporting process, which unlinks the
+    # segment if the exporting process ends without leaving share_setup
+    segment = shared_memory.SharedMemory(name=handle.segment_name)
+    _attached.append(segment)
+
+    attacher = Attacher(segment)
+    setup = handle.setup_class.__new__(handle.setup_class)
+    # setups are frozen, so the attributes are set directly
+    setup.__dict__.update({name: attacher.attach(value)
+                           for name, value in handle.attributes.items()})
+    return setup
+
+
+def detach_setup():
+    """
+    Unmap all attached segments. All setups attached in this process (and frames sharing their
+    data) have to be deleted before.
+    """
+    while _attached:
+        _attached.pop().close()
+
+
+def view_array(segment: shared_memory.SharedMemory, shared: SharedArray,
+               writeable: bool = False):
+    array = np.ndarray(shared.shape, dtype=shared.dtype, buffer=segment.buf,
+                       offset=shared.offset)
+    array.flags.writeable = writeable
+    return array
+
+
+def is_shareable(values):
+    return isinstance(values, np.ndarray) and values.dtype.kind in 'biufc' and values.size > 0
+
+
+class Exporter():
+    """ Replaces numeric arrays by references into the segment, keeping shared objects shared """
+
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+        self.memo = {}
+
+    def export(self, obj):
+        if id(obj) not in self.memo:
+            # the object is kept in the memo, so that its id is not reused
+            self.memo[id(obj)] = (obj, self.export_new(obj))
+        return self.memo[id(obj)][1]
+
+    def export_new(self, obj):
+        if isinstance(obj, pd.DataFrame):
+            return SharedFrame(obj.columns,
+                               [self.export_values(obj.iloc[:, i].values)
+                                for i in range(obj.shape[1])],
+                               self.export_index(obj.index))
+        elif isinstance(obj, pd.Series):
+            return SharedSeries(self.export_values(obj.values), self.export_index(obj.index),
+                                obj.name)
+        elif isinstance(obj, np.ndarray):
+            return self.export_values(obj)
+        elif isinstance(obj, dict):
+            return {key: self.export(value) for key, value in obj.items()}
+        elif isinstance(obj, SelectionCache):
+            return SelectionCache(self.export(obj.copy().entries))
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(self.export(value) for value in obj)
+        return obj
+
+    def export_index(self, index: pd.Index):
+        if isinstance(index, (pd.RangeIndex, pd.MultiIndex)) or not is_shareable(index.values):
+            return index
+        return SharedIndex(self.export_values(index.values), index.name)
+
+    def export_values(self, values):
+        if not is_shareable(values):
+            return values
+        offset = -(-self.size // ALIGNMENT) * ALIGNMENT
+        shared = SharedArray(offset, values.dtype, values.shape)
+        self.arrays.append((values, shared))
+        self.size = offset + values.nbytes
+        return shared
+
+
+class Attacher():
+    """ Rebuilds exported objects on views of the segment, keeping shared objects shared """
+
+    def __init__(self, segment: shared_memory.SharedMemory):
+        self.segment = segment
+        self.memo = {}
+
+    def attach(self, obj):
+        if id(obj) not in self.memo:
+            self.memo[id(obj)] = (obj, self.attach_new(obj))
+        return self.memo[id(obj)][1]
+
+    def attach_new(self, obj):
+        if isinstance(obj, SharedArray):
+            return view_array(self.segment, obj)
+        elif isinstance(obj, SharedIndex):
+            return pd.Index(self.attach(obj.values), name=obj.name, copy=False)
+        elif isinstance(obj, SharedSeries):
+            return pd.Series(self.attach(obj.values), index=self.attach(obj.index),
+                             name=obj.name, copy=False)
+        elif isinstance(obj, SharedFrame):
+            # one block per column, so that pandas does not consolidate (copy) them
+            df = pd.DataFrame({i: self.attach(values) for i, values in enumerate(obj.values)},
+                              index=self.attach(obj.index), copy=False)
+            df.columns = obj.columns
+            return df
+        elif isinstance(obj, dict):
+            return {key: self.attach(value) for key, value in obj.items()}
+        elif isinstance(obj, SelectionCache):
+            return SelectionCache(self.attach(obj.entries))
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(self.attach(value) for value in obj)
+        return obj
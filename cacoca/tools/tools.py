@@ -9,4 +9,10 @@ def filter_df(projects: pd.DataFrame, filter_by: dict):
     for filter_column, filter_values in filter_by.items():
         query_str = " | ".join([f"`{filter_column}` == '{fv}'" for fv in filter_values])
         projects = projects.query(query_str)
-    return projects
\ No newline at end of file
+    return projects
+
+def with_column(df: pd.DataFrame, column: str, values):
+    """ Shallow copy of df with one column replaced; All other columns share their data with df """
+    df = df.copy(deep=False)
+    df[column] = values
+    return df
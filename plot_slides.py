@@ -1,20 +1,20 @@
 # %%
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
-setup, cost_and_em_actual = run(config_filepath='config/config_slides.yml')
+setup, cost_and_em_actual = run_pipeline(config_filepath='config/config_slides.yml')
 change_output_subdir_by_filename(setup.config, __file__)
 
 
 # %% SECTOR COMPARISON  ============================================================================
 
 from cacoca.output.plot_project_cost_time_curves import plot_project_cost_time_curves
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
 
 if 'cost_and_em_actual' not in globals():
-    setup, cost_and_em_actual = run(config_filepath='config/config_slides.yml')
+    setup, cost_and_em_actual = run_pipeline(config_filepath='config/config_slides.yml')
     change_output_subdir_by_filename(setup.config, __file__)
 
 project_names = [
@@ -29,7 +29,7 @@ plot_project_cost_time_curves(cost_and_em_actual, config=setup.config, print_nam
 
 import copy
 from cacoca.setup.read_input import read_config
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.output.plot_project_cost_time_curves import plot_project_cost_time_curves
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
@@ -40,7 +40,7 @@ if 'config' not in globals():
 
 config_all = copy.deepcopy(config)
 config_all['projects_file'] = 'config/projects.csv'
-setup_all, cost_and_em_all = run(config=config_all)
+setup_all, cost_and_em_all = run_pipeline(config=config_all)
 
 plot_project_cost_time_curves(cost_and_em_all, config=setup_all.config, print_name='all_projects',
                               color_by='Industry')
@@ -49,12 +49,12 @@ plot_project_cost_time_curves(cost_and_em_all, config=setup_all.config, print_na
 # %% STACKED BARS  =================================================================================
 
 from cacoca.output.plot_stacked_bars import plot_stacked_bars
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
 
 if 'cost_and_em_actual' not in globals():
-    setup, cost_and_em_actual = run(config_filepath='config/config_slides.yml')
+    setup, cost_and_em_actual = run_pipeline(config_filepath='config/config_slides.yml')
     change_output_subdir_by_filename(setup.config, __file__)
 
 project_names = [
@@ -103,12 +103,12 @@ plot_h2share_scenarios(setup, project_names, 'h2share', 'vary_h2share')
 # %% INFLUENCE OF H2 SHARE  ========================================================================
 
 from cacoca.output.plot_project_cost_time_curves import plot_project_cost_time_curves
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
 
 if 'cost_and_em_actual' not in globals():
-    setup, cost_and_em_actual = run(config_filepath='config/config_slides.yml')
+    setup, cost_and_em_actual = run_pipeline(config_filepath='config/config_slides.yml')
     change_output_subdir_by_filename(setup.config, __file__)
 
 project_names = [
@@ -122,13 +122,13 @@ plot_project_cost_time_curves(cost_and_em_actual, config=setup.config,
 # %% ABSOLUTE HYDROGEN DEMAND  =====================================================================
 
 from cacoca.output.plot_absolute_hydrogen_demand import plot_absolute_hydrogen_demand
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.calc.calc_derived_quantities import add_absolute_hydrogen_demand
 from cacoca.output.plot_tools import change_output_subdir_by_filename
 
 
 if 'cost_and_em_actual' not in globals():
-    setup, cost_and_em_actual = run(config_filepath='config/config_slides.yml')
+    setup, cost_and_em_actual = run_pipeline(config_filepath='config/config_slides.yml')
     change_output_subdir_by_filename(setup.config, __file__)
 
 cost_and_em_actual = add_absolute_hydrogen_demand(cost_and_em_actual, setup)
@@ -147,7 +147,7 @@ plot_absolute_hydrogen_demand(cost_and_em_actual, setup, project_names)
 # %% INFLUENCE OF UNCERTAINTIES  ===================================================================
 
 import copy
-from cacoca.run import run
+from cacoca.pipeline import run_pipeline
 from cacoca.setup.read_input import read_config
 from cacoca.output.plot_project_cost_time_curves import plot_project_cost_time_curves
 from cacoca.output.plot_tools import change_output_subdir_by_filename
@@ -211,7 +211,7 @@ for scen_name, uct_prms in sens_scenarios.items():
     config_sens = copy.deepcopy(config)
     config_sens['uncertain_parameters'] = [uct_prm_definitions[up] for up in uct_prms]
 
-    setup, cost_and_em_sens = run(config=config_sens)
+    setup, cost_and_em_sens = run_pipeline(config=config_sens)
 
     for h2name, project_name in project_names_dict.items():
         plot_project_cost_time_curves(cost_and_em_sens,